@@ -0,0 +1,70 @@
+"""Add daily results and user stats tables
+
+Revision ID: 1ea2469789dc
+Revises: e274eb160b5e
+Create Date: 2026-10-19 14:02:51.774310
+
+"""
+
+from collections.abc import Sequence
+from typing import Union
+
+import sqlalchemy as sa
+
+from alembic import op
+
+# revision identifiers, used by Alembic.
+revision: str = "1ea2469789dc"
+down_revision: Union[str, None] = "e274eb160b5e"
+branch_labels: Union[str, Sequence[str], None] = None
+depends_on: Union[str, Sequence[str], None] = None
+
+
+def upgrade() -> None:
+    op.create_table(
+        "daily_results",
+        sa.Column("id", sa.Integer(), autoincrement=True, nullable=False),
+        sa.Column("user_id", sa.Integer(), nullable=False),
+        sa.Column("run_date", sa.Date(), nullable=False),
+        sa.Column("overdue_count", sa.Integer(), nullable=False),
+        sa.Column("labelled_count", sa.Integer(), nullable=False),
+        sa.Column("streak", sa.Integer(), nullable=False),
+        sa.ForeignKeyConstraint(
+            ["user_id"],
+            ["users.id"],
+        ),
+        sa.PrimaryKeyConstraint("id"),
+        sa.UniqueConstraint("user_id", "run_date"),
+    )
+    op.create_index(
+        op.f("ix_daily_results_user_id"), "daily_results", ["user_id"], unique=False
+    )
+
+    op.create_table(
+        "user_stats",
+        sa.Column("id", sa.Integer(), autoincrement=True, nullable=False),
+        sa.Column("user_id", sa.Integer(), nullable=False),
+        sa.Column("streak", sa.Integer(), nullable=False),
+        sa.Column("best_streak", sa.Integer(), nullable=False),
+        sa.Column("completed_days", sa.Integer(), nullable=False),
+        sa.Column("recorded_days", sa.Integer(), nullable=False),
+        sa.Column("last_result_date", sa.Date(), nullable=False),
+        sa.Column("completion_rate_7", sa.Float(), nullable=False),
+        sa.Column("completion_rate_30", sa.Float(), nullable=False),
+        sa.ForeignKeyConstraint(
+            ["user_id"],
+            ["users.id"],
+        ),
+        sa.PrimaryKeyConstraint("id"),
+        sa.UniqueConstraint("user_id"),
+    )
+    op.create_index(
+        op.f("ix_user_stats_streak"), "user_stats", ["streak"], unique=False
+    )
+
+
+def downgrade() -> None:
+    op.drop_index(op.f("ix_user_stats_streak"), table_name="user_stats")
+    op.drop_table("user_stats")
+    op.drop_index(op.f("ix_daily_results_user_id"), table_name="daily_results")
+    op.drop_table("daily_results")
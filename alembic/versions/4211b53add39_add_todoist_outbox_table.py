@@ -0,0 +1,59 @@
+"""Add todoist outbox table
+
+Revision ID: 4211b53add39
+Revises: 6abb547f5e5b
+Create Date: 2026-10-19 18:12:40.118305
+
+"""
+
+from collections.abc import Sequence
+from typing import Union
+
+import sqlalchemy as sa
+
+from alembic import op
+
+# revision identifiers, used by Alembic.
+revision: str = "4211b53add39"
+down_revision: Union[str, None] = "6abb547f5e5b"
+branch_labels: Union[str, Sequence[str], None] = None
+depends_on: Union[str, Sequence[str], None] = None
+
+
+def upgrade() -> None:
+    op.create_table(
+        "todoist_outbox",
+        sa.Column("id", sa.Integer(), autoincrement=True, nullable=False),
+        sa.Column("uuid", sa.String(), nullable=False),
+        sa.Column("user_id", sa.Integer(), nullable=False),
+        sa.Column("task_id", sa.String(), nullable=False),
+        sa.Column("action", sa.String(), nullable=False),
+        sa.Column("label", sa.String(), nullable=False),
+        sa.Column("attempts", sa.Integer(), server_default="0", nullable=False),
+        sa.Column("next_attempt_at", sa.DateTime(), nullable=False),
+        sa.Column("last_error", sa.String(), nullable=True),
+        sa.Column("failed_at", sa.DateTime(), nullable=True),
+        sa.ForeignKeyConstraint(
+            ["user_id"],
+            ["users.id"],
+        ),
+        sa.PrimaryKeyConstraint("id"),
+        sa.UniqueConstraint("uuid"),
+    )
+    op.create_index(
+        op.f("ix_todoist_outbox_user_id"), "todoist_outbox", ["user_id"], unique=False
+    )
+    op.create_index(
+        op.f("ix_todoist_outbox_next_attempt_at"),
+        "todoist_outbox",
+        ["next_attempt_at"],
+        unique=False,
+    )
+
+
+def downgrade() -> None:
+    op.drop_index(
+        op.f("ix_todoist_outbox_next_attempt_at"), table_name="todoist_outbox"
+    )
+    op.drop_index(op.f("ix_todoist_outbox_user_id"), table_name="todoist_outbox")
+    op.drop_table("todoist_outbox")
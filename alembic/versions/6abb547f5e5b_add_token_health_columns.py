@@ -0,0 +1,40 @@
+"""Add token health columns
+
+Revision ID: 6abb547f5e5b
+Revises: 1ea2469789dc
+Create Date: 2026-10-19 15:26:18.940512
+
+"""
+
+from collections.abc import Sequence
+from typing import Union
+
+import sqlalchemy as sa
+
+from alembic import op
+
+# revision identifiers, used by Alembic.
+revision: str = "6abb547f5e5b"
+down_revision: Union[str, None] = "1ea2469789dc"
+branch_labels: Union[str, Sequence[str], None] = None
+depends_on: Union[str, Sequence[str], None] = None
+
+
+def upgrade() -> None:
+    with op.batch_alter_table("users") as batch_op:
+        batch_op.add_column(
+            sa.Column("token_invalid_since", sa.DateTime(), nullable=True)
+        )
+        batch_op.add_column(
+            sa.Column(
+                "token_failures", sa.Integer(), server_default="0", nullable=False
+            )
+        )
+        batch_op.add_column(sa.Column("token_next_check", sa.DateTime(), nullable=True))
+
+
+def downgrade() -> None:
+    with op.batch_alter_table("users") as batch_op:
+        batch_op.drop_column("token_next_check")
+        batch_op.drop_column("token_failures")
+        batch_op.drop_column("token_invalid_since")
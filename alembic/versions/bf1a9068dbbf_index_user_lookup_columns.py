@@ -0,0 +1,90 @@
+"""Index user lookup columns
+
+Revision ID: bf1a9068dbbf
+Revises: d27880372ee9
+Create Date: 2026-10-19 09:12:41.503118
+
+"""
+
+from collections.abc import Sequence
+from typing import Union
+
+import sqlalchemy as sa
+
+from alembic import op
+
+# revision identifiers, used by Alembic.
+revision: str = "bf1a9068dbbf"
+down_revision: Union[str, None] = "d27880372ee9"
+branch_labels: Union[str, Sequence[str], None] = None
+depends_on: Union[str, Sequence[str], None] = None
+
+
+def merge_duplicate_users(column: str) -> None:
+    # re-authorizing used to add a new row, the newest row has the current token
+    # so it is kept and picks up the discord link and score of the older rows
+    kept_ids = f"select max(id) from users group by {column}"  # noqa: S608
+
+    op.execute(
+        sa.text(
+            f"""
+            update users set discord_id = (
+                select max(duplicate.discord_id) from users duplicate
+                where duplicate.{column} = users.{column}
+            )
+            where discord_id is null and id in ({kept_ids} having count(*) > 1)
+            """  # noqa: S608
+        )
+    )
+    op.execute(
+        sa.text(
+            f"""
+            update scores set user_id = (
+                select max(kept.id) from users duplicate
+                join users kept on kept.{column} = duplicate.{column}
+                where duplicate.id = scores.user_id
+            )
+            where user_id in (select id from users) and user_id not in ({kept_ids})
+            """  # noqa: S608
+        )
+    )
+    op.execute(sa.text(f"delete from users where id not in ({kept_ids})"))  # noqa: S608
+
+
+def upgrade() -> None:
+    merge_duplicate_users("todoist_id")
+    merge_duplicate_users("email")
+
+    # a discord account can only be linked once, the newest link wins
+    op.execute(
+        sa.text(
+            """
+            update users set discord_id = null
+            where discord_id is not null and id not in (
+                select max(id) from users
+                where discord_id is not null group by discord_id
+            )
+            """
+        )
+    )
+
+    op.execute(
+        sa.text("delete from scores where user_id not in (select id from users)")
+    )
+    op.execute(
+        sa.text(
+            "delete from scores where id not in (select min(id) from scores group by user_id)"
+        )
+    )
+
+    op.create_index(op.f("ix_users_email"), "users", ["email"], unique=True)
+    op.create_index(op.f("ix_users_todoist_id"), "users", ["todoist_id"], unique=True)
+    op.create_index(op.f("ix_users_discord_id"), "users", ["discord_id"], unique=True)
+    op.create_index(op.f("ix_scores_user_id"), "scores", ["user_id"], unique=False)
+
+
+def downgrade() -> None:
+    op.drop_index(op.f("ix_scores_user_id"), table_name="scores")
+    op.drop_index(op.f("ix_users_discord_id"), table_name="users")
+    op.drop_index(op.f("ix_users_todoist_id"), table_name="users")
+    op.drop_index(op.f("ix_users_email"), table_name="users")
@@ -6,10 +6,12 @@ Create Date: 2024-09-27 20:24:14.431231
 
 """
 
+import logging
 from collections.abc import Sequence
 from typing import Union
 
 import sqlalchemy as sa
+from sqlalchemy.engine import Connection
 
 from alembic import op
 
@@ -19,9 +21,48 @@ down_revision: Union[str, None] = None
 branch_labels: Union[str, Sequence[str], None] = None
 depends_on: Union[str, Sequence[str], None] = None
 
+logger = logging.getLogger("alembic.migrations")
+
+BATCH_SIZE = 10_000
+# rowid is 64 bit signed
+MIN_ROWID = -(2**63)
+
+
+def copy_users(connection: Connection) -> None:
+    # INSERT ... SELECT in rowid ranges of BATCH_SIZE rows, no rows pass through
+    # python. kept in this file rather than using utils.Migrations so the
+    # upgrade can't change with the app code
+    upper_bound = sa.text(
+        "SELECT rowid FROM users WHERE rowid > :after"
+        " ORDER BY rowid LIMIT 1 OFFSET :offset"
+    )
+    last_rowid = sa.text("SELECT max(rowid) FROM users WHERE rowid > :after")
+    insert = sa.text(
+        "INSERT INTO _migration_users (email, discord_id, todoist_id, todoist_token)"
+        " SELECT email, discord_id, todoist_id, todoist_token FROM users"
+        " WHERE rowid > :after AND rowid <= :upper ORDER BY rowid"
+    )
+
+    copied = 0
+    after = MIN_ROWID
+    while True:
+        upper = connection.execute(
+            upper_bound, {"after": after, "offset": BATCH_SIZE - 1}
+        ).scalar()
+        if upper is None:
+            # the last batch is shorter than BATCH_SIZE
+            upper = connection.execute(last_rowid, {"after": after}).scalar()
+            if upper is None:
+                break
+        copied += connection.execute(insert, {"after": after, "upper": upper}).rowcount
+        after = upper
+    logger.info("copied %d users", copied)
+
 
 def upgrade() -> None:
-    migration_users_table = op.create_table(
+    # left behind when an earlier attempt was interrupted between batches
+    op.execute("DROP TABLE IF EXISTS _migration_users")
+    op.create_table(
         "_migration_users",
         sa.Column(
             "id", sa.Integer(), autoincrement=True, nullable=False, primary_key=True
@@ -32,11 +73,10 @@ def upgrade() -> None:
         sa.Column("todoist_token", sa.String(), nullable=False),
     )
 
-    connection = op.get_bind()
-    users = connection.execute(sa.text("select * from users")).fetchall()
-
-    users = [dict(user._mapping) for user in users]  # noqa: SLF001
-    op.bulk_insert(migration_users_table, users)
+    # the old table has no id column, rows are copied in rowid order so ids
+    # follow signup order. each batch commits on its own
+    with op.get_context().autocommit_block():
+        copy_users(op.get_bind())
 
     op.drop_table("users")
     op.rename_table("_migration_users", "users")
@@ -0,0 +1,43 @@
+"""Add pending signups table
+
+Revision ID: e274eb160b5e
+Revises: bf1a9068dbbf
+Create Date: 2026-10-19 11:37:05.218640
+
+"""
+
+from collections.abc import Sequence
+from typing import Union
+
+import sqlalchemy as sa
+
+from alembic import op
+
+# revision identifiers, used by Alembic.
+revision: str = "e274eb160b5e"
+down_revision: Union[str, None] = "bf1a9068dbbf"
+branch_labels: Union[str, Sequence[str], None] = None
+depends_on: Union[str, Sequence[str], None] = None
+
+
+def upgrade() -> None:
+    op.create_table(
+        "pending_signups",
+        sa.Column("id", sa.Integer(), autoincrement=True, nullable=False),
+        sa.Column("discord_id", sa.BigInteger(), nullable=False),
+        sa.Column("state", sa.String(), nullable=False),
+        sa.Column("email", sa.String(), nullable=True),
+        sa.Column("expires_at", sa.DateTime(), nullable=False),
+        sa.PrimaryKeyConstraint("id"),
+    )
+    op.create_index(
+        op.f("ix_pending_signups_discord_id"),
+        "pending_signups",
+        ["discord_id"],
+        unique=True,
+    )
+
+
+def downgrade() -> None:
+    op.drop_index(op.f("ix_pending_signups_discord_id"), table_name="pending_signups")
+    op.drop_table("pending_signups")
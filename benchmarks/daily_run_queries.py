@@ -0,0 +1,117 @@
+"""Compare the daily run's database access against the old per-row behaviour.
+
+run with `python -m benchmarks.daily_run_queries [user_count]`
+"""
+
+import sys
+import tempfile
+import time
+from collections.abc import Callable, Sequence
+from pathlib import Path
+
+from sqlalchemy import Engine, create_engine, event, insert, select
+from sqlalchemy.orm import Session, sessionmaker
+
+from utils.Database import Base, Score, User, get_users, update_streaks
+
+DEFAULT_USER_COUNT = 10_000
+
+
+def create_population(engine: Engine, user_count: int) -> None:
+    Base.metadata.create_all(engine)
+    with Session(engine) as session:
+        session.execute(
+            insert(User),
+            [
+                {
+                    "email": f"user{index}@example.com",
+                    "discord_id": 100_000 + index,
+                    "todoist_id": str(index),
+                    "todoist_token": f"token{index}",
+                }
+                for index in range(user_count)
+            ],
+        )
+        # every other user already has a score row so both the insert and update paths run
+        session.execute(
+            insert(Score),
+            [
+                {"user_id": user_id, "streak": 3}
+                for user_id in range(1, user_count + 1, 2)
+            ],
+        )
+        session.commit()
+
+
+def completed_all_tasks(user: User) -> bool:
+    return user.id % 3 != 0
+
+
+def legacy_run(session: Session) -> None:
+    users = session.execute(select(User)).scalars().all()
+    for user in users:
+        if not user.score:
+            user.score = Score(streak=0)
+        if completed_all_tasks(user):
+            user.score.streak += 1
+        else:
+            user.score.streak = 0
+    session.commit()
+
+
+def bulk_run(session: Session) -> None:
+    users = get_users(session)
+    completed: list[User] = []
+    shamed: list[User] = []
+    for user in users:
+        (completed if completed_all_tasks(user) else shamed).append(user)
+    update_streaks(session, completed, shamed)
+    session.commit()
+
+
+def streaks(engine: Engine) -> Sequence[tuple[int, int]]:
+    with Session(engine) as session:
+        return session.execute(
+            select(Score.user_id, Score.streak).order_by(Score.user_id)
+        ).all()
+
+
+def measure(
+    name: str, run: Callable[[Session], None], user_count: int, directory: Path
+) -> Sequence[tuple[int, int]]:
+    engine = create_engine(f"sqlite:///{directory / f'{name}.sqlite'}")
+    create_population(engine, user_count)
+
+    query_count = 0
+
+    def count_query(*_: object) -> None:
+        nonlocal query_count
+        query_count += 1
+
+    event.listen(engine, "before_cursor_execute", count_query)
+    session_maker = sessionmaker(bind=engine)
+
+    start = time.perf_counter()
+    with session_maker() as session:
+        run(session)
+    elapsed = time.perf_counter() - start
+
+    event.remove(engine, "before_cursor_execute", count_query)
+    sys.stdout.write(
+        f"{name:8} users: {user_count:6d} queries: {query_count:6d} time: {elapsed:8.3f}s\n"
+    )
+    return streaks(engine)
+
+
+def main() -> None:
+    user_count = int(sys.argv[1]) if len(sys.argv) > 1 else DEFAULT_USER_COUNT
+    with tempfile.TemporaryDirectory() as directory:
+        legacy = measure("legacy", legacy_run, user_count, Path(directory))
+        bulk = measure("bulk", bulk_run, user_count, Path(directory))
+
+    if legacy != bulk:
+        raise AssertionError("bulk streak update does not match legacy behaviour")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,163 @@
+"""Concurrent read/write stress test for the shared sqlite engine.
+
+Reader threads stand in for webhook lookups, writer threads and a second
+process stand in for the daily run and the other service writing the same file.
+
+run with `python -m benchmarks.db_stress [seconds]`
+"""
+
+import multiprocessing
+import statistics
+import sys
+import tempfile
+import threading
+import time
+from pathlib import Path
+
+from sqlalchemy import insert, update
+from sqlalchemy.exc import OperationalError
+from sqlalchemy.orm import sessionmaker
+
+from utils.Config import DatabaseConfig
+from utils.Database import (
+    Base,
+    Score,
+    User,
+    create_db_engine,
+    get_user_by_todoist_id,
+)
+
+USER_COUNT = 1_000
+READER_THREADS = 8
+WRITER_THREADS = 2
+DEFAULT_DURATION = 10.0
+
+
+def populate(db_path: Path) -> None:
+    engine = create_db_engine(db_path, DatabaseConfig())
+    Base.metadata.create_all(engine)
+    with sessionmaker(bind=engine)() as session:
+        session.execute(
+            insert(User),
+            [
+                {
+                    "email": f"user{index}@example.com",
+                    "discord_id": index,
+                    "todoist_id": str(index),
+                    "todoist_token": f"token{index}",
+                }
+                for index in range(USER_COUNT)
+            ],
+        )
+        session.execute(
+            insert(Score),
+            [{"user_id": user_id, "streak": 0} for user_id in range(1, USER_COUNT + 1)],
+        )
+        session.commit()
+    engine.dispose()
+
+
+def write_streaks(
+    session_maker: sessionmaker, deadline: float, writes: list[int], errors: list[str]
+) -> None:
+    while time.monotonic() < deadline:
+        try:
+            with session_maker() as session:
+                session.execute(update(Score).values(streak=Score.streak + 1))
+                session.commit()
+            writes.append(1)
+        except OperationalError as error:
+            errors.append(str(error.orig))
+
+
+def read_users(
+    session_maker: sessionmaker,
+    deadline: float,
+    latencies: list[float],
+    errors: list[str],
+) -> None:
+    index = 0
+    while time.monotonic() < deadline:
+        index = (index + 7) % USER_COUNT
+        start = time.perf_counter()
+        try:
+            with session_maker() as session:
+                get_user_by_todoist_id(session=session, todoist_id=str(index))
+            latencies.append(time.perf_counter() - start)
+        except OperationalError as error:
+            errors.append(str(error.orig))
+
+
+def other_process_writer(
+    db_path: Path, deadline: float, result: "multiprocessing.Queue[int]"
+) -> None:
+    engine = create_db_engine(db_path, DatabaseConfig())
+    writes: list[int] = []
+    errors: list[str] = []
+    write_streaks(sessionmaker(bind=engine), deadline, writes, errors)
+    result.put(len(writes))
+    result.put(len(errors))
+
+
+def main() -> None:
+    duration = float(sys.argv[1]) if len(sys.argv) > 1 else DEFAULT_DURATION
+
+    with tempfile.TemporaryDirectory() as directory:
+        db_path = Path(directory) / "database.sqlite"
+        populate(db_path)
+
+        engine = create_db_engine(db_path, DatabaseConfig())
+        session_maker = sessionmaker(bind=engine)
+        deadline = time.monotonic() + duration
+
+        latencies: list[float] = []
+        writes: list[int] = []
+        errors: list[str] = []
+
+        process_result: multiprocessing.Queue[int] = multiprocessing.Queue()
+        process = multiprocessing.Process(
+            target=other_process_writer, args=(db_path, deadline, process_result)
+        )
+        process.start()
+
+        threads = [
+            threading.Thread(
+                target=read_users, args=(session_maker, deadline, latencies, errors)
+            )
+            for _ in range(READER_THREADS)
+        ] + [
+            threading.Thread(
+                target=write_streaks, args=(session_maker, deadline, writes, errors)
+            )
+            for _ in range(WRITER_THREADS)
+        ]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+
+        process_writes = process_result.get()
+        process_errors = process_result.get()
+        process.join()
+        engine.dispose()
+
+    latencies.sort()
+    sys.stdout.write(
+        "\n".join(
+            [
+                f"reads: {len(latencies)} ({len(latencies) / duration:.0f}/s)",
+                f"read latency p50: {statistics.median(latencies) * 1000:.2f}ms"
+                f" p99: {latencies[int(len(latencies) * 0.99)] * 1000:.2f}ms",
+                f"writes: {len(writes)} this process, {process_writes} other process",
+                f"lock errors: {len(errors) + process_errors}",
+                "",
+            ]
+        )
+    )
+
+    if errors or process_errors:
+        raise AssertionError(f"Database errors under load: {errors[:5]}")
+
+
+if __name__ == "__main__":
+    main()
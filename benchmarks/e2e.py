@@ -0,0 +1,327 @@
+"""Run the daily readout, /shame or the label sweep end to end against local Todoist and Discord fakes.
+
+run with `python -m benchmarks.e2e --users 500 --latency 0.05`, see --help for the
+scenario options. pass --output to save the results as json for later comparison.
+exits 1 if the scenario raised, once the results are written.
+`--tracemalloc --outbox-rate 1000` also fails the run when the python heap peak
+per user goes over MEMORY_BUDGET_PER_USER, or the --memory-budget given. the peak
+includes the in-process fakes, their allocations are left out of the phase lists.
+benchmarks.memory_budget runs the readout with the budget always enforced
+"""
+
+import argparse
+import asyncio
+import json
+import logging
+import os
+import random
+import resource
+import sys
+import tempfile
+import time
+import tracemalloc
+from pathlib import Path
+from typing import Any
+
+from sqlalchemy import insert, select
+
+import shame_command
+import shame_script
+from benchmarks.fake_discord import (
+    FakeChannel,
+    FakeInteraction,
+    FakeMemberResolver,
+    FakeUser,
+)
+from benchmarks.fake_todoist import FakeTodoist, TodoistScenario
+from outbox import WriteState
+from reconcile import reconcile_shame_labels
+from todoist import rest, sync
+from utils import AsyncDatabase, Database
+from utils.Config import DatabaseConfig
+from utils.RunReport import TRACEMALLOC_FRAMES, exclude_from_traces, heap_peak
+
+CHANNEL_ID = 1
+# a 500 user readout peaks at about 28KB per user, fakes included
+MEMORY_BUDGET_PER_USER = 40_000
+SETTINGS = """
+[DISCORD]
+TOKEN = benchmark
+CHANNEL_ID = {channel_id}
+SERVER_ID = 1
+
+[SHAME_SCRIPT]
+READOUT_STYLE = {readout_style}
+
+[TODOIST_AUTH]
+CLIENT_ID = benchmark
+CLIENT_SECRET = benchmark
+REDIRECT_URI = http://127.0.0.1/auth
+TOKEN_URL = http://127.0.0.1/token
+APP_LINK = http://127.0.0.1/app
+
+[OUTBOX]
+CONCURRENCY = {outbox_concurrency}
+REQUESTS_PER_SECOND = {outbox_rate}
+
+[RECONCILE]
+CONCURRENCY = {outbox_concurrency}
+REQUESTS_PER_SECOND = {outbox_rate}
+"""
+
+
+def parse_args(argv: list[str] | None = None) -> argparse.Namespace:
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument(
+        "--scenario", choices=("readout", "shame", "reconcile"), default="readout"
+    )
+    parser.add_argument("--users", type=int, default=200)
+    parser.add_argument("--latency", type=float, default=0.0, help="todoist latency")
+    parser.add_argument("--jitter", type=float, default=0.0)
+    parser.add_argument("--rate-limit", type=float, default=0.0, help="429 ratio")
+    parser.add_argument("--revoked", type=float, default=0.0, help="401 ratio")
+    parser.add_argument("--tasks", default="poisson:3", help="task distribution")
+    parser.add_argument("--labelled", type=float, default=0.0)
+    parser.add_argument(
+        "--rescheduled", type=float, default=0.0, help="share of tasks not overdue"
+    )
+    parser.add_argument("--discord-latency", type=float, default=0.0)
+    parser.add_argument("--readout-style", choices=("table", "embed"), default="table")
+    parser.add_argument("--outbox-concurrency", type=int, default=4)
+    parser.add_argument("--outbox-rate", type=float, default=5.0, help="requests/s")
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument(
+        "--tracemalloc",
+        action="store_true",
+        help="also report python heap peak and memory per run phase",
+    )
+    parser.add_argument(
+        "--memory-budget",
+        type=int,
+        help="heap peak bytes per user to fail above, implies --tracemalloc",
+    )
+    parser.add_argument("--output", type=Path, help="write results as json")
+    parser.add_argument("--log-level", default="CRITICAL", help="bot log level")
+    return parser.parse_args(argv)
+
+
+def populate(db_path: Path, todoist: FakeTodoist, user_count: int, seed: int) -> int:
+    rng = random.Random(seed)  # noqa: S311
+    session_maker = Database.load_db(db_path, DatabaseConfig())
+    task_count = 0
+    with session_maker() as session:
+        session.execute(
+            insert(Database.User),
+            [
+                {
+                    "email": f"user{index}@example.com",
+                    "discord_id": index + 1,
+                    "todoist_id": str(index),
+                    "todoist_token": f"token{index}",
+                }
+                for index in range(user_count)
+            ],
+        )
+        user_ids = session.execute(select(Database.User.id)).scalars().all()
+        session.execute(
+            insert(Database.Score),
+            [
+                {"user_id": user_id, "streak": rng.randint(0, 30)}
+                for user_id in user_ids
+            ],
+        )
+        session.commit()
+    for index in range(user_count):
+        task_count += todoist.add_user(
+            f"token{index}", str(index), f"user{index}@example.com"
+        )
+    # the directory is loaded before the users exist
+    Database.load_db(db_path, DatabaseConfig())
+    return task_count
+
+
+async def run_readout(
+    _: argparse.Namespace, channel: FakeChannel, resolver: FakeMemberResolver
+) -> None:
+    shame_script.bot.get_channel = lambda _: channel  # pyright: ignore[reportAttributeAccessIssue]
+    shame_script.member_resolver = resolver  # pyright: ignore[reportAttributeAccessIssue]
+    outbox_worker = shame_script.outbox_worker
+    outbox_worker.start()
+    start = time.perf_counter()
+    await shame_script.fetch_and_send_tasks()
+    posted = time.perf_counter() - start
+    # label writes drain after the post, shutdown makes the final flush
+    await outbox_worker.shutdown(deadline=3600)
+    retrying = sum(
+        status.state == WriteState.retrying for status in outbox_worker.status.values()
+    )
+    sys.stdout.write(
+        f"readout posted after {posted:.2f}s, outbox drained after"
+        f" {time.perf_counter() - start:.2f}s ({retrying} users retrying,"
+        f" {await AsyncDatabase.count_pending_outbox()} writes left)\n"
+    )
+
+
+async def run_shame(
+    args: argparse.Namespace, channel: FakeChannel, _: FakeMemberResolver
+) -> None:
+    interaction = FakeInteraction(channel)
+    for index in range(args.users):
+        member = FakeUser(index + 1, f"member{index + 1}")
+        await shame_command.shame(interaction, member)  # pyright: ignore[reportArgumentType]
+
+
+async def run_reconcile(
+    _: argparse.Namespace, __: FakeChannel, ___: FakeMemberResolver
+) -> None:
+    outbox_worker = shame_script.outbox_worker
+    outbox_worker.start()
+    start = time.perf_counter()
+    result = await reconcile_shame_labels()
+    swept = time.perf_counter() - start
+    await outbox_worker.shutdown(deadline=3600)
+    sys.stdout.write(
+        f"sweep found {len(result.entries)} stale of {result.labelled} labels after"
+        f" {swept:.2f}s, removed by {time.perf_counter() - start:.2f}s"
+        f" ({await AsyncDatabase.count_pending_outbox()} writes left)\n"
+    )
+
+
+SCENARIOS = {"readout": run_readout, "shame": run_shame, "reconcile": run_reconcile}
+
+
+async def run(args: argparse.Namespace, directory: Path) -> dict[str, Any]:
+    todoist = FakeTodoist(
+        TodoistScenario(
+            latency=args.latency,
+            jitter=args.jitter,
+            rate_limit_ratio=args.rate_limit,
+            revoked_ratio=args.revoked,
+            task_distribution=args.tasks,
+            labelled_ratio=args.labelled,
+            rescheduled_ratio=args.rescheduled,
+            seed=args.seed,
+        )
+    )
+    task_count = populate(directory / "database.sqlite", todoist, args.users, args.seed)
+    await todoist.start()
+    rest.API_URL = todoist.rest_url
+    sync.SYNC_URL = todoist.sync_url
+
+    channel = FakeChannel(CHANNEL_ID, args.discord_latency)
+    resolver = FakeMemberResolver(args.discord_latency)
+    scenario = SCENARIOS[args.scenario]
+
+    # the fake servers' populations already exist, their responses are traced
+    tracing = args.tracemalloc or args.memory_budget is not None
+    if tracing:
+        exclude_from_traces("*/benchmarks/fake_*.py")
+        tracemalloc.start(TRACEMALLOC_FRAMES)
+    error = None
+    start = time.perf_counter()
+    try:
+        await scenario(args, channel, resolver)
+    except Exception as exception:
+        # the run is still reported, a 429 currently aborts the readout
+        error = f"{type(exception).__name__}: {exception}"
+    wall_time = time.perf_counter() - start
+    heap_peak_bytes = heap_peak() if tracing else None
+    tracemalloc.stop()
+    await todoist.close()
+
+    reports = sorted((directory / "log").glob("daily_run-*.json"))
+    return {
+        "scenario": args.scenario,
+        "users": args.users,
+        "tasks": task_count,
+        "wall_time": wall_time,
+        "throughput": args.users / wall_time,
+        "error": error,
+        "todoist_requests": dict(sorted(todoist.requests.items())),
+        "discord_messages": len(channel.sent_messages),
+        "discord_embeds": sum(len(message.embeds) for message in channel.sent_messages),
+        "discord_threads": len(channel.created_threads),
+        "member_lookups": resolver.lookups,
+        # ru_maxrss is in KiB on linux, it includes the fake server and population
+        "peak_rss_bytes": resource.getrusage(resource.RUSAGE_SELF).ru_maxrss * 1024,
+        "heap_peak_bytes": heap_peak_bytes,
+        "heap_peak_bytes_per_user": heap_peak_bytes and heap_peak_bytes / args.users,
+        "run_report": json.loads(reports[-1].read_text()) if reports else None,
+    }
+
+
+def write_summary(results: dict[str, Any]) -> None:
+    write = sys.stdout.write
+    write(
+        f"{results['scenario']}: {results['users']} users, {results['tasks']} tasks"
+        f" in {results['wall_time']:.2f}s ({results['throughput']:.1f} users/s)\n"
+    )
+    if results["error"]:
+        write(f"run failed: {results['error']}\n")
+
+    requests = results["todoist_requests"]
+    write(f"todoist requests: {sum(requests.values())}\n")
+    for request, count in requests.items():
+        write(f"  {request}: {count}\n")
+    write(
+        f"discord: {results['discord_messages']} messages,"
+        f" {results['discord_embeds']} embeds,"
+        f" {results['discord_threads']} threads,"
+        f" {results['member_lookups']} member lookups\n"
+    )
+    write(f"peak rss: {results['peak_rss_bytes'] / 2**20:.1f}MiB\n")
+    if results["heap_peak_bytes"] is not None:
+        write(
+            f"python heap peak, bot and fakes: {results['heap_peak_bytes'] / 2**20:.1f}MiB"
+            f" ({results['heap_peak_bytes_per_user']:.0f}B per user)\n"
+        )
+
+    if results["run_report"]:
+        for stage, timing in results["run_report"]["critical_path"].items():
+            write(f"  {stage:15} {timing['seconds']:8.3f}s {timing['share']:6.1%}\n")
+        for phase in results["run_report"].get("memory", {}).get("phases", []):
+            write(
+                f"  {phase['name']:15} peak {phase['peak_bytes'] / 2**20:7.2f}MiB"
+                f" retained {phase['retained_bytes'] / 2**20:7.2f}MiB\n"
+            )
+            for allocator in phase["top_allocators"][:3]:
+                write(
+                    f"    {allocator['size_bytes'] / 2**10:+9.1f}KiB"
+                    f" {allocator['location']}\n"
+                )
+
+
+def main(argv: list[str] | None = None) -> None:
+    args = parse_args(argv)
+    logging.basicConfig(level=args.log_level.upper())
+    with tempfile.TemporaryDirectory() as directory:
+        # settings.cfg and the log directory are read relative to the working directory
+        settings = SETTINGS.format(
+            channel_id=CHANNEL_ID,
+            readout_style=args.readout_style,
+            outbox_concurrency=args.outbox_concurrency,
+            outbox_rate=args.outbox_rate,
+        )
+        Path(directory, "settings.cfg").write_text(settings, encoding="utf-8")
+        working_directory = Path.cwd()
+        os.chdir(directory)
+        try:
+            results = asyncio.run(run(args, Path(directory)))
+        finally:
+            os.chdir(working_directory)
+
+    write_summary(results)
+    if args.output:
+        args.output.write_text(json.dumps(results, indent=2), encoding="utf-8")
+    if results["error"]:
+        sys.exit(1)
+    budget = args.memory_budget or MEMORY_BUDGET_PER_USER
+    if results["heap_peak_bytes"] is not None and (
+        results["heap_peak_bytes_per_user"] > budget
+    ):
+        sys.stdout.write(f"heap peak per user over the {budget}B budget\n")
+        sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()
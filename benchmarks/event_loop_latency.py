@@ -0,0 +1,93 @@
+"""Measure how long the event loop stalls while the daily run reads the database.
+
+run with `python -m benchmarks.event_loop_latency [user_count]`
+"""
+
+import asyncio
+import statistics
+import sys
+import tempfile
+import time
+from collections.abc import Awaitable, Callable
+from pathlib import Path
+
+from sqlalchemy import insert
+
+from utils import AsyncDatabase, Database
+from utils.Config import DatabaseConfig
+
+DEFAULT_USER_COUNT = 50_000
+HEARTBEAT_INTERVAL = 0.01
+ROUNDS = 5
+
+
+def populate(db_path: Path, user_count: int) -> None:
+    session_maker = Database.load_db(db_path, DatabaseConfig())
+    with session_maker() as session:
+        session.execute(
+            insert(Database.User),
+            [
+                {
+                    "email": f"user{index}@example.com",
+                    "discord_id": index,
+                    "todoist_id": str(index),
+                    "todoist_token": f"token{index}",
+                }
+                for index in range(user_count)
+            ],
+        )
+        session.commit()
+
+
+async def heartbeat(lags: list[float], stop: asyncio.Event) -> None:
+    # stands in for the gateway heartbeat, any overshoot is time the loop was blocked
+    while not stop.is_set():
+        start = time.perf_counter()
+        await asyncio.sleep(HEARTBEAT_INTERVAL)
+        lags.append(time.perf_counter() - start - HEARTBEAT_INTERVAL)
+
+
+async def blocking_get_users() -> None:  # noqa: RUF029
+    with Database.get_session() as session:
+        Database.get_users(session)
+
+
+async def executor_get_users() -> None:
+    await AsyncDatabase.get_users()
+
+
+async def measure(name: str, load: Callable[[], Awaitable[None]]) -> None:
+    lags: list[float] = []
+    stop = asyncio.Event()
+    beat = asyncio.create_task(heartbeat(lags, stop))
+
+    start = time.perf_counter()
+    for _ in range(ROUNDS):
+        await load()
+        await asyncio.sleep(0)
+    elapsed = time.perf_counter() - start
+
+    stop.set()
+    await beat
+
+    sys.stdout.write(
+        f"{name:9} time: {elapsed:6.2f}s heartbeats: {len(lags):4d}"
+        f" lag p50: {statistics.median(lags) * 1000:7.2f}ms"
+        f" max: {max(lags) * 1000:7.2f}ms\n"
+    )
+
+
+async def run() -> None:
+    await measure("blocking", blocking_get_users)
+    await measure("executor", executor_get_users)
+
+
+def main() -> None:
+    user_count = int(sys.argv[1]) if len(sys.argv) > 1 else DEFAULT_USER_COUNT
+    with tempfile.TemporaryDirectory() as directory:
+        populate(Path(directory) / "database.sqlite", user_count)
+        asyncio.run(run())
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,78 @@
+"""Stand-ins for the Discord objects the daily readout and commands talk to."""
+
+import asyncio
+import itertools
+from dataclasses import dataclass, field
+from typing import Any
+
+import discord
+
+from readout import EMBED_TOTAL_LIMIT, EMBEDS_PER_MESSAGE, MESSAGE_CONTENT_LIMIT
+
+
+@dataclass
+class FakeUser:
+    id: int
+    name: str
+
+    @property
+    def mention(self) -> str:
+        return f"<@{self.id}>"
+
+
+@dataclass
+class FakeMessage:
+    id: int
+    content: str
+    embeds: list[discord.Embed] = field(default_factory=list)
+
+
+class FakeChannel(discord.TextChannel):
+    # subclassed so the readout's isinstance check passes, no discord state is built
+    def __init__(self, channel_id: int = 1, latency: float = 0.0) -> None:
+        self.id = channel_id
+        self.latency = latency
+        self.message_ids = itertools.count(1)
+        self.sent_messages: list[FakeMessage] = []
+        self.created_threads: list[str] = []
+
+    async def send(  # pyright: ignore[reportIncompatibleMethodOverride]
+        self,
+        content: str | None = None,
+        embeds: list[discord.Embed] | None = None,
+        **_: Any,  # noqa: ANN401
+    ) -> FakeMessage:
+        await asyncio.sleep(self.latency)
+        embeds = embeds or []
+        # discord answers 400 bad request for messages over these limits
+        if (
+            len(content or "") > MESSAGE_CONTENT_LIMIT
+            or len(embeds) > EMBEDS_PER_MESSAGE
+            or sum(map(len, embeds)) > EMBED_TOTAL_LIMIT
+        ):
+            raise ValueError("Message exceeds discord limits")
+        message = FakeMessage(next(self.message_ids), content or "", embeds)
+        self.sent_messages.append(message)
+        return message
+
+    async def create_thread(self, *, name: str, **_: Any) -> None:  # pyright: ignore[reportIncompatibleMethodOverride]  # noqa: ANN401
+        await asyncio.sleep(self.latency)
+        self.created_threads.append(name)
+
+
+class FakeMemberResolver:
+    # replaces member_cache.MemberResolver, every lookup costs one discord round trip
+    def __init__(self, latency: float = 0.0) -> None:
+        self.latency = latency
+        self.lookups = 0
+
+    async def resolve(self, user_id: int) -> FakeUser:
+        self.lookups += 1
+        await asyncio.sleep(self.latency)
+        return FakeUser(user_id, f"member{user_id}")
+
+
+@dataclass
+class FakeInteraction:
+    # command replies land in the channel's sent messages
+    followup: FakeChannel
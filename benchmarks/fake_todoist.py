@@ -0,0 +1,286 @@
+"""Local stand-in for the Todoist REST and Sync APIs, used by the offline benchmarks.
+
+point `todoist.rest.API_URL` at `FakeTodoist.rest_url` once the server has started
+"""
+
+import asyncio
+import itertools
+import json
+import math
+import random
+import re
+from collections import Counter
+from collections.abc import Awaitable, Callable
+from dataclasses import dataclass
+from datetime import UTC, datetime, timedelta, timezone
+from http import HTTPStatus
+
+from aiohttp import web
+
+# filters are evaluated on labels only, every stored task matches overdue
+FILTER_LABEL = re.compile(r"(!\()?@([\w-]+)")
+RETRY_AFTER_SECONDS = 1
+
+Handler = Callable[[web.Request], Awaitable[web.StreamResponse]]
+
+
+@dataclass
+class TodoistScenario:
+    # seconds added to every response, plus up to `jitter` more
+    latency: float = 0.0
+    jitter: float = 0.0
+    # share of requests answered with 429 too many requests
+    rate_limit_ratio: float = 0.0
+    # share of tokens answered with 401, as if the app had been revoked
+    revoked_ratio: float = 0.0
+    # fixed:N, uniform:LOW:HIGH, poisson:MEAN or geometric:P
+    task_distribution: str = "poisson:3"
+    # share of generated tasks that already carry the shame label
+    labelled_ratio: float = 0.0
+    # share of generated tasks moved to a future due date, so they aren't overdue
+    rescheduled_ratio: float = 0.0
+    seed: int = 0
+
+
+def sample_task_count(distribution: str, rng: random.Random) -> int:
+    kind, _, argument = distribution.partition(":")
+    if kind == "fixed":
+        return int(argument)
+    if kind == "uniform":
+        low, high = argument.split(":")
+        return rng.randint(int(low), int(high))
+    if kind == "poisson":
+        # knuth's method, fine for the small means used here
+        limit = math.exp(-float(argument))
+        count, product = 0, rng.random()
+        while product > limit:
+            count += 1
+            product *= rng.random()
+        return count
+    if kind == "geometric":
+        probability = float(argument)
+        count = 0
+        while rng.random() > probability:
+            count += 1
+        return count
+    raise ValueError(f"Unknown task distribution: {distribution}")
+
+
+def make_due(task_id: int, due: datetime) -> dict:
+    # all-day, utc, fixed offset and floating dues, in turn
+    kind = task_id % 4
+    fields = {
+        "date": due.date().isoformat(),
+        "is_recurring": False,
+        "string": due.strftime("%b %d"),
+    }
+    if kind == 1:
+        fields["datetime"] = due.strftime("%Y-%m-%dT%H:%M:%S.%fZ")
+        fields["timezone"] = "UTC"
+    elif kind == 2:  # noqa: PLR2004
+        offset = timezone(timedelta(hours=5, minutes=30))
+        fields["datetime"] = due.astimezone(offset).isoformat()
+        fields["timezone"] = "Asia/Kolkata"
+    elif kind == 3:  # noqa: PLR2004
+        fields["datetime"] = due.replace(tzinfo=None).isoformat(timespec="seconds")
+    return fields
+
+
+def make_task(
+    task_id: int, user_id: str, labels: list[str], rescheduled: bool = False
+) -> dict:
+    offset = timedelta(days=task_id % 7 + 1)
+    due = datetime.now(UTC) + offset if rescheduled else datetime.now(UTC) - offset
+    return {
+        "assignee_id": None,
+        "assigner_id": None,
+        "comment_count": 0,
+        "is_completed": False,
+        "content": f"Synthetic task {task_id} with a reasonably long description",
+        "created_at": (due - timedelta(days=1)).isoformat(),
+        "creator_id": user_id,
+        "description": "",
+        "due": make_due(task_id, due),
+        "id": str(task_id),
+        "labels": labels,
+        "order": task_id,
+        "parent_id": None,
+        "priority": 1,
+        "project_id": "1",
+        "section_id": None,
+        "url": f"https://todoist.com/showTask?id={task_id}",
+        "duration": None,
+    }
+
+
+def matches_filter(task: dict, task_filter: str) -> bool:
+    labels = task["labels"]
+    for negated, label in FILTER_LABEL.findall(task_filter):
+        if bool(negated) == (label in labels):
+            return False
+    return True
+
+
+class FakeTodoist:
+    def __init__(self, scenario: TodoistScenario | None = None) -> None:
+        self.scenario = scenario or TodoistScenario()
+        self.rng = random.Random(self.scenario.seed)  # noqa: S311
+        self.task_ids = itertools.count(1)
+        self.label_ids = itertools.count(1)
+        # keyed by api token
+        self.user_ids: dict[str, str] = {}
+        self.emails: dict[str, str] = {}
+        self.tasks: dict[str, dict[str, dict]] = {}
+        self.labels: dict[str, list[dict]] = {}
+        self.revoked: set[str] = set()
+        # sync command uuids already applied, replays are acknowledged without effect
+        self.command_uuids: set[str] = set()
+        self.requests: Counter[str] = Counter()
+        self.rest_url = ""
+        self.sync_url = ""
+        self._runner: web.AppRunner | None = None
+
+        self.app = web.Application(middlewares=[self.middleware])
+        self.app.router.add_get("/rest/v2/tasks", self.get_tasks)
+        self.app.router.add_get("/rest/v2/tasks/{task_id}", self.get_task)
+        self.app.router.add_post("/rest/v2/tasks/{task_id}", self.update_task)
+        self.app.router.add_get("/rest/v2/labels", self.get_labels)
+        self.app.router.add_post("/rest/v2/labels", self.create_label)
+        self.app.router.add_post("/sync/v9/sync", self.sync)
+
+    def add_user(self, api_token: str, user_id: str, email: str) -> int:
+        self.user_ids[api_token] = user_id
+        self.emails[api_token] = email
+        self.labels[api_token] = []
+        if self.rng.random() < self.scenario.revoked_ratio:
+            self.revoked.add(api_token)
+
+        task_count = sample_task_count(self.scenario.task_distribution, self.rng)
+        tasks = {}
+        for _ in range(task_count):
+            task_id = next(self.task_ids)
+            labelled = self.rng.random() < self.scenario.labelled_ratio
+            rescheduled = self.rng.random() < self.scenario.rescheduled_ratio
+            tasks[str(task_id)] = make_task(
+                task_id, user_id, ["shame"] if labelled else [], rescheduled
+            )
+        self.tasks[api_token] = tasks
+        return task_count
+
+    async def start(self) -> None:
+        self._runner = web.AppRunner(self.app, access_log=None)
+        await self._runner.setup()
+        site = web.TCPSite(self._runner, "127.0.0.1", 0)
+        await site.start()
+        host, port = self._runner.addresses[0][:2]
+        self.rest_url = f"http://{host}:{port}/rest/v2/"
+        self.sync_url = f"http://{host}:{port}/sync/v9/sync"
+
+    async def close(self) -> None:
+        if self._runner is not None:
+            await self._runner.cleanup()
+
+    @web.middleware
+    async def middleware(
+        self, request: web.Request, handler: Handler
+    ) -> web.StreamResponse:
+        scenario = self.scenario
+        delay = scenario.latency + self.rng.uniform(0, scenario.jitter)
+        if delay:
+            await asyncio.sleep(delay)
+
+        token = request.headers.get("Authorization", "").removeprefix("Bearer ")
+        if self.rng.random() < scenario.rate_limit_ratio:
+            response: web.StreamResponse = web.Response(
+                status=HTTPStatus.TOO_MANY_REQUESTS,
+                headers={"Retry-After": str(RETRY_AFTER_SECONDS)},
+            )
+        elif token not in self.tasks or token in self.revoked:
+            response = web.Response(status=HTTPStatus.UNAUTHORIZED)
+        else:
+            response = await handler(request)
+
+        resource = request.match_info.route.resource
+        path = resource.canonical if resource is not None else request.path
+        self.requests[f"{request.method} {path} {response.status}"] += 1
+        return response
+
+    @staticmethod
+    def token(request: web.Request) -> str:
+        return request.headers["Authorization"].removeprefix("Bearer ")
+
+    async def get_tasks(self, request: web.Request) -> web.Response:
+        task_filter = request.query.get("filter", "")
+        tasks = self.tasks[self.token(request)]
+        if "ids" in request.query:
+            ids = request.query["ids"].split(",")
+            return web.json_response(
+                [tasks[task_id] for task_id in ids if task_id in tasks]
+            )
+        return web.json_response(
+            [task for task in tasks.values() if matches_filter(task, task_filter)]
+        )
+
+    async def get_task(self, request: web.Request) -> web.Response:
+        task = self.tasks[self.token(request)].get(request.match_info["task_id"])
+        if task is None:
+            return web.Response(status=HTTPStatus.NOT_FOUND)
+        return web.json_response(task)
+
+    async def update_task(self, request: web.Request) -> web.Response:
+        task = self.tasks[self.token(request)].get(request.match_info["task_id"])
+        if task is None:
+            return web.Response(status=HTTPStatus.NOT_FOUND)
+        data = await request.json()
+        if "labels" in data:
+            task["labels"] = list(data["labels"])
+        return web.json_response(task)
+
+    async def get_labels(self, request: web.Request) -> web.Response:
+        return web.json_response(self.labels[self.token(request)])
+
+    async def create_label(self, request: web.Request) -> web.Response:
+        data = await request.json()
+        label = {
+            "id": str(next(self.label_ids)),
+            "name": data["name"],
+            "color": "charcoal",
+            "order": 0,
+            "is_favorite": False,
+        }
+        self.labels[self.token(request)].append(label)
+        return web.json_response(label)
+
+    async def sync(self, request: web.Request) -> web.Response:
+        token = self.token(request)
+        form = await request.post()
+        resource_types = str(form.get("resource_types", "[]"))
+        response: dict = {"sync_token": "fake", "full_sync": True}
+        if "commands" in form:
+            response["sync_status"] = self.apply_commands(
+                token, json.loads(str(form["commands"]))
+            )
+        if "user" in resource_types or "all" in resource_types:
+            response["user"] = {"id": self.user_ids[token], "email": self.emails[token]}
+        if "items" in resource_types or "all" in resource_types:
+            response["items"] = list(self.tasks[token].values())
+        if "labels" in resource_types or "all" in resource_types:
+            response["labels"] = self.labels[token]
+        return web.json_response(response)
+
+    def apply_commands(self, token: str, commands: list[dict]) -> dict[str, object]:
+        # only item_update is supported, which is all the bot sends
+        status: dict[str, object] = {}
+        for command in commands:
+            command_uuid = command["uuid"]
+            task = self.tasks[token].get(command["args"]["id"])
+            if command["type"] != "item_update":
+                status[command_uuid] = {"error_code": 20, "error": "Unknown command"}
+            elif task is None:
+                status[command_uuid] = {"error_code": 22, "error": "Item not found"}
+            else:
+                if command_uuid not in self.command_uuids:
+                    task.update(command["args"])
+                    self.command_uuids.add(command_uuid)
+                status[command_uuid] = "ok"
+        return status
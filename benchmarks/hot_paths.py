@@ -0,0 +1,266 @@
+"""Time the pure per-user and per-task functions and compare them with the stored baseline.
+
+run with `python -m benchmarks.hot_paths`, it exits with 1 when a benchmark is more
+than --threshold slower than benchmarks/baselines/hot_paths.json. after an intended
+change, or on a new machine, rewrite the baseline with --update
+"""
+
+import argparse
+import asyncio
+import json
+import platform
+import random
+import sys
+import timeit
+from collections.abc import Callable
+from pathlib import Path
+
+import shame_script
+from benchmarks.fake_discord import FakeChannel
+from benchmarks.fake_todoist import make_task
+from readout import ReadoutUser, pack_readout
+from todoist.types import Filter, Label, Task
+from utils.Constants import OVERDUE, SHAME_LABEL
+
+BASELINE_PATH = Path(__file__).parent / "baselines" / "hot_paths.json"
+# run to run noise on shared vms is around 30%, pass a lower --threshold on a quiet machine
+DEFAULT_THRESHOLD = 0.5
+REPEATS = 5
+CONFIRM_RUNS = 2
+TASK_COUNTS = (1, 10, 1000, 10_000)
+
+WORDS = [
+    "review",
+    "quarterly",
+    "report",
+    "straße",
+    "café",
+    "naïve",
+    "日本語のテキスト",
+    "задача",
+    "🔥",
+    "✅",
+    "📅",
+    "ﬁnalise",
+    "mañana",
+    "résumé",
+]
+
+
+def synthetic_content(rng: random.Random) -> str:
+    # mostly short titles with a tail of very long ones, like real task lists
+    length = int(rng.paretovariate(1.5) * 4)
+    return " ".join(rng.choices(WORDS, k=min(length, 120)))
+
+
+def synthetic_task_json(count: int, seed: int = 0) -> list[dict]:
+    rng = random.Random(seed)  # noqa: S311
+    tasks = []
+    for index in range(count):
+        task = make_task(index, "1", [SHAME_LABEL] if index % 3 else [])
+        task["content"] = synthetic_content(rng)
+        task["due"]["string"] = rng.choice(
+            ["every weekday at 9am", "Mar 3", "every 2nd monday 📅", "tomorrow"]
+        )
+        tasks.append(task)
+    return tasks
+
+
+def synthetic_label_json(count: int) -> list[dict]:
+    return [
+        {
+            "id": str(index),
+            "name": f"label-{index}-ラベル",
+            "color": "charcoal",
+            "order": index,
+            "is_favorite": index % 2 == 0,
+        }
+        for index in range(count)
+    ]
+
+
+def calibration() -> None:
+    # fixed pure python workload, results are stored relative to it so the
+    # baseline roughly carries over between machines
+    sum(len(str(number)) for number in range(2000))
+
+
+def benchmarks() -> dict[str, Callable[[], object]]:
+    cases: dict[str, Callable[[], object]] = {
+        "filter_overdue": lambda: str(OVERDUE & ~Filter(label="exclude")),
+        "filter_chain_50": lambda: str(chain_filters(50)),
+    }
+
+    task_json = synthetic_task_json(max(TASK_COUNTS))
+    tasks = [Task(**task) for task in task_json]
+    contents = [task.content for task in tasks]
+    cases["string_shorten_10000"] = lambda: [
+        shame_script.string_shorten(content, shame_script.TASK_MAX_LENGTH)
+        for content in contents
+    ]
+
+    for count in TASK_COUNTS:
+        cases[f"task_parse_{count}"] = lambda count=count: [
+            Task(**task) for task in task_json[:count]
+        ]
+        cases[f"task_table_{count}"] = lambda count=count: (
+            shame_script.build_task_table(tasks[:count])
+        )
+
+    label_json = synthetic_label_json(1000)
+    cases["label_parse_1000"] = lambda: [Label(**label) for label in label_json]
+
+    # one readout line per user, a mix of completed users and task tables
+    tables = [
+        shame_script.build_task_table(tasks[index : index + 5])
+        for index in range(0, 50, 5)
+    ]
+    message_content = [
+        f"*Tasks for <@{index}> | Streak: 0*\n```\n{tables[index % 10]}\n```"
+        if index % 2
+        else f"**member{index}** Completed all tasks | Streak: {index % 30}"
+        for index in range(1000)
+    ]
+    readout = [
+        ReadoutUser(
+            f"user{index}@example.com",
+            f"member{index}",
+            f"<@{index}>",
+            index % 30,
+            tasks[index : index + index % 7] if index % 2 else [],
+        )
+        for index in range(1000)
+    ]
+    cases["pack_readout_1000_users"] = lambda: pack_readout("Readout", readout)
+
+    loop = asyncio.new_event_loop()
+    channel = FakeChannel()
+    cases["paginate_1000_users"] = lambda: loop.run_until_complete(
+        shame_script.paginate_message_send(channel, message_content)
+    )
+    return cases
+
+
+def chain_filters(count: int) -> Filter:
+    task_filter = OVERDUE
+    for index in range(count):
+        task_filter = (
+            task_filter & ~Filter(label=f"l{index}")
+            if index % 2
+            else task_filter | Filter(label=f"l{index}")
+        )
+    return task_filter
+
+
+def measure(function: Callable[[], object]) -> float:
+    # autorange picks a loop count that takes at least 0.2s, so short benchmarks
+    # aren't just timer noise, and the best of the repeats is kept
+    timer = timeit.Timer(function)
+    number, _ = timer.autorange()
+    return min(timer.repeat(repeat=REPEATS, number=number)) / number
+
+
+def relative_change(
+    name: str, results: dict[str, float], baseline: dict[str, float]
+) -> float:
+    # both sides are divided by their own calibration time before comparing
+    relative = results[name] / results["calibration"]
+    baseline_relative = baseline[name] / baseline["calibration"]
+    return relative / baseline_relative - 1
+
+
+def run(cases: dict[str, Callable[[], object]]) -> dict[str, float]:
+    # calibration is sampled around every benchmark so a noisy moment on the
+    # machine doesn't skew the comparison of everything else
+    calibrations = [measure(calibration)]
+    results = {}
+    for name, function in cases.items():
+        results[name] = measure(function)
+        calibrations.append(measure(calibration))
+    results["calibration"] = min(calibrations)
+    return results
+
+
+def confirm(
+    cases: dict[str, Callable[[], object]],
+    results: dict[str, float],
+    baseline: dict[str, float],
+    threshold: float,
+) -> None:
+    # anything over the threshold is measured again and keeps its best time, so
+    # only a slowdown that repeats fails the run
+    for _ in range(CONFIRM_RUNS):
+        suspects = [
+            name
+            for name in cases
+            if name in baseline and relative_change(name, results, baseline) > threshold
+        ]
+        for name in suspects:
+            results[name] = min(results[name], measure(cases[name]))
+
+
+def report(
+    results: dict[str, float], baseline: dict[str, float], threshold: float
+) -> list[str]:
+    regressions = []
+    write = sys.stdout.write
+    write(f"{'benchmark':24} {'time':>12} {'baseline':>12} {'change':>8}\n")
+    for name, seconds in results.items():
+        if name == "calibration":
+            continue
+        line = f"{name:24} {seconds * 1e6:10.1f}us"
+        if name in baseline:
+            change = relative_change(name, results, baseline)
+            line += f" {baseline[name] * 1e6:10.1f}us {change:+8.1%}"
+            if change > threshold:
+                regressions.append(name)
+                line += "  REGRESSION"
+        write(line + "\n")
+    return regressions
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument("--threshold", type=float, default=DEFAULT_THRESHOLD)
+    parser.add_argument("--update", action="store_true", help="rewrite the baseline")
+    parser.add_argument("--only", help="run benchmarks whose name contains this")
+    args = parser.parse_args()
+
+    cases = {
+        name: function
+        for name, function in benchmarks().items()
+        if not args.only or args.only in name
+    }
+    results = run(cases)
+
+    if args.update:
+        # the baseline keeps the best of a few runs, like confirm does for regressions
+        for _ in range(CONFIRM_RUNS):
+            for name, seconds in run(cases).items():
+                results[name] = min(results[name], seconds)
+        BASELINE_PATH.parent.mkdir(parents=True, exist_ok=True)
+        BASELINE_PATH.write_text(
+            json.dumps(
+                {"python": platform.python_version(), "results": results}, indent=2
+            )
+            + "\n",
+            encoding="utf-8",
+        )
+        sys.stdout.write(f"Baseline written to {BASELINE_PATH}\n")
+        return
+
+    baseline = {}
+    if BASELINE_PATH.exists():
+        baseline = json.loads(BASELINE_PATH.read_text(encoding="utf-8"))["results"]
+    confirm(cases, results, baseline, args.threshold)
+    regressions = report(results, baseline, args.threshold)
+    if regressions:
+        sys.stdout.write(
+            f"{len(regressions)} benchmark(s) regressed by more than"
+            f" {args.threshold:.0%}: {', '.join(regressions)}\n"
+        )
+        sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,109 @@
+"""Measure time spent in the caller while logging traced requests.
+
+`direct` is the file and console handlers on the root logger, as before the
+queue listener. `queue` is the stdlib QueueHandler, which formats the full line
+in the caller, and `deferred` is log_setup's DeferredQueueHandler. `info` is the
+deferred handler with the logger at INFO, where the DEBUG records are dropped
+before a record is made. Exits 1 if a record shows an argument changed after the
+logging call.
+
+run with `python -m benchmarks.log_handler [request_count]`
+"""
+
+import io
+import logging
+import queue
+import sys
+import tempfile
+import time
+from collections.abc import Callable
+from logging.handlers import QueueHandler, QueueListener
+from pathlib import Path
+
+from yarl import URL
+
+from log_setup import DATE_FORMAT, LOG_FORMAT, ColorFormatter, DeferredQueueHandler
+
+DEFAULT_REQUEST_COUNT = 1000
+ROUNDS = 5
+
+
+def create_handlers(log_path: Path) -> list[logging.Handler]:
+    file_handler = logging.FileHandler(log_path)
+    file_handler.setFormatter(logging.Formatter(LOG_FORMAT, DATE_FORMAT, style="{"))
+    # a console that isn't a terminal, so only formatting and the write are timed
+    stream_handler = logging.StreamHandler(io.StringIO())
+    stream_handler.setFormatter(ColorFormatter())
+    return [file_handler, stream_handler]
+
+
+def log_requests(logger: logging.Logger, request_count: int) -> None:
+    # the two DEBUG records the aiohttp trace hooks write for every request
+    for index in range(request_count):
+        url = URL(f"https://api.todoist.com/rest/v2/tasks/{index}")
+        logger.debug("Request Started: %s %s", "GET", url)
+        logger.debug("Response Received: %s %d", url, 200)
+
+
+def measure(
+    name: str,
+    create_handler: Callable[[queue.SimpleQueue], logging.Handler] | None,
+    request_count: int,
+    level: int = logging.DEBUG,
+) -> bool:
+    logger = logging.getLogger(f"benchmark.{name}")
+    logger.setLevel(level)
+    logger.propagate = False
+    timings = []
+    with tempfile.TemporaryDirectory() as directory:
+        log_path = Path(directory) / "benchmark.log"
+        handlers = create_handlers(log_path)
+        listener = None
+        if create_handler is None:
+            for handler in handlers:
+                logger.addHandler(handler)
+        else:
+            log_queue: queue.SimpleQueue[logging.LogRecord] = queue.SimpleQueue()
+            listener = QueueListener(log_queue, *handlers)
+            listener.start()
+            logger.addHandler(create_handler(log_queue))
+
+        for _ in range(ROUNDS):
+            start = time.perf_counter()
+            log_requests(logger, request_count)
+            timings.append(time.perf_counter() - start)
+
+        # the log has to show the argument as it was when the call was made
+        members = ["before"]
+        logger.info("Members: %s", members)
+        members.append("after")
+
+        if listener is not None:
+            listener.stop()
+        for handler in [*logger.handlers, *handlers]:
+            handler.close()
+        logger.handlers.clear()
+        snapshotted = "Members: ['before']" in log_path.read_text(encoding="utf-8")
+
+    sys.stdout.write(
+        f"{name:8} requests: {request_count:6d}"
+        f" caller: {min(timings) * 1000:8.2f}ms (best of {ROUNDS})"
+        f" args snapshotted: {snapshotted}\n"
+    )
+    return snapshotted
+
+
+def main() -> None:
+    request_count = int(sys.argv[1]) if len(sys.argv) > 1 else DEFAULT_REQUEST_COUNT
+    results = [
+        measure("direct", None, request_count),
+        measure("queue", QueueHandler, request_count),
+        measure("deferred", DeferredQueueHandler, request_count),
+        measure("info", DeferredQueueHandler, request_count, logging.INFO),
+    ]
+    if not all(results):
+        sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,121 @@
+"""Compare member cache memory for a synthetic large guild.
+
+`default` is discord.py's member cache after startup chunking, `linked` is
+MemberResolver holding only signed up members.
+
+run with `python -m benchmarks.member_cache_memory [member_count] [linked_count]`
+"""
+
+import gc
+import sys
+import time
+import tracemalloc
+from collections.abc import Callable
+
+import discord
+from discord.ext import commands
+
+from member_cache import MemberResolver
+
+DEFAULT_MEMBER_COUNT = 100_000
+DEFAULT_LINKED_COUNT = 500
+FIRST_MEMBER_ID = 10**17
+
+
+def create_bot(member_cache_flags: discord.MemberCacheFlags) -> commands.Bot:
+    intents = discord.Intents.default()
+    intents.members = True
+    return commands.Bot(
+        intents=intents,
+        command_prefix="!",
+        member_cache_flags=member_cache_flags,
+        chunk_guilds_at_startup=False,
+    )
+
+
+def create_guild(bot: commands.Bot) -> discord.Guild:
+    return discord.Guild(
+        data={  # pyright: ignore[reportArgumentType]
+            "id": 1,
+            "name": "guild",
+            "roles": [],
+            "emojis": [],
+            "features": [],
+            "member_count": 0,
+        },
+        state=bot._connection,  # noqa: SLF001
+    )
+
+
+def create_member(
+    bot: commands.Bot, guild: discord.Guild, index: int
+) -> discord.Member:
+    return discord.Member(
+        data={  # pyright: ignore[reportArgumentType]
+            "user": {
+                "id": FIRST_MEMBER_ID + index,
+                "username": f"member{index}",
+                "discriminator": "0",
+                "avatar": None,
+                "global_name": f"Member {index}",
+            },
+            "roles": [],
+            "joined_at": None,
+            "deaf": False,
+            "mute": False,
+            "flags": 0,
+        },
+        guild=guild,
+        state=bot._connection,  # noqa: SLF001
+    )
+
+
+def default_cache(member_count: int, _: int) -> object:
+    bot = create_bot(discord.MemberCacheFlags.all())
+    guild = create_guild(bot)
+    for index in range(member_count):
+        guild._add_member(create_member(bot, guild, index))  # noqa: SLF001
+    return guild
+
+
+def linked_cache(_: int, linked_count: int) -> object:
+    bot = create_bot(discord.MemberCacheFlags.none())
+    guild = create_guild(bot)
+    resolver = MemberResolver(bot)
+    for index in range(linked_count):
+        resolver.store(create_member(bot, guild, index), linked=True)
+    return resolver
+
+
+def measure(
+    name: str,
+    build: Callable[[int, int], object],
+    member_count: int,
+    linked_count: int,
+) -> None:
+    gc.collect()
+    tracemalloc.start()
+    start = time.perf_counter()
+    cache = build(member_count, linked_count)
+    elapsed = time.perf_counter() - start
+    current, peak = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+
+    sys.stdout.write(
+        f"{name:8} members: {member_count:7d} linked: {linked_count:5d}"
+        f" retained: {current / 1024 / 1024:7.2f}MiB peak: {peak / 1024 / 1024:7.2f}MiB"
+        f" build: {elapsed:6.2f}s\n"
+    )
+    del cache
+
+
+def main() -> None:
+    member_count = int(sys.argv[1]) if len(sys.argv) > 1 else DEFAULT_MEMBER_COUNT
+    linked_count = int(sys.argv[2]) if len(sys.argv) > 2 else DEFAULT_LINKED_COUNT  # noqa: PLR2004
+
+    measure("default", default_cache, member_count, linked_count)
+    measure("linked", linked_cache, member_count, linked_count)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,23 @@
+"""Fail when the daily readout's python heap peak per user goes over budget.
+
+Runs the benchmarks.e2e readout with tracemalloc always on, so the budget is
+checked even without --tracemalloc. other e2e options are passed through, e.g.
+`--users 1000 --memory-budget 30000`.
+
+run with `python -m benchmarks.memory_budget [e2e options]`
+"""
+
+import sys
+
+from benchmarks import e2e
+
+# a fast outbox keeps the run short, tracing slows every allocation
+ARGUMENTS = ["--scenario", "readout", "--tracemalloc", "--outbox-rate", "1000"]
+
+
+def main() -> None:
+    e2e.main([*ARGUMENTS, *sys.argv[1:]])
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,149 @@
+"""Copy a synthetic legacy users table with the streaming migration helpers.
+
+`naive` is the old d27880372ee9 upgrade, fetchall and one bulk insert. `copy` is
+utils.Migrations.copy_rows and `transform` is transform_rows. Peak memory is the
+python heap from tracemalloc, the lock window is the longest write transaction.
+Exits 1 if a copy loses rows or a streaming helper goes over MEMORY_BUDGET.
+
+run with `python -m benchmarks.migrations [row_count] [--skip-naive]`
+"""
+
+import gc
+import sys
+import tempfile
+import time
+import tracemalloc
+from collections.abc import Callable, Mapping
+from pathlib import Path
+from typing import Any
+
+import sqlalchemy as sa
+from sqlalchemy.engine import Connection, Engine, RowMapping
+
+from utils.Migrations import copy_rows, transform_rows
+
+DEFAULT_ROW_COUNT = 1_000_000
+# the streaming helpers hold one batch at a time whatever the table size
+MEMORY_BUDGET = 32 * 1024 * 1024
+COLUMNS = ["email", "discord_id", "todoist_id", "todoist_token"]
+
+metadata = sa.MetaData()
+target_table = sa.Table(
+    "_migration_users",
+    metadata,
+    sa.Column("id", sa.Integer(), primary_key=True, autoincrement=True),
+    sa.Column("email", sa.String(), nullable=False),
+    sa.Column("discord_id", sa.BigInteger(), nullable=True),
+    sa.Column("todoist_id", sa.String(), nullable=False),
+    sa.Column("todoist_token", sa.String(), nullable=False),
+)
+
+
+def create_legacy_table(engine: Engine, row_count: int) -> None:
+    # same shape as the users table before d27880372ee9, no id column
+    with engine.begin() as connection:
+        connection.execute(
+            sa.text(
+                "CREATE TABLE users (email VARCHAR NOT NULL, discord_id BIGINT,"
+                " todoist_id VARCHAR NOT NULL, todoist_token VARCHAR NOT NULL)"
+            )
+        )
+        connection.execute(
+            sa.text(
+                "WITH RECURSIVE n(i) AS (SELECT 1 WHERE :row_count > 0 UNION ALL SELECT i + 1 FROM n"
+                " WHERE i < :row_count)"
+                " INSERT INTO users SELECT 'user' || i || '@example.com',"
+                " 100000000000000000 + i, 'todoist' || i, hex(randomblob(20)) FROM n"
+            ),
+            {"row_count": row_count},
+        )
+
+
+def naive(engine: Engine) -> float:
+    # alembic ran the whole upgrade in one transaction
+    with engine.begin() as connection:
+        users = connection.execute(sa.text("select * from users")).fetchall()
+        users = [dict(user._mapping) for user in users]  # noqa: SLF001
+        started = time.perf_counter()
+        connection.execute(sa.insert(target_table), users)
+    # the write lock is held from the first insert until the commit
+    return time.perf_counter() - started
+
+
+def autocommit(engine: Engine) -> Connection:
+    # as inside alembic's autocommit_block, each batch commits on its own
+    return engine.connect().execution_options(isolation_level="AUTOCOMMIT")
+
+
+def copy(engine: Engine) -> float:
+    with autocommit(engine) as connection:
+        return copy_rows(connection, "users", target_table.name, COLUMNS).longest_batch
+
+
+def lowercase_email(row: RowMapping) -> Mapping[str, Any]:
+    return {**row, "email": row["email"].lower()}
+
+
+def transform(engine: Engine) -> float:
+    with autocommit(engine) as connection:
+        return transform_rows(
+            connection, "users", target_table, COLUMNS, lowercase_email
+        ).longest_batch
+
+
+def measure(name: str, migrate: Callable[[Engine], float], row_count: int) -> bool:
+    with tempfile.TemporaryDirectory() as directory:
+        engine = sa.create_engine(f"sqlite:///{Path(directory) / 'migration.db'}")
+        create_legacy_table(engine, row_count)
+        metadata.create_all(engine)
+
+        gc.collect()
+        tracemalloc.start()
+        start = time.perf_counter()
+        lock_window = migrate(engine)
+        elapsed = time.perf_counter() - start
+        _, peak = tracemalloc.get_traced_memory()
+        tracemalloc.stop()
+        with engine.connect() as connection:
+            copied, mismatched = connection.execute(
+                sa.text(
+                    "SELECT count(*), sum(t.todoist_id != u.todoist_id)"
+                    " FROM _migration_users t JOIN users u ON u.rowid = t.id"
+                )
+            ).one()
+        engine.dispose()
+
+    sys.stdout.write(
+        f"{name:9} rows: {copied:8d} peak: {peak / 1024 / 1024:8.2f}MiB"
+        f" time: {elapsed:6.2f}s lock window: {lock_window:6.3f}s\n"
+    )
+    ok = copied == row_count and not mismatched
+    if not ok:
+        sys.stdout.write(f"{name}: copied {copied} of {row_count} rows\n")
+    if name != "naive" and peak > MEMORY_BUDGET:
+        sys.stdout.write(
+            f"{name}: peak {peak / 1024 / 1024:.2f}MiB"
+            f" over the {MEMORY_BUDGET / 1024 / 1024:.0f}MiB budget\n"
+        )
+        ok = False
+    return ok
+
+
+def main() -> None:
+    arguments = [argument for argument in sys.argv[1:] if argument != "--skip-naive"]
+    row_count = int(arguments[0]) if arguments else DEFAULT_ROW_COUNT
+
+    cases: list[tuple[str, Callable[[Engine], float]]] = [
+        ("copy", copy),
+        ("transform", transform),
+    ]
+    if "--skip-naive" not in sys.argv:
+        cases.insert(0, ("naive", naive))
+
+    results = [measure(name, migrate, row_count) for name, migrate in cases]
+    if not all(results):
+        sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()
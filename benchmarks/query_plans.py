@@ -0,0 +1,111 @@
+"""Check that the user lookup helpers are answered from an index.
+
+The database is a legacy users table upgraded with `alembic upgrade head`, so
+the plans are checked against the indexes the migrations build rather than the
+ones the models declare.
+
+run with `python -m benchmarks.query_plans`
+"""
+
+import sys
+import tempfile
+from collections.abc import Callable
+from pathlib import Path
+
+from alembic.config import Config
+from sqlalchemy import Engine, create_engine, event
+from sqlalchemy.orm import Session
+
+from alembic import command
+from benchmarks.migrations import create_legacy_table
+from utils.Database import (
+    discord_id_exists,
+    get_user_by_discord_id,
+    get_user_by_email,
+    get_user_by_todoist_id,
+    get_users,
+)
+
+USER_COUNT = 1000
+# values of the first user create_legacy_table writes
+DISCORD_ID = 100000000000000001
+EMAIL = "user1@example.com"
+TODOIST_ID = "todoist1"
+
+LOOKUPS: dict[str, Callable[[Session], object]] = {
+    "get_user_by_discord_id": lambda session: get_user_by_discord_id(
+        session=session, discord_id=DISCORD_ID
+    ),
+    "discord_id_exists": lambda session: discord_id_exists(
+        session=session, discord_id=DISCORD_ID
+    ),
+    "get_user_by_email": lambda session: get_user_by_email(
+        session=session, email=EMAIL
+    ),
+    "get_user_by_todoist_id": lambda session: get_user_by_todoist_id(
+        session=session, todoist_id=TODOIST_ID
+    ),
+    # the second statement is the eager load of scores by user_id
+    "get_users": get_users,
+}
+
+
+def upgrade(url: str) -> None:
+    alembic_config = Config("alembic.ini")
+    alembic_config.set_main_option("sqlalchemy.url", url)
+    command.upgrade(alembic_config, "head")
+
+
+def check_plans(engine: Engine) -> list[str]:
+    failures: list[str] = []
+    for name, lookup in LOOKUPS.items():
+        statements: list[tuple[str, tuple]] = []
+
+        def capture(
+            _conn: object,
+            _cursor: object,
+            statement: str,
+            parameters: tuple,
+            *_: object,
+            statements: list[tuple[str, tuple]] = statements,
+        ) -> None:
+            statements.append((statement, parameters))
+
+        event.listen(engine, "before_cursor_execute", capture)
+        with Session(engine) as session:
+            lookup(session)
+        event.remove(engine, "before_cursor_execute", capture)
+
+        with engine.connect() as connection:
+            for statement, parameters in statements:
+                plan = " ".join(
+                    row[-1]
+                    for row in connection.exec_driver_sql(
+                        f"EXPLAIN QUERY PLAN {statement}", parameters
+                    )
+                )
+                # get_users reads every user on purpose, only the score load must be indexed
+                uses_index = "USING" in plan and "INDEX" in plan
+                if name == "get_users" and "FROM users" in statement:
+                    uses_index = True
+                sys.stdout.write(f"{name:24} {plan}\n")
+                if not uses_index:
+                    failures.append(name)
+    return failures
+
+
+def main() -> None:
+    with tempfile.TemporaryDirectory() as directory:
+        url = f"sqlite:///{Path(directory) / 'query_plans.db'}"
+        engine = create_engine(url)
+        create_legacy_table(engine, USER_COUNT)
+        upgrade(url)
+        failures = check_plans(engine)
+        engine.dispose()
+
+    if failures:
+        raise AssertionError(f"Lookups without an index: {', '.join(failures)}")
+
+
+if __name__ == "__main__":
+    main()
@@ -1,52 +1,51 @@
-import asyncio
 import logging
 import re
-from typing import Callable, Optional
+from datetime import timedelta
 
 import discord
-from discord.ext import commands
-from sqlalchemy.orm import Session
+from discord.ext import commands, tasks
 
-from utils.Config import load_config
-from utils.Database import (
-    EmailClaimedError,
+from utils.AsyncDatabase import (
     add_discord_to_user,
+    delete_pending_signup,
     discord_id_exists,
-    get_session,
+    get_pending_signup,
+    get_pending_signup_by_email,
+    get_pending_signups,
+    refresh_cached_user,
+    save_pending_signup,
 )
+from utils.Config import load_config
+from utils.Database import EmailClaimedError, PendingSignup, SignupState, utc_now
+from utils.SignupNotifier import start_notification_server
 
 logger = logging.getLogger(__name__)
 
 ONE_MINUTE = 60
-SIGNUP_TIMEOUT = ONE_MINUTE * 10
+SIGNUP_TIMEOUT = timedelta(minutes=10)
+AUTHORIZATION_TIMEOUT = timedelta(minutes=10)
 EMAIL_REGEX = re.compile(r"[\w.+-]+@[\w-]+\.[\w.-]+")
 
 
 async def signup(
-    interaction: discord.Interaction, user_to_signup: discord.Member, bot: commands.Bot
+    interaction: discord.Interaction, user_to_signup: discord.Member
 ) -> None:
-    with get_session() as session:
-        if discord_id_exists(session=session, discord_id=user_to_signup.id):
-            await interaction.followup.send(
-                f"User {user_to_signup.mention} already signed up"
-            )
-            return
-        await interaction.followup.send(f"Sent {user_to_signup.mention} dm to register")
-        await add_user(session, user_to_signup, bot)
-
-
-def create_message_filter(
-    user: discord.Member, dm_channel: discord.DMChannel
-) -> Callable[[discord.Message], bool]:
-    def message_filter(message: discord.Message) -> bool:
-        return message.channel == dm_channel and message.author == user
-
-    return message_filter
+    if await discord_id_exists(discord_id=user_to_signup.id):
+        await interaction.followup.send(
+            f"User {user_to_signup.mention} already signed up"
+        )
+        return
 
+    # the rest of the signup is driven by dm replies, see handle_signup_message
+    await save_pending_signup(
+        discord_id=user_to_signup.id,
+        state=SignupState.awaiting_email,
+        email=None,
+        expires_at=utc_now() + SIGNUP_TIMEOUT,
+    )
+    await interaction.followup.send(f"Sent {user_to_signup.mention} dm to register")
 
-async def get_user_email(
-    user: discord.Member, dm_channel: discord.DMChannel, bot: commands.Bot
-) -> Optional[str]:
+    dm_channel = await user_to_signup.create_dm()
     await dm_channel.send(
         "\n".join(
             [
@@ -57,98 +56,149 @@ async def get_user_email(
         )
     )
 
-    while True:
-        try:
-            reply = (
-                await bot.wait_for(
-                    "message",
-                    check=create_message_filter(user, dm_channel),
-                    timeout=SIGNUP_TIMEOUT,
-                )
-            ).content
 
-        except asyncio.TimeoutError:
-            await dm_channel.send("User signup timed out, please try again later")
-            return None
+async def handle_signup_message(message: discord.Message) -> None:
+    if not isinstance(message.channel, discord.DMChannel) or message.author.bot:
+        return
+
+    pending_signup = await get_pending_signup(discord_id=message.author.id)
+    if pending_signup is None:
+        return
+
+    dm_channel = message.channel
+    user = message.author
 
-        if reply == "q":
-            await dm_channel.send("User signup cancelled")
-            return None
+    if pending_signup.expires_at <= utc_now():
+        await expire_signup(pending_signup, dm_channel)
+        return
+
+    if message.content == "q":
+        await delete_pending_signup(discord_id=user.id)
+        await dm_channel.send("User signup cancelled")
+        return
+
+    if pending_signup.state == SignupState.awaiting_email:
+        email = await parse_email(message.content, dm_channel)
+        if email:
+            logger.info("received email- user: %s, email: %s", user.name, email)
+            await request_authorization(user, dm_channel, email)
+
+    elif pending_signup.state == SignupState.awaiting_authorization:
+        assert pending_signup.email is not None
+        await check_email_registration(user, dm_channel, pending_signup.email)
+
+
+async def parse_email(reply: str, dm_channel: discord.DMChannel) -> str | None:
+    email_list = re.findall(EMAIL_REGEX, reply)
 
-        email_list = re.findall(EMAIL_REGEX, reply)
+    if len(email_list) == 0:
+        await dm_channel.send("No valid email provided, please try again")
+        return None
 
-        if len(email_list) == 0:
-            await dm_channel.send("No valid email provided, please try again")
+    if len(email_list) > 1:
+        await dm_channel.send("Please provide only one email address")
+        return None
 
-        elif len(email_list) > 1:
-            await dm_channel.send("Please provide only one email address")
+    return email_list[0]
 
-        else:
-            return email_list[0]
+
+async def request_authorization(
+    user: discord.abc.User, dm_channel: discord.DMChannel, email: str
+) -> None:
+    if await check_email_registration(user, dm_channel, email):
+        return
+
+    await save_pending_signup(
+        discord_id=user.id,
+        state=SignupState.awaiting_authorization,
+        email=email,
+        expires_at=utc_now() + AUTHORIZATION_TIMEOUT,
+    )
+    await dm_channel.send(
+        "\n".join(
+            [
+                "Please add the app to todoist and authorize it with the link in settings",
+                f"{load_config().todoist.app_link}",
+            ]
+        )
+    )
 
 
 async def check_email_registration(
-    session: Session, user: discord.Member, dm_channel: discord.DMChannel, email: str
+    user: discord.abc.User, dm_channel: discord.DMChannel, email: str
 ) -> bool:
     try:
-        if not add_discord_to_user(session, email, user.id):
+        if not await add_discord_to_user(email, user.id):
             return False
     except EmailClaimedError:
+        await delete_pending_signup(discord_id=user.id)
         await dm_channel.send(
             "This email is already registered, please try with another email"
         )
+        return True
 
+    await delete_pending_signup(discord_id=user.id)
     await dm_channel.send("Todoist Linking complete!")
     logger.info("added user- user: %s, email: %s", user.name, email)
     return True
 
 
-async def add_user(session: Session, user: discord.Member, bot: commands.Bot) -> None:
-    dm_channel = await user.create_dm()
+async def expire_signup(
+    pending_signup: PendingSignup, dm_channel: discord.DMChannel
+) -> None:
+    await delete_pending_signup(discord_id=pending_signup.discord_id)
+    if pending_signup.state == SignupState.awaiting_email:
+        await dm_channel.send("User signup timed out, please try again later")
+    else:
+        await dm_channel.send(
+            "No authorization found for given email, please try again later"
+        )
 
-    email = await get_user_email(user, dm_channel, bot)
 
-    if not email:
+async def handle_authorization(bot: commands.Bot, email: str) -> None:
+    # sent by the /auth handler as soon as the todoist account is stored
+    await refresh_cached_user(email=email)
+    pending_signup = await get_pending_signup_by_email(email=email)
+    if (
+        pending_signup is None
+        or pending_signup.state != SignupState.awaiting_authorization
+    ):
         return
 
-    logger.info("received email- user: %s, email: %s", user.name, email)
+    user = await bot.fetch_user(pending_signup.discord_id)
+    await check_email_registration(user, await user.create_dm(), email)
+
+
+async def check_pending_signup(
+    bot: commands.Bot, pending_signup: PendingSignup
+) -> None:
+    user = await bot.fetch_user(pending_signup.discord_id)
+    dm_channel = await user.create_dm()
 
-    if await check_email_registration(session, user, dm_channel, email):
+    # last look in case the authorization notification was missed
+    if (
+        pending_signup.state == SignupState.awaiting_authorization
+        and pending_signup.email is not None
+        and await check_email_registration(user, dm_channel, pending_signup.email)
+    ):
         return
 
-    await dm_channel.send(
-        "\n".join(
-            [
-                "Please add the app to todoist and authorize it with the link in settings",
-                f"{load_config().todoist.app_link}",
-            ]
-        )
-    )
+    await expire_signup(pending_signup, dm_channel)
 
-    for _ in range(10):
-        # wait up to 10 minutes for user to add app
 
+@tasks.loop(seconds=ONE_MINUTE)
+async def expire_pending_signups(bot: commands.Bot) -> None:
+    now = utc_now()
+    for pending_signup in await get_pending_signups():
+        if pending_signup.expires_at > now:
+            continue
         try:
-            reply = (
-                await bot.wait_for(
-                    "message",
-                    check=create_message_filter(user, dm_channel),
-                    timeout=ONE_MINUTE,
-                )
-            ).content
-
-        except asyncio.TimeoutError:
-            # check for updated config every minute
-            pass
-
-        else:
-            if reply == "q":
-                await dm_channel.send("User signup cancelled")
-                return
-
-        if await check_email_registration(session, user, dm_channel, email):
-            return
+            await check_pending_signup(bot, pending_signup)
+        except Exception:
+            logger.exception("Error checking signup for %d", pending_signup.discord_id)
 
-    await dm_channel.send(
-        "No authorization found for given email, please try again later"
-    )
+
+async def start_signup_listeners(bot: commands.Bot) -> None:
+    if not expire_pending_signups.is_running():
+        expire_pending_signups.start(bot)
+    await start_notification_server(lambda email: handle_authorization(bot, email))
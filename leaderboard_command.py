@@ -0,0 +1,32 @@
+import logging
+
+import discord
+
+from utils.AsyncDatabase import get_leaderboard
+
+logger = logging.getLogger(__name__)
+
+LEADERBOARD_SIZE = 10
+
+
+# Discord bot command to show the current streak leaders
+async def leaderboard(interaction: discord.Interaction) -> None:
+    # rollups are maintained by the daily run, this never scans daily_results
+    leaders = await get_leaderboard(limit=LEADERBOARD_SIZE)
+
+    if not leaders:
+        await interaction.followup.send("No results recorded yet!")
+        return
+
+    lines = ["**Leaderboard**"]
+    for place, stats in enumerate(leaders, start=1):
+        name = f"<@{stats.user.discord_id}>" if stats.user.discord_id else "unlinked"
+        lines.append(
+            f"{place}. {name} | Streak: {stats.streak} | Best: {stats.best_streak}"
+            f" | 7 days: {stats.completion_rate_7:.0%}"
+            f" | 30 days: {stats.completion_rate_30:.0%}"
+        )
+
+    await interaction.followup.send(
+        "\n".join(lines), allowed_mentions=discord.AllowedMentions.none()
+    )
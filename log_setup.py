@@ -1,11 +1,22 @@
+import atexit
+import copy
 import logging
+import queue
+import re
+import time
 from http import HTTPStatus
-from logging.handlers import TimedRotatingFileHandler
+from logging.handlers import QueueHandler, QueueListener, TimedRotatingFileHandler
 from pathlib import Path
-from typing import ClassVar
+from types import SimpleNamespace
+from typing import TYPE_CHECKING, ClassVar
 
 import aiohttp
 
+from utils.Metrics import Counter, Histogram
+
+if TYPE_CHECKING:
+    from yarl import URL
+
 LOG_FORMAT = (
     "{asctime} - {name:15.15} - {levelname:8} - {message} ({filename}:{lineno})"
 )
@@ -27,21 +38,55 @@ class ColorFormatter(logging.Formatter):
         logging.CRITICAL: bold_red + LOG_FORMAT + reset,
     }
 
+    def __init__(self) -> None:
+        super().__init__(fmt=LOG_FORMAT, datefmt=DATE_FORMAT, style="{")
+        # formatters are built once rather than for every record
+        self.formatters = {
+            level: logging.Formatter(fmt=log_fmt, datefmt=DATE_FORMAT, style="{")
+            for level, log_fmt in self.FORMATS.items()
+        }
+
     def format(self, record: logging.LogRecord) -> str:
-        log_fmt = self.FORMATS.get(record.levelno)
-        formatter = logging.Formatter(fmt=log_fmt, datefmt=DATE_FORMAT, style="{")
+        formatter = self.formatters.get(record.levelno)
+        if formatter is None:
+            return super().format(record)
         return formatter.format(record)
 
 
-def log_setup() -> None:
+class DeferredQueueHandler(QueueHandler):
+    # only used for tracebacks, the listener's handlers format the full line
+    exception_formatter = logging.Formatter()
+
+    def prepare(self, record: logging.LogRecord) -> logging.LogRecord:
+        # the message and traceback are rendered in the caller, so later changes
+        # to mutable args don't reach the log and no frames are kept alive for
+        # the listener. timestamps, padding and colour are left to the listener
+        record = copy.copy(record)
+        record.msg = record.getMessage()
+        record.args = None
+        if record.exc_info:
+            record.exc_text = self.exception_formatter.formatException(record.exc_info)
+            record.exc_info = None
+        return record
+
+
+_listener: QueueListener | None = None
+_stream_handler: logging.StreamHandler | None = None
+
+
+def log_setup(console_level: int = logging.INFO) -> None:
+    global _listener, _stream_handler  # noqa: PLW0603
+    if _listener is not None:
+        return
+
     # Create log directory if it doesn't exist
     log_directory = "log"
-    if not Path(log_directory).exists:
-        Path(log_directory).mkdir(parents=True)
+    Path(log_directory).mkdir(parents=True, exist_ok=True)
 
     # change the behavior of the root logger so all other loggers inherit this behavior
+    # the root level is the lowest handler level so disabled records are dropped early
     root_logger = logging.getLogger()
-    root_logger.setLevel(logging.DEBUG)
+    root_logger.setLevel(min(logging.INFO, console_level))
 
     # Set up handlers (applies to all loggers unless overridden)
     log_file_path = Path(log_directory) / "shamebot.log"
@@ -52,25 +97,89 @@ def log_setup() -> None:
     file_handler.setFormatter(logging.Formatter(LOG_FORMAT, DATE_FORMAT, style="{"))
 
     stream_handler = logging.StreamHandler()
-    stream_handler.setLevel(logging.DEBUG)
-    stream_handler.setFormatter(ColorFormatter(style="{"))
+    stream_handler.setLevel(console_level)
+    stream_handler.setFormatter(ColorFormatter())
+    _stream_handler = stream_handler
+
+    # disk and console writes happen on the listener thread, never on the event loop
+    log_queue: queue.SimpleQueue[logging.LogRecord] = queue.SimpleQueue()
+    _listener = QueueListener(
+        log_queue, file_handler, stream_handler, respect_handler_level=True
+    )
+    _listener.start()
+    atexit.register(_listener.stop)
 
-    # Add handlers to the root logger
-    root_logger.addHandler(file_handler)
-    root_logger.addHandler(stream_handler)
+    root_logger.addHandler(DeferredQueueHandler(log_queue))
 
 
 request_logger = logging.getLogger("aiohttp")
 trace_config = aiohttp.TraceConfig()
 
+# ids are collapsed so each api endpoint is a single label value
+ID_SEGMENT = re.compile(r"/\d+(?=/|$)")
+
+request_duration = Histogram(
+    "http_client_request_duration_seconds",
+    "Time from sending a request until its response headers arrive",
+    ("method", "endpoint"),
+)
+responses = Counter(
+    "http_client_responses_total",
+    "Responses received, by status code",
+    ("method", "endpoint", "status"),
+)
+request_exceptions = Counter(
+    "http_client_request_exceptions_total",
+    "Requests that raised before a response was received",
+    ("method", "endpoint"),
+)
+connections = Counter(
+    "http_client_connections_total",
+    "Connections used for requests, by whether a pooled connection was reused",
+    ("reused",),
+)
+dns_duration = Histogram(
+    "http_client_dns_resolve_duration_seconds",
+    "Time spent resolving hostnames that were not in the dns cache",
+    ("host",),
+)
+dns_cache = Counter(
+    "http_client_dns_cache_total",
+    "Hostname lookups, by whether aiohttp's dns cache answered them",
+    ("result",),
+)
+connect_duration = Histogram(
+    "http_client_connect_duration_seconds",
+    "Time to open a new connection, including the tcp and tls handshakes",
+)
+
+
+def endpoint_label(url: "URL") -> str:
+    return f"{url.host}{ID_SEGMENT.sub('/{id}', url.path)}"
+
 
-async def on_request_start(_, __, params: aiohttp.TraceRequestStartParams) -> None:  # noqa: RUF029
+async def on_request_start(  # noqa: RUF029
+    _, context: SimpleNamespace, params: aiohttp.TraceRequestStartParams
+) -> None:
+    context.request_start = time.perf_counter()
     request_logger.debug(
         "Request Started: %s %s", params.method, params.url, stacklevel=6
     )
 
 
-async def on_request_end(_, __, params: aiohttp.TraceRequestEndParams) -> None:  # noqa: RUF029
+async def on_request_end(  # noqa: RUF029
+    _, context: SimpleNamespace, params: aiohttp.TraceRequestEndParams
+) -> None:
+    endpoint = endpoint_label(params.url)
+    request_duration.observe(
+        time.perf_counter() - context.request_start,
+        method=params.method,
+        endpoint=endpoint,
+    )
+    responses.inc(
+        method=params.method, endpoint=endpoint, status=str(params.response.status)
+    )
+
     if params.response.status >= HTTPStatus.SERVICE_UNAVAILABLE:
         request_logger.error(
             "Request Error: %s %d",
@@ -90,9 +199,55 @@ async def on_request_end(_, __, params: aiohttp.TraceRequestEndParams) -> None:
 async def on_request_exception(  # noqa: RUF029
     _, __, params: aiohttp.TraceRequestExceptionParams
 ) -> None:
+    request_exceptions.inc(method=params.method, endpoint=endpoint_label(params.url))
     request_logger.error("Request Exception: %s", params.exception, stacklevel=6)
 
 
+async def on_connection_create_start(_, context: SimpleNamespace, __) -> None:  # noqa: RUF029
+    context.connect_start = time.perf_counter()
+
+
+async def on_connection_create_end(_, context: SimpleNamespace, __) -> None:  # noqa: RUF029
+    connect_duration.observe(time.perf_counter() - context.connect_start)
+    connections.inc(reused="false")
+
+
+async def on_connection_reuseconn(_, __, ___) -> None:  # noqa: RUF029
+    connections.inc(reused="true")
+
+
+async def on_dns_resolvehost_start(_, context: SimpleNamespace, __) -> None:  # noqa: RUF029
+    context.dns_start = time.perf_counter()
+
+
+async def on_dns_resolvehost_end(  # noqa: RUF029
+    _, context: SimpleNamespace, params: aiohttp.TraceDnsResolveHostEndParams
+) -> None:
+    dns_duration.observe(time.perf_counter() - context.dns_start, host=params.host)
+
+
+async def on_dns_cache_hit(_, __, ___) -> None:  # noqa: RUF029
+    dns_cache.inc(result="hit")
+
+
+async def on_dns_cache_miss(_, __, ___) -> None:  # noqa: RUF029
+    dns_cache.inc(result="miss")
+
+
 trace_config.on_request_start.append(on_request_start)
 trace_config.on_request_end.append(on_request_end)
 trace_config.on_request_exception.append(on_request_exception)
+trace_config.on_connection_create_start.append(on_connection_create_start)
+trace_config.on_connection_create_end.append(on_connection_create_end)
+trace_config.on_connection_reuseconn.append(on_connection_reuseconn)
+trace_config.on_dns_resolvehost_start.append(on_dns_resolvehost_start)
+trace_config.on_dns_resolvehost_end.append(on_dns_resolvehost_end)
+trace_config.on_dns_cache_hit.append(on_dns_cache_hit)
+trace_config.on_dns_cache_miss.append(on_dns_cache_miss)
+
+
+def set_console_level(console_level: int) -> None:
+    # applied when the config is reloaded, the file handler stays at INFO
+    logging.getLogger().setLevel(min(logging.INFO, console_level))
+    if _stream_handler is not None:
+        _stream_handler.setLevel(console_level)
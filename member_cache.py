@@ -0,0 +1,102 @@
+import logging
+from collections import OrderedDict
+from enum import StrEnum
+
+import discord
+from discord.ext import commands
+
+from utils.Config import load_config
+from utils.UserDirectory import user_directory
+
+logger = logging.getLogger(__name__)
+
+QUERY_MEMBERS_LIMIT = 100
+RECENT_MEMBER_LIMIT = 256
+
+
+class MemberCacheMode(StrEnum):
+    # only members linked in users.discord_id are kept, everyone else is looked up on demand
+    linked = "linked"
+    # every guild member is loaded once at startup, as discord.py chunking used to do
+    full = "full"
+
+
+class MemberResolver:
+    def __init__(
+        self, bot: commands.Bot, recent_limit: int = RECENT_MEMBER_LIMIT
+    ) -> None:
+        self.bot = bot
+        self.recent_limit = recent_limit
+        self.linked: dict[int, discord.abc.User] = {}
+        # bounded lru for members that aren't signed up
+        self.recent: OrderedDict[int, discord.abc.User] = OrderedDict()
+        self.preloaded = False
+        self.hits = 0
+        self.misses = 0
+
+    def __len__(self) -> int:
+        return len(self.linked) + len(self.recent)
+
+    def store(self, member: discord.abc.User, linked: bool = False) -> None:
+        if linked or user_directory.is_linked(member.id):
+            self.linked[member.id] = member
+            self.recent.pop(member.id, None)
+            return
+
+        self.recent[member.id] = member
+        self.recent.move_to_end(member.id)
+        while len(self.recent) > self.recent_limit:
+            self.recent.popitem(last=False)
+
+    def clear(self) -> None:
+        self.linked.clear()
+        self.recent.clear()
+        self.preloaded = False
+
+    def get(self, user_id: int) -> discord.abc.User | None:
+        member = self.linked.get(user_id)
+        if member is None:
+            member = self.recent.get(user_id)
+            if member is not None:
+                self.recent.move_to_end(user_id)
+        return member
+
+    async def preload(self) -> None:
+        guild = self.bot.get_guild(load_config().discord.server_id)
+        if guild is None:
+            logger.warning("Guild not found, member cache not preloaded")
+            return
+
+        if load_config().discord.member_cache == MemberCacheMode.full:
+            for member in await guild.chunk(cache=False):
+                self.store(member, linked=True)
+        else:
+            linked_ids = user_directory.linked_discord_ids()
+            for start in range(0, len(linked_ids), QUERY_MEMBERS_LIMIT):
+                batch = linked_ids[start : start + QUERY_MEMBERS_LIMIT]
+                for member in await guild.query_members(
+                    user_ids=batch, limit=len(batch), cache=False
+                ):
+                    self.store(member, linked=True)
+
+        self.preloaded = True
+        logger.info("Preloaded %d members", len(self.linked))
+
+    async def resolve(self, user_id: int) -> discord.abc.User:
+        member = self.get(user_id)
+        if member is not None:
+            self.hits += 1
+            return member
+
+        self.misses += 1
+        guild = self.bot.get_guild(load_config().discord.server_id)
+        if guild is not None:
+            try:
+                member = await guild.fetch_member(user_id)
+            except discord.NotFound:
+                logger.info("User %d is not a member of the guild", user_id)
+        if member is None:
+            member = await self.bot.fetch_user(user_id)
+
+        self.store(member)
+        return member
@@ -0,0 +1,257 @@
+import asyncio
+import contextlib
+import logging
+import time
+from collections.abc import Sequence
+from dataclasses import dataclass, field
+from enum import StrEnum
+
+import aiohttp
+
+from log_setup import trace_config
+from todoist.rest import get_tasks_by_ids
+from todoist.sync import SYNC_COMMAND_LIMIT, item_update, sync_commands
+from utils import AsyncDatabase
+from utils.Config import OutboxConfig, load_config
+from utils.Database import OutboxAction, OutboxEntry, utc_now
+from utils.Metrics import Counter, Gauge
+from utils.RateLimiter import RateLimiter
+from utils.UserDirectory import CachedUser
+
+logger = logging.getLogger(__name__)
+
+outbox_entries = Counter(
+    "shame_outbox_entries_total",
+    "Todoist writes taken from the outbox, by result",
+    ("result",),
+)
+outbox_pending = Gauge(
+    "shame_outbox_pending", "Todoist writes waiting in the outbox after the last drain"
+)
+
+
+class WriteState(StrEnum):
+    done = "done"
+    retrying = "retrying"
+    failed = "failed"
+
+
+@dataclass
+class WriteStatus:
+    state: WriteState
+    written: int = 0
+    error: str | None = None
+    finished_at: float = field(default_factory=time.time)
+
+
+@dataclass
+class WriteResult:
+    done: list[int] = field(default_factory=list)
+    failed: list[tuple[OutboxEntry, str]] = field(default_factory=list)
+    written: int = 0
+
+
+def apply_entry(labels: list[str], entry: OutboxEntry) -> list[str] | None:
+    # the new label list, or None when the task already looks the way it should
+    if entry.action == OutboxAction.add_label and entry.label not in labels:
+        return [*labels, entry.label]
+    if entry.action == OutboxAction.remove_label and entry.label in labels:
+        return [label for label in labels if label != entry.label]
+    return None
+
+
+class OutboxWorker:
+    # drains the todoist_outbox table, see OutboxEntry
+    def __init__(self) -> None:
+        self.status: dict[int, WriteStatus] = {}
+        self.limiter: RateLimiter | None = None
+        self._session: aiohttp.ClientSession | None = None
+        self._runner: asyncio.Task | None = None
+        self._wake = asyncio.Event()
+        self._stopping = False
+
+    def start(self) -> None:
+        if self._runner is not None:
+            return
+        config = load_config().outbox
+        self.limiter = RateLimiter(config.requests_per_second)
+        self._session = aiohttp.ClientSession(trace_configs=[trace_config])
+        self._stopping = False
+        self._runner = asyncio.create_task(self.run(self._session), name="outbox")
+
+    def wake(self) -> None:
+        self._wake.set()
+
+    def apply_config(self, old: OutboxConfig, new: OutboxConfig) -> None:
+        # config subscriber, the other settings are read on every drain
+        if (
+            self.limiter is not None
+            and old.requests_per_second != new.requests_per_second
+        ):
+            self.limiter = RateLimiter(new.requests_per_second)
+
+    async def run(self, session: aiohttp.ClientSession) -> None:
+        # entries left by a previous process are already due, so they replay first
+        while not self._stopping:
+            self._wake.clear()
+            try:
+                await self.flush(session)
+            except Exception:
+                logger.exception("Error draining outbox")
+            with contextlib.suppress(TimeoutError):
+                await asyncio.wait_for(
+                    self._wake.wait(), load_config().outbox.poll_interval
+                )
+
+        await self.flush(session)
+
+    async def flush(self, session: aiohttp.ClientSession) -> None:
+        concurrency = load_config().outbox.concurrency
+        semaphore = asyncio.Semaphore(concurrency)
+        while True:
+            user_ids = await AsyncDatabase.get_due_outbox_user_ids(
+                utc_now(), concurrency * 4
+            )
+            if not user_ids:
+                break
+            await asyncio.gather(
+                *(self.drain_user(session, user_id, semaphore) for user_id in user_ids)
+            )
+        outbox_pending.set(await AsyncDatabase.count_pending_outbox())
+
+    async def drain_user(
+        self, session: aiohttp.ClientSession, user_id: int, semaphore: asyncio.Semaphore
+    ) -> None:
+        max_attempts = load_config().outbox.max_attempts
+        async with semaphore:
+            now = utc_now()
+            entries = await AsyncDatabase.get_due_outbox_entries(
+                user_id, now, SYNC_COMMAND_LIMIT
+            )
+            if not entries:
+                return
+
+            # entries enqueued by the server can be for users this process hasn't seen
+            user = await AsyncDatabase.get_user_by_id(user_id)
+            if user is None:
+                await AsyncDatabase.retry_outbox_entries(
+                    [(entry, "User not found") for entry in entries], now, 0
+                )
+                outbox_entries.inc(len(entries), result="failed")
+                return
+
+            try:
+                result = await self.write(session, user, entries)
+            except (aiohttp.ClientError, TimeoutError) as error:
+                # nothing was acknowledged, the whole batch is tried again later
+                result = WriteResult(failed=[(entry, str(error)) for entry in entries])
+            except Exception as error:
+                # a bad response or entry backs off and is dead lettered like any
+                # other failure instead of blocking this user's outbox on every poll
+                logger.exception(
+                    "Unexpected error writing outbox for user %s", user.email
+                )
+                message = f"{type(error).__name__}: {error}"
+                result = WriteResult(failed=[(entry, message) for entry in entries])
+
+            await AsyncDatabase.complete_outbox_entries(result.done)
+            await AsyncDatabase.retry_outbox_entries(result.failed, now, max_attempts)
+            self.record(user, entries, result, max_attempts)
+
+    async def write(
+        self,
+        session: aiohttp.ClientSession,
+        user: CachedUser,
+        entries: Sequence[OutboxEntry],
+    ) -> WriteResult:
+        # one read for the current labels and one sync request for every change.
+        # completed or deleted tasks aren't returned and, like changes already
+        # made by an earlier attempt, need no write
+        result = WriteResult()
+        if self.limiter is not None:
+            await self.limiter.acquire()
+        tasks = {
+            task.id: task
+            for task in await get_tasks_by_ids(
+                session,
+                user.todoist_token,
+                list(dict.fromkeys(entry.task_id for entry in entries)),
+            )
+        }
+
+        commands = []
+        pending: dict[str, OutboxEntry] = {}
+        for entry in entries:
+            task = tasks.get(entry.task_id)
+            labels = apply_entry(task.labels or [], entry) if task else None
+            if task is None or labels is None:
+                result.done.append(entry.id)
+                continue
+            # later entries for the same task build on this one
+            task.labels = labels
+            commands.append(item_update(entry.uuid, entry.task_id, labels))
+            pending[entry.uuid] = entry
+
+        if not commands:
+            return result
+
+        if self.limiter is not None:
+            await self.limiter.acquire()
+        statuses = await sync_commands(session, user.todoist_token, commands)
+        for command_uuid, entry in pending.items():
+            status = statuses.get(command_uuid)
+            if status == "ok":
+                result.done.append(entry.id)
+                result.written += 1
+            else:
+                result.failed.append((entry, f"Sync command failed: {status}"))
+        return result
+
+    def record(
+        self,
+        user: CachedUser,
+        entries: Sequence[OutboxEntry],
+        result: WriteResult,
+        max_attempts: int,
+    ) -> None:
+        given_up = [
+            entry for entry, _ in result.failed if entry.attempts + 1 >= max_attempts
+        ]
+        outbox_entries.inc(result.written, result="written")
+        outbox_entries.inc(len(result.done) - result.written, result="skipped")
+        outbox_entries.inc(len(result.failed) - len(given_up), result="retried")
+        outbox_entries.inc(len(given_up), result="failed")
+
+        if not result.failed:
+            self.status[user.id] = WriteStatus(WriteState.done, result.written)
+            return
+
+        error = result.failed[0][1]
+        state = WriteState.failed if given_up else WriteState.retrying
+        self.status[user.id] = WriteStatus(state, result.written, error)
+        logger.warning(
+            "%d of %d todoist writes failed for user %s: %s",
+            len(result.failed),
+            len(entries),
+            user.email,
+            error,
+        )
+
+    async def shutdown(self, deadline: float) -> None:
+        # stops polling and makes a final flush, whatever doesn't make the deadline
+        # stays in the outbox and is replayed on the next start
+        if self._runner is None:
+            return
+        self._stopping = True
+        self._wake.set()
+        try:
+            await asyncio.wait_for(asyncio.shield(self._runner), deadline)
+        except TimeoutError:
+            logger.warning("Outbox not flushed within %ss", deadline)
+            self._runner.cancel()
+            with contextlib.suppress(asyncio.CancelledError):
+                await self._runner
+        self._runner = None
+        if self._session is not None:
+            await self._session.close()
+            self._session = None
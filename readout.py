@@ -0,0 +1,157 @@
+from dataclasses import dataclass, field
+
+import discord
+from discord.utils import escape_markdown
+
+from todoist.types import Task
+
+# https://discord.com/developers/docs/resources/message#embed-object-embed-limits
+EMBEDS_PER_MESSAGE = 10
+EMBED_FIELD_LIMIT = 25
+# title, description, field names and values of every embed in one message
+EMBED_TOTAL_LIMIT = 6000
+FIELD_NAME_LIMIT = 256
+FIELD_VALUE_LIMIT = 1024
+MESSAGE_CONTENT_LIMIT = 2000
+
+# fields wrap, so titles can be longer than in the fixed width table
+TASK_MAX_LENGTH = 100
+DUE_MAX_LENGTH = 30
+TASK_LIMIT = 10
+COMPLETED_FIELD_NAME = "Completed all tasks"
+MORE_TASKS_RESERVE = "\n9999 more task(s)"
+
+
+@dataclass
+class ReadoutUser:
+    email: str
+    name: str
+    mention: str
+    streak: int
+    # empty when every task was completed
+    tasks: list[Task] = field(default_factory=list)
+
+
+@dataclass
+class ReadoutField:
+    name: str
+    value: str
+    # embeds don't ping, shamed users are mentioned in the message content instead
+    mention: str | None = None
+
+    def __len__(self) -> int:
+        return len(self.name) + len(self.value)
+
+
+@dataclass
+class ReadoutMessage:
+    mentions: list[str] = field(default_factory=list)
+    embeds: list[discord.Embed] = field(default_factory=list)
+    size: int = 0
+
+    @property
+    def content(self) -> str | None:
+        return " ".join(self.mentions) or None
+
+
+def shorten(text: str, max_length: int) -> str:
+    text = text.strip()
+    if len(text) <= max_length:
+        return text
+    return text[: max_length - 1] + "…"
+
+
+def task_line(task: Task) -> str:
+    line = f"• {escape_markdown(shorten(task.content, TASK_MAX_LENGTH))}"
+    if task.due:
+        line += f" · *{escape_markdown(shorten(task.due.string, DUE_MAX_LENGTH))}*"
+    return line
+
+
+def shamed_field(user: ReadoutUser) -> ReadoutField:
+    lines = [user.mention]
+    size = len(user.mention)
+    shown = (
+        user.tasks if len(user.tasks) <= TASK_LIMIT else user.tasks[: TASK_LIMIT - 1]
+    )
+    for task in shown:
+        line = task_line(task)
+        # long titles can fill the field before the task limit is reached
+        if size + len(line) + len(MORE_TASKS_RESERVE) + 1 > FIELD_VALUE_LIMIT:
+            break
+        lines.append(line)
+        size += len(line) + 1
+
+    hidden = len(user.tasks) - (len(lines) - 1)
+    if hidden:
+        lines.append(f"{hidden} more task(s)")
+    return ReadoutField(
+        name=shorten(
+            f"{escape_markdown(user.name)} | Streak: {user.streak}", FIELD_NAME_LIMIT
+        ),
+        value="\n".join(lines),
+        mention=user.mention,
+    )
+
+
+def completed_fields(users: list[ReadoutUser]) -> list[ReadoutField]:
+    fields: list[ReadoutField] = []
+    lines: list[str] = []
+    size = 0
+    for user in users:
+        line = f"**{escape_markdown(user.name)}** | Streak: {user.streak}"
+        if lines and size + len(line) + 1 > FIELD_VALUE_LIMIT:
+            fields.append(ReadoutField(COMPLETED_FIELD_NAME, "\n".join(lines)))
+            lines, size = [], 0
+        lines.append(line)
+        size += len(line) + 1
+    if lines:
+        fields.append(ReadoutField(COMPLETED_FIELD_NAME, "\n".join(lines)))
+    return fields
+
+
+def pack_readout(title: str, users: list[ReadoutUser]) -> list[ReadoutMessage]:
+    # completed users are listed together, then one field per shamed user. fields
+    # are packed in order and a message is closed once the next field would break
+    # any of discord's limits
+    fields = completed_fields([user for user in users if not user.tasks])
+    fields += [shamed_field(user) for user in users if user.tasks]
+
+    message = ReadoutMessage()
+    embed = discord.Embed(title=title)
+    message.size = len(embed)
+    messages = [message]
+    for readout_field in fields:
+        mention_size = len(readout_field.mention) + 1 if readout_field.mention else 0
+        if (
+            message.size + len(readout_field) > EMBED_TOTAL_LIMIT
+            or len(message.content or "") + mention_size > MESSAGE_CONTENT_LIMIT
+            or (
+                len(embed.fields) == EMBED_FIELD_LIMIT
+                and len(message.embeds) == EMBEDS_PER_MESSAGE - 1
+            )
+        ):
+            message.embeds.append(embed)
+            message = ReadoutMessage()
+            messages.append(message)
+            embed = discord.Embed()
+        elif len(embed.fields) == EMBED_FIELD_LIMIT:
+            message.embeds.append(embed)
+            embed = discord.Embed()
+
+        embed.add_field(
+            name=readout_field.name, value=readout_field.value, inline=False
+        )
+        message.size += len(readout_field)
+        if readout_field.mention:
+            message.mentions.append(readout_field.mention)
+
+    message.embeds.append(embed)
+    return messages
+
+
+async def send_readout(
+    channel: discord.TextChannel, messages: list[ReadoutMessage]
+) -> None:
+    for message in messages:
+        await channel.send(content=message.content, embeds=message.embeds)
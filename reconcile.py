@@ -0,0 +1,123 @@
+import asyncio
+import logging
+from dataclasses import dataclass, field
+from datetime import UTC, datetime, timedelta
+
+import aiohttp
+
+from log_setup import trace_config
+from todoist.rest import get_tasks
+from todoist.types import Filter, Task
+from utils import AsyncDatabase
+from utils.Config import load_config
+from utils.Constants import SHAME_LABEL
+from utils.Database import OutboxAction, OutboxEntry, User, utc_now
+from utils.Metrics import Gauge
+from utils.RateLimiter import RateLimiter
+
+logger = logging.getLogger(__name__)
+
+# dates without a timezone are in the user's local time, which can be up to
+# 14 hours ahead of utc, a label is only stale once it can't be overdue anywhere
+TIMEZONE_MARGIN = timedelta(hours=14)
+
+reconcile_labels = Gauge(
+    "shame_reconcile_labels",
+    "Shame labels seen by the last reconciliation sweep, by outcome",
+    ("outcome",),
+)
+reconcile_completed = Gauge(
+    "shame_reconcile_last_completed_timestamp_seconds",
+    "Unix time the last reconciliation sweep finished",
+)
+
+
+@dataclass
+class ReconcileResult:
+    users: int = 0
+    failed_users: int = 0
+    labelled: int = 0
+    entries: list[OutboxEntry] = field(default_factory=list)
+
+
+def is_overdue(task: Task, now: datetime) -> bool:
+    # false only when the task can't be overdue in any timezone. now is naive utc
+    if task.due is None:
+        return False
+    if task.due.datetime is not None:
+        due = datetime.fromisoformat(task.due.datetime)
+        if due.tzinfo is not None:
+            return due.astimezone(UTC).replace(tzinfo=None) < now
+        return due < now + TIMEZONE_MARGIN
+    return datetime.fromisoformat(task.due.date).date() < (now + TIMEZONE_MARGIN).date()
+
+
+async def find_stale_labels(
+    session: aiohttp.ClientSession,
+    user: User,
+    now: datetime,
+    limiter: RateLimiter,
+    result: ReconcileResult,
+) -> None:
+    await limiter.acquire()
+    try:
+        labelled = await get_tasks(
+            session, user.todoist_token, Filter(label=SHAME_LABEL)
+        )
+    except (aiohttp.ClientError, TimeoutError):
+        # revoked tokens are left to the daily readout, the next sweep retries
+        logger.warning("Failed to fetch shame labels for user: %s", user.email)
+        result.failed_users += 1
+        return
+
+    result.users += 1
+    result.labelled += len(labelled)
+    for task in labelled:
+        try:
+            overdue = is_overdue(task, now)
+        except (TypeError, ValueError):
+            # an unparseable due date keeps its label rather than ending the sweep
+            logger.exception("Failed to read due date of task: %s", task.id)
+            continue
+        if not overdue:
+            result.entries.append(
+                OutboxEntry(
+                    user_id=user.id,
+                    task_id=task.id,
+                    action=OutboxAction.remove_label,
+                    label=SHAME_LABEL,
+                )
+            )
+
+
+async def reconcile_shame_labels() -> ReconcileResult:
+    # labels are removed when the completion webhook arrives, this catches the
+    # ones that were missed and tasks that were rescheduled instead of completed
+    config = load_config().reconcile
+    limiter = RateLimiter(config.requests_per_second)
+    semaphore = asyncio.Semaphore(config.concurrency)
+    result = ReconcileResult()
+    now = utc_now()
+    users = await AsyncDatabase.get_shameable_users(now)
+
+    async def check(user: User) -> None:
+        async with semaphore:
+            await find_stale_labels(client_session, user, now, limiter, result)
+
+    async with aiohttp.ClientSession(trace_configs=[trace_config]) as client_session:
+        await asyncio.gather(*(check(user) for user in users))
+
+    # removals go through the outbox like every other todoist write
+    await AsyncDatabase.enqueue_outbox(result.entries, now)
+
+    reconcile_labels.set(result.labelled, outcome="checked")
+    reconcile_labels.set(len(result.entries), outcome="stale")
+    reconcile_completed.set(datetime.now().timestamp())
+    logger.info(
+        "Reconciled shame labels for %d users: %d of %d labels stale, %d users failed",
+        result.users,
+        len(result.entries),
+        result.labelled,
+        result.failed_users,
+    )
+    return result
@@ -1,18 +1,56 @@
 import logging
+import tracemalloc
 from http import HTTPStatus
+from time import perf_counter
 
 import requests
 from aiohttp import ClientError
 from flask import Flask, Response, jsonify, request
-from todoist_api_python.api import TodoistAPI
 
-from utils.Config import load_config
+from utils.Config import load_config, reload_if_changed
 from utils.Constants import SHAME_LABEL
-from utils.Database import User, add_user, get_session, get_user_by_todoist_id
+from utils.Database import (
+    EmailClaimedError,
+    OutboxAction,
+    OutboxEntry,
+    User,
+    add_user,
+    enqueue_outbox,
+    get_cached_user_by_todoist_id,
+    get_session,
+    utc_now,
+)
+from utils.Metrics import Counter, Gauge, Histogram, read_snapshots, registry
+from utils.RunReport import TRACEMALLOC_FRAMES, trace_memory
+from utils.SignupNotifier import notify_authorized
 
 app = Flask(__name__)
 logger = logging.getLogger(__name__)
 
+webhooks_in_flight = Gauge(
+    "shame_webhooks_in_flight", "Webhook deliveries currently being processed"
+)
+webhook_duration = Histogram(
+    "shame_webhook_duration_seconds", "Time taken to process a webhook delivery"
+)
+webhook_responses = Counter(
+    "shame_webhook_responses_total",
+    "Webhook deliveries handled, by status code",
+    ("status",),
+)
+
+
+@app.before_request
+def refresh_config() -> None:
+    # oauth and database settings change without restarting the server
+    reload_if_changed()
+    # PROFILER = tracemalloc also traces the memory of each webhook
+    tracing = load_config().shame_script.profiler == "tracemalloc"
+    if tracing and not tracemalloc.is_tracing():
+        tracemalloc.start(TRACEMALLOC_FRAMES)
+    elif not tracing and tracemalloc.is_tracing():
+        tracemalloc.stop()
+
 
 @app.route("/connect", methods=["POST"])
 def connect() -> tuple[Response, int]:
@@ -28,20 +66,50 @@ def connect() -> tuple[Response, int]:
     ), HTTPStatus.OK
 
 
+@app.route("/metrics", methods=["GET"])
+def metrics() -> Response:
+    # the bot's metrics come from the snapshot it writes, see utils.Metrics
+    return Response(
+        registry.render() + read_snapshots(),
+        mimetype="text/plain; version=0.0.4; charset=utf-8",
+    )
+
+
 @app.route("/webhook", methods=["POST"])
 def webhook() -> tuple[str, int]:
-    data = request.json
+    webhooks_in_flight.inc()
+    start = perf_counter()
+    try:
+        with trace_memory("webhook") as memory:
+            body, status = handle_webhook(request.json)
+    finally:
+        webhooks_in_flight.dec()
+    webhook_duration.observe(perf_counter() - start)
+    if memory.traced:
+        logger.info(
+            "Webhook peak %d bytes, retained %d bytes, top allocators: %s",
+            memory.peak_bytes,
+            memory.retained_bytes,
+            ", ".join(
+                f"{allocator.location} {allocator.size_bytes:+d}B"
+                for allocator in memory.top_allocators
+            ),
+        )
+    webhook_responses.inc(status=str(int(status)))
+    return body, status
+
+
+def handle_webhook(data: dict | None) -> tuple[str, int]:
     try:
         if data is None or "event_name" not in data:
             return "", HTTPStatus.BAD_REQUEST
         if data["event_name"] == "item:completed":
             task_id = data["event_data"]["id"]
             user_id = data["event_data"]["user_id"]
-            with get_session() as session:
-                user = get_user_by_todoist_id(session=session, todoist_id=user_id)
-                if not user:
-                    return "", HTTPStatus.BAD_REQUEST
-                clear_shame(user.todoist_token, task_id)
+            user = get_cached_user_by_todoist_id(todoist_id=user_id)
+            if not user:
+                return "", HTTPStatus.BAD_REQUEST
+            clear_shame(user.id, task_id)
     except Exception:
         logger.exception("Error processing webhook")
         return "", HTTPStatus.INTERNAL_SERVER_ERROR
@@ -57,12 +125,23 @@ def auth() -> tuple[str, int]:
     user_id, user_email = get_user_info_from_todoist(access_token)
     with get_session() as session:
         if user_id and user_email:
-            add_user(
-                session=session,
-                user=User(
-                    email=user_email, todoist_id=user_id, todoist_token=access_token
-                ),
-            )
+            try:
+                add_user(
+                    session=session,
+                    user=User(
+                        email=user_email, todoist_id=user_id, todoist_token=access_token
+                    ),
+                )
+            except EmailClaimedError:
+                logger.warning(
+                    "Todoist account %s uses an email registered to another account",
+                    user_id,
+                )
+                return (
+                    "This email is already registered to another Todoist account",
+                    HTTPStatus.CONFLICT,
+                )
+            notify_authorized(user_email)
     return "Success", HTTPStatus.OK
 
 
@@ -101,22 +180,24 @@ def get_user_info_from_todoist(access_token: str) -> tuple[str, str]:
     raise ClientError
 
 
-def clear_shame(token: str, completed_task_id: str) -> None:
-    try:
-        api = TodoistAPI(token)
-        task = api.get_task(completed_task_id)
-        if task is None or task.labels is None:
-            return
-
-        updated_labels = [label for label in task.labels if label != SHAME_LABEL]
-        success = api.update_task(task_id=completed_task_id, labels=updated_labels)
-
-        if success:
-            logger.info("Cleared shame on task %s", completed_task_id)
-        else:
-            logger.warning("Failed to clear shame on task %s", completed_task_id)
-    except Exception:
-        logger.exception("Failed to clear shame")
+def clear_shame(user_id: int, completed_task_id: str) -> None:
+    # written to todoist by the bot's outbox worker, which retries until it's
+    # accepted, so the webhook answers without waiting on the todoist api
+    with get_session() as session:
+        enqueue_outbox(
+            session,
+            [
+                OutboxEntry(
+                    user_id=user_id,
+                    task_id=completed_task_id,
+                    action=OutboxAction.remove_label,
+                    label=SHAME_LABEL,
+                )
+            ],
+            utc_now(),
+        )
+        session.commit()
+    logger.info("Queued shame removal for task %s", completed_task_id)
 
 
 if __name__ == "__main__":
@@ -6,8 +6,8 @@ import discord
 from log_setup import trace_config
 from todoist.rest import get_tasks
 from todoist.types import Filter
+from utils.AsyncDatabase import get_user_by_discord_id
 from utils.Constants import DUE_TODAY, SHAME_LABEL
-from utils.Database import get_session, get_user_by_discord_id
 
 logger = logging.getLogger(__name__)
 
@@ -17,8 +17,7 @@ async def shame(
     interaction: discord.Interaction, user_to_shame: discord.Member
 ) -> None:
     async with aiohttp.ClientSession(trace_configs=[trace_config]) as client_session:
-        with get_session() as session:
-            user = get_user_by_discord_id(session=session, discord_id=user_to_shame.id)
+        user = await get_user_by_discord_id(discord_id=user_to_shame.id)
 
         if user is None:
             await interaction.followup.send(
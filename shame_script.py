@@ -1,31 +1,88 @@
+import asyncio
+import hashlib
+import json
 import logging
-from datetime import datetime
+import signal
+from collections.abc import Coroutine
+from datetime import datetime, time
+from pathlib import Path
+from time import perf_counter
+from typing import Any
 
 import aiohttp
 import discord
 from discord.ext import commands, tasks
 from table2ascii import Alignment, TableStyle, table2ascii
-
-from discord_signup import signup
-from log_setup import log_setup, trace_config
+from wcwidth import width
+
+from discord_signup import handle_signup_message, signup, start_signup_listeners
+from leaderboard_command import leaderboard
+from log_setup import log_setup, set_console_level, trace_config
+from member_cache import MemberResolver
+from outbox import OutboxWorker
+from readout import ReadoutUser, pack_readout, send_readout
+from reconcile import reconcile_shame_labels
 from shame_command import shame
-from todoist.rest import add_label, get_tasks
-from todoist.types import Filter
-from utils.Config import load_config
+from todoist.rest import TOKEN_REJECTED_STATUSES, get_tasks
+from todoist.types import Filter, Task
+from utils.AsyncDatabase import DailyRun, get_shameable_users, save_daily_run
+from utils.Config import (
+    DiscordConfig,
+    ReconcileConfig,
+    ShameScriptConfig,
+    load_config,
+    reload_config,
+    reload_if_changed,
+    subscribe,
+)
 from utils.Constants import OVERDUE, SHAME_LABEL
-from utils.Database import Score, get_session, get_users
+from utils.Database import (
+    DailyResult,
+    OutboxAction,
+    OutboxEntry,
+    load_db,
+    utc_now,
+)
+from utils.Metrics import Gauge, write_snapshot
+from utils.RunReport import RunReport, profile
+from utils.SignupNotifier import restart_notification_server
+from utils.StartupTimer import startup_timer
 
 logger = logging.getLogger(__name__)
 logger.info("Bot is starting up...")
 
-SCHEDULED_UTC_POST_TIME = datetime.strptime(
-    load_config().shame_script.utc_runtime, "%H:%M"
-).time()
+# replaced with the configured time before the loop is started
+DEFAULT_UTC_POST_TIME = time(0, 0)
+DEFAULT_RECONCILE_HOURS = 6
+COMMAND_TREE_HASH_PATH = Path(__file__).parent / "data" / "command_tree.sha256"
 
 TASK_MAX_LENGTH = 70
 INTERVAL_MAX_LENGTH = 20
 TASK_TABLE_LIMIT = 10
 DISCORD_MESSAGE_LIMIT = 2000
+READOUT_TITLE = "Daily Task Readout"
+METRICS_SNAPSHOT_INTERVAL = 15
+CONFIG_WATCH_INTERVAL = 10
+
+daily_run_in_progress = Gauge(
+    "shame_daily_run_in_progress", "Whether the daily readout is currently running"
+)
+daily_run_duration = Gauge(
+    "shame_daily_run_duration_seconds", "Wall time of the last completed daily readout"
+)
+daily_run_completed = Gauge(
+    "shame_daily_run_last_completed_timestamp_seconds",
+    "Unix time the last daily readout finished",
+)
+daily_run_users = Gauge(
+    "shame_daily_run_users",
+    "Users processed by the last daily readout, by outcome",
+    ("outcome",),
+)
+metrics_published = Gauge(
+    "shame_bot_metrics_published_timestamp_seconds",
+    "Unix time the bot last published its metrics snapshot",
+)
 
 
 async def safe_send(channel: discord.TextChannel, message: str) -> discord.Message:
@@ -38,30 +95,211 @@ async def safe_send(channel: discord.TextChannel, message: str) -> discord.Messa
 def string_shorten(message: str, max_length: int) -> str:
     message = message.strip()
 
-    if len(message) <= max_length:
+    if message.isascii() and message.isprintable():
+        if len(message) <= max_length:
+            return message
+        return message[: max_length - 3] + "..."
+
+    # table2ascii measures display width, so wide characters such as cjk and emoji
+    # count twice and tabs expand, cut at the longest prefix that still fits
+    if width(message) <= max_length:
         return message
 
-    return message[: max_length - 3] + "..."
+    low, high = 0, min(len(message), max_length - 3)
+    while low < high:
+        middle = (low + high + 1) // 2
+        if width(message[:middle]) <= max_length - 3:
+            low = middle
+        else:
+            high = middle - 1
+    return message[:low] + "..."
+
+
+def build_task_table(task_list: list[Task]) -> str:
+    task_table = [
+        [
+            string_shorten(task.content, TASK_MAX_LENGTH),
+            string_shorten(task.due.string if task.due else "", INTERVAL_MAX_LENGTH),
+        ]
+        for task in task_list
+    ]
+    task_count = len(task_list)
+
+    if task_count > TASK_TABLE_LIMIT:
+        # subtract 1 from the task limit to leave room for the "more tasks" line
+        task_table = task_table[: TASK_TABLE_LIMIT - 1]
+        task_table.append([f"{task_count - (TASK_TABLE_LIMIT - 1)} more task(s)", ""])
+
+    return table2ascii(
+        header=["Task", "Due"],
+        body=task_table,
+        style=TableStyle.from_string("┏━┳┳┓┃┃┃┣━╋╋┫     ┗┻┻┛  ┳┻  ┳┻"),
+        alignments=Alignment.LEFT,
+        # extra is added for the required padding
+        column_widths=[TASK_MAX_LENGTH + 2, INTERVAL_MAX_LENGTH + 2],
+    )
 
 
 # Initialize the bot
 intents = discord.Intents.default()
 intents.message_content = True
 intents.members = True
-bot = commands.Bot(intents=intents, command_prefix="!")
+# guild members are cached by member_resolver rather than discord.py, see member_cache
+bot = commands.Bot(
+    intents=intents,
+    command_prefix="!",
+    member_cache_flags=discord.MemberCacheFlags.none(),
+    chunk_guilds_at_startup=False,
+)
+member_resolver = MemberResolver(bot)
+outbox_worker = OutboxWorker()
+shutdown_task: asyncio.Task | None = None
+background_tasks: set[asyncio.Task] = set()
+readout_running = asyncio.Event()
 
 
 @bot.event
 async def on_ready() -> None:
     logger.info("Bot is ready. Logged in as %s", bot.user)
     try:
-        synced = await bot.tree.sync()
-        fetch_and_send_tasks.start()
-        for command in synced:
-            logger.info("Command synced: %s", command.name)
+        await sync_command_tree()
+        start_loops()
+        await start_signup_listeners(bot)
+        if not member_resolver.preloaded:
+            await member_resolver.preload()
     except Exception:
         logger.exception("Error during on_ready")
 
+    if "ready" not in startup_timer.stages:
+        startup_timer.mark("ready")
+        startup_timer.report()
+
+
+@bot.listen("on_connect")
+async def on_connect() -> None:  # noqa: RUF029
+    if "login" not in startup_timer.stages:
+        startup_timer.mark("login")
+
+
+def start_loops() -> None:
+    # on_ready fires again after every reconnect
+    outbox_worker.start()
+    loop = asyncio.get_running_loop()
+    loop.add_signal_handler(signal.SIGTERM, begin_shutdown)
+    loop.add_signal_handler(signal.SIGHUP, reload_config)
+    if not fetch_and_send_tasks.is_running():
+        fetch_and_send_tasks.change_interval(time=scheduled_post_time())
+        fetch_and_send_tasks.start()
+    if not publish_metrics.is_running():
+        publish_metrics.start()
+    if not reconcile_labels.is_running():
+        reconcile_labels.change_interval(hours=load_config().reconcile.interval_hours)
+        reconcile_labels.start()
+    if not watch_config.is_running():
+        watch_config.start()
+
+
+def run_in_background(coroutine: Coroutine[Any, Any, None]) -> None:
+    task = asyncio.create_task(coroutine)
+    background_tasks.add(task)
+    task.add_done_callback(background_tasks.discard)
+
+
+def reschedule_readout() -> None:
+    fetch_and_send_tasks.change_interval(time=scheduled_post_time())
+    # change_interval only applies after the next run, restarting applies it now
+    # but would cancel a readout in progress, which picks up the new time anyway
+    if fetch_and_send_tasks.is_running() and not readout_running.is_set():
+        fetch_and_send_tasks.restart()
+    logger.info("Daily readout rescheduled for %s UTC", scheduled_post_time())
+
+
+def on_shame_script_config(old: ShameScriptConfig, new: ShameScriptConfig) -> None:
+    if old.utc_runtime != new.utc_runtime:
+        reschedule_readout()
+
+
+def on_reconcile_config(old: ReconcileConfig, new: ReconcileConfig) -> None:
+    if old.interval_hours != new.interval_hours:
+        reconcile_labels.change_interval(hours=new.interval_hours)
+
+
+def on_discord_config(old: DiscordConfig, new: DiscordConfig) -> None:
+    # the channel is looked up on every run, only the member cache depends on the guild
+    if old.token != new.token:
+        logger.warning("Discord token changes take effect after a restart")
+    if (old.server_id, old.member_cache) != (new.server_id, new.member_cache):
+        member_resolver.clear()
+        run_in_background(member_resolver.preload())
+
+
+subscribe("shame_script", on_shame_script_config)
+subscribe("reconcile", on_reconcile_config)
+subscribe("discord", on_discord_config)
+subscribe("outbox", outbox_worker.apply_config)
+subscribe("signup", lambda _, __: run_in_background(restart_notification_server()))
+subscribe("logging", lambda _, new: set_console_level(new.level))
+
+
+def begin_shutdown() -> None:
+    global shutdown_task  # noqa: PLW0603
+    if shutdown_task is None:
+        shutdown_task = asyncio.create_task(shutdown())
+
+
+async def shutdown() -> None:
+    # queued todoist writes get a deadline to flush, anything left is replayed
+    # from the outbox on the next start
+    logger.info("SIGTERM received, flushing outbox")
+    await outbox_worker.shutdown(load_config().outbox.shutdown_deadline)
+    await bot.close()
+
+
+def scheduled_post_time() -> time:
+    return datetime.strptime(load_config().shame_script.utc_runtime, "%H:%M").time()
+
+
+def hash_command_tree() -> str:
+    payload = {
+        "application_id": bot.application_id,
+        "commands": [command.to_dict(bot.tree) for command in bot.tree.get_commands()],
+    }
+    return hashlib.sha256(
+        json.dumps(payload, sort_keys=True, default=str).encode()
+    ).hexdigest()
+
+
+def read_synced_tree_hash() -> str | None:
+    if not COMMAND_TREE_HASH_PATH.exists():
+        return None
+    return COMMAND_TREE_HASH_PATH.read_text(encoding="utf-8").strip()
+
+
+def write_synced_tree_hash(tree_hash: str) -> None:
+    COMMAND_TREE_HASH_PATH.parent.mkdir(parents=True, exist_ok=True)
+    COMMAND_TREE_HASH_PATH.write_text(tree_hash, encoding="utf-8")
+
+
+async def sync_command_tree() -> None:
+    # global syncs are rate limited, only sync when the commands actually changed
+    tree_hash = hash_command_tree()
+    if read_synced_tree_hash() == tree_hash:
+        logger.info("Command tree unchanged, skipping sync")
+        return
+
+    synced = await bot.tree.sync()
+    write_synced_tree_hash(tree_hash)
+    for command in synced:
+        logger.info("Command synced: %s", command.name)
+
+
+@bot.listen("on_message")
+async def on_message(message: discord.Message) -> None:
+    try:
+        await handle_signup_message(message)
+    except Exception:
+        logger.exception("Error handling signup message")
+
 
 async def paginate_message_send(
     channel: discord.TextChannel,
@@ -81,8 +319,48 @@ async def paginate_message_send(
     await safe_send(channel, "\n".join(message_content[page_start:]))
 
 
-@tasks.loop(time=SCHEDULED_UTC_POST_TIME)
+@tasks.loop(seconds=METRICS_SNAPSHOT_INTERVAL)
+async def publish_metrics() -> None:
+    metrics_published.set(datetime.now().timestamp())
+    await asyncio.to_thread(write_snapshot, "bot")
+
+
+@tasks.loop(seconds=CONFIG_WATCH_INTERVAL)
+async def watch_config() -> None:  # noqa: RUF029
+    reload_if_changed()
+
+
+@tasks.loop(hours=DEFAULT_RECONCILE_HOURS)
+async def reconcile_labels() -> None:
+    try:
+        await reconcile_shame_labels()
+    except Exception:
+        logger.exception("Error reconciling shame labels")
+    outbox_worker.wake()
+
+
+@tasks.loop(time=DEFAULT_UTC_POST_TIME)
 async def fetch_and_send_tasks() -> None:
+    daily_run_in_progress.set(1)
+    readout_running.set()
+    start = perf_counter()
+    report = RunReport("daily_run")
+    try:
+        with profile(load_config().shame_script.profiler, report.path(".prof")):
+            await send_daily_readout(report)
+    finally:
+        daily_run_in_progress.set(0)
+        readout_running.clear()
+        report.finish()
+        report_path = await asyncio.to_thread(report.write)
+        logger.info(
+            "Daily run took %.2fs, report saved to %s", report.wall_time, report_path
+        )
+    daily_run_duration.set(perf_counter() - start)
+    daily_run_completed.set(datetime.now().timestamp())
+
+
+async def send_daily_readout(report: RunReport) -> None:
     label_name = "exclude"  # Replace with your desired label
 
     channel = bot.get_channel(load_config().discord.channel_id)
@@ -93,89 +371,137 @@ async def fetch_and_send_tasks() -> None:
     if not isinstance(channel, discord.TextChannel):
         raise TypeError("Incorrect channel type")
 
-    logger.info("Fetching and sending tasks for channel: %d", config.discord.channel_id)
+    logger.info("Fetching and sending tasks for channel: %d", channel.id)
 
-    message_content = ["**Daily Task Readout**"]
+    readout: list[ReadoutUser] = []
 
     async with aiohttp.ClientSession(trace_configs=[trace_config]) as client_session:
-        with get_session() as database_session:
-            users = get_users(database_session)
+        now = utc_now()
+        with report.phase("load_users"), report.span("load_users"):
+            users = await get_shameable_users(now)
+        run = DailyRun()
+        # users, their tasks and readout entries are held until the readout posts
+        with report.phase("process_users"):
             for user in users:
-                logger.info("Processing tasks for user: %s", user.email)
+                if not user.discord_id:
+                    continue
 
-                task_list = await get_tasks(
-                    client_session,
-                    user.todoist_token,
-                    OVERDUE & ~Filter(label=label_name),
-                )
+                logger.info("Processing tasks for user: %s", user.email)
 
-                if not user.discord_id:
+                try:
+                    with report.span("fetch_tasks", user.email):
+                        task_list = await get_tasks(
+                            client_session,
+                            user.todoist_token,
+                            OVERDUE & ~Filter(label=label_name),
+                        )
+                except aiohttp.ClientResponseError as error:
+                    if error.status not in TOKEN_REJECTED_STATUSES:
+                        raise
+                    logger.warning("Todoist token rejected for user: %s", user.email)
+                    run.revoked.append(user)
                     continue
 
-                discord_user = await bot.fetch_user(user.discord_id)
+                with report.span("resolve_member", user.email):
+                    discord_user = await member_resolver.resolve(user.discord_id)
 
-                if not user.score:
-                    user.score = Score(streak=0)
+                streak = user.score.streak if user.score else 0
+                readout_user = ReadoutUser(
+                    user.email, discord_user.name, discord_user.mention, streak=0
+                )
+                readout.append(readout_user)
 
                 # All tasks completed
                 if not task_list:
-                    user.score.streak += 1
-                    message_content.append(
-                        f"**{discord_user.name}** Completed all tasks | Streak: {user.score.streak}"
+                    run.completed.append(user)
+                    run.results.append(
+                        DailyResult(
+                            user_id=user.id,
+                            overdue_count=0,
+                            labelled_count=0,
+                            streak=streak + 1,
+                        )
                     )
+                    readout_user.streak = streak + 1
                     continue
 
                 # Otherwise, proceed with shaming
-                user.score.streak = 0
-                await add_label(
-                    client_session, user.todoist_token, task_list, SHAME_LABEL
-                )
-
-                task_table = [
-                    [
-                        string_shorten(task.content, TASK_MAX_LENGTH),
-                        string_shorten(
-                            task.due.string if task.due else "", INTERVAL_MAX_LENGTH
+                run.shamed.append(user)
+                readout_user.tasks = task_list
+                run.results.append(
+                    DailyResult(
+                        user_id=user.id,
+                        overdue_count=len(task_list),
+                        labelled_count=sum(
+                            SHAME_LABEL not in (task.labels or []) for task in task_list
                         ),
-                    ]
-                    for task in task_list
-                ]
-                task_count = len(task_list)
-
-                if task_count > TASK_TABLE_LIMIT:
-                    # subtract 1 from the task limit to leave room for the "more tasks" line
-                    task_table = task_table[: TASK_TABLE_LIMIT - 1]
-                    task_table.append(
-                        [f"{task_count - (TASK_TABLE_LIMIT - 1)} more task(s)", ""]
+                        streak=0,
                     )
-
-                table = table2ascii(
-                    header=["Task", "Due"],
-                    body=task_table,
-                    style=TableStyle.from_string("┏━┳┳┓┃┃┃┣━╋╋┫     ┗┻┻┛  ┳┻  ┳┻"),
-                    alignments=Alignment.LEFT,
-                    # extra is added for the required padding
-                    column_widths=[TASK_MAX_LENGTH + 2, INTERVAL_MAX_LENGTH + 2],
                 )
-
-                message_content.append(
-                    f"*Tasks for {discord_user.mention} | Streak: {user.score.streak}*\n```\n{table}\n```"
+                # written in the background by the outbox worker once the run is saved
+                run.outbox_entries.extend(
+                    OutboxEntry(
+                        user_id=user.id,
+                        task_id=task.id,
+                        action=OutboxAction.add_label,
+                        label=SHAME_LABEL,
+                    )
+                    for task in task_list
+                    if SHAME_LABEL not in (task.labels or [])
                 )
-            database_session.commit()
+        with report.phase("save_results"), report.span("save_results"):
+            await save_daily_run(run, now)
+        outbox_worker.wake()
+        daily_run_users.set(len(run.completed), outcome="completed")
+        daily_run_users.set(len(run.shamed), outcome="shamed")
+        daily_run_users.set(len(run.revoked), outcome="revoked")
+
+    with report.phase("post_readout"):
+        await post_readout(channel, readout, report)
+
+
+def build_message_content(readout: list[ReadoutUser], report: RunReport) -> list[str]:
+    message_content = [f"**{READOUT_TITLE}**"]
+    for user in readout:
+        if not user.tasks:
+            message_content.append(
+                f"**{user.name}** Completed all tasks | Streak: {user.streak}"
+            )
+            continue
+
+        with report.span("render_table", user.email):
+            table = build_task_table(user.tasks)
+        message_content.append(
+            f"*Tasks for {user.mention} | Streak: {user.streak}*\n```\n{table}\n```"
+        )
+    return message_content
+
 
-    await paginate_message_send(channel, message_content)
+async def post_readout(
+    channel: discord.TextChannel, readout: list[ReadoutUser], report: RunReport
+) -> None:
+    if load_config().shame_script.readout_style == "embed":
+        with report.span("render_embeds"):
+            messages = pack_readout(READOUT_TITLE, readout)
+        with report.span("send_messages"):
+            await send_readout(channel, messages)
+    else:
+        message_content = build_message_content(readout, report)
+        with report.span("send_messages"):
+            await paginate_message_send(channel, message_content)
 
     today = datetime.now().strftime("%Y-%m-%d")
 
-    thread_message = await safe_send(
-        channel, "Discuss Task Completion in following Thread:"
-    )
+    with report.span("create_thread"):
+        thread_message = await safe_send(
+            channel, "Discuss Task Completion in following Thread:"
+        )
 
-    await channel.create_thread(
-        name=f"Daily Task Thread {today}",
-        message=thread_message,
-        reason="Daily Task Thread",
-    )
+        await channel.create_thread(
+            name=f"Daily Task Thread {today}",
+            message=thread_message,
+            reason="Daily Task Thread",
+        )
 
 
 @discord.app_commands.describe(user_to_signup="Mention of user")
@@ -186,7 +512,7 @@ async def signup_passthrough(
     logger.info("Signup command received for user: %s", user_to_signup.name)
     await interaction.response.defer(ephemeral=True, thinking=True)
     try:
-        await signup(interaction, user_to_signup, bot)
+        await signup(interaction, user_to_signup)
         logger.info("Signup successful for user: %s", user_to_signup.name)
     except Exception:
         logger.exception("Error during signup")
@@ -211,7 +537,25 @@ async def shame_passthrough(
         )
 
 
+@bot.tree.command(name="leaderboard")
+async def leaderboard_passthrough(interaction: discord.Interaction) -> None:
+    logger.info("Leaderboard command received")
+
+    await interaction.response.defer(ephemeral=False, thinking=True)
+    try:
+        await leaderboard(interaction)
+    except Exception:
+        logger.exception("Error during leaderboard")
+        await interaction.followup.send(
+            "An error occurred while processing the leaderboard command."
+        )
+
+
 if __name__ == "__main__":
-    log_setup()
+    startup_timer.mark("import")
     config = load_config()
+    log_setup(config.logging.level)
+    startup_timer.mark("config")
+    load_db()
+    startup_timer.mark("database")
     bot.run(config.discord.token, log_handler=None)
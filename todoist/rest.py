@@ -8,6 +8,8 @@ from todoist.types import Filter, Label, Task
 logger = logging.getLogger(__name__)
 
 API_URL = "https://api.todoist.com/rest/v2/"
+# todoist answers these once the app has been revoked or the token is invalid
+TOKEN_REJECTED_STATUSES = {HTTPStatus.UNAUTHORIZED, HTTPStatus.FORBIDDEN}
 
 
 async def get_tasks(
@@ -16,7 +18,7 @@ async def get_tasks(
     headers = {"Authorization": f"Bearer {api_token}"}
     url = f"{API_URL}tasks"
 
-    logger.info(str(task_filter))
+    logger.debug("Task filter: %s", task_filter)
 
     async with session.get(
         url, headers=headers, params={"filter": str(task_filter)}
@@ -39,6 +41,34 @@ async def get_tasks(
         return [Task(**task) for task in res]
 
 
+async def get_tasks_by_ids(
+    session: aiohttp.ClientSession, api_token: str, task_ids: list[str]
+) -> list[Task]:
+    # completed and deleted tasks are left out of the response
+    headers = {"Authorization": f"Bearer {api_token}"}
+    url = f"{API_URL}tasks"
+
+    async with session.get(
+        url, headers=headers, params={"ids": ",".join(task_ids)}
+    ) as response:
+        if response.status != HTTPStatus.OK:
+            logger.error("Failed to retrieve tasks: %s", response.status)
+            raise aiohttp.ClientResponseError(
+                request_info=response.request_info,
+                history=response.history,
+                status=response.status,
+                message=f"Failed to retrieve tasks: {response.status}",
+            )
+
+        res: list[dict] = await response.json()
+
+        if not isinstance(res, list):
+            logger.error("Response is not a list: %s", type(res))
+            raise TypeError("Response is not a list")
+
+        return [Task(**task) for task in res]
+
+
 async def get_task(
     session: aiohttp.ClientSession, api_token: str, task_id: str
 ) -> Task | None:
@@ -115,24 +145,3 @@ async def update_task(
                 status=response.status,
                 message=f"Failed to update task: {response.status}",
             )
-
-
-async def add_label(
-    session: aiohttp.ClientSession, api_token: str, tasks: list[Task], label_name: str
-) -> None:
-    labels = await get_labels(session, api_token)
-
-    label_id = next((label.id for label in labels if label.name == label_name), None)
-
-    if label_id is None:
-        await create_label(session, api_token, label_name)
-
-    for task in tasks:
-        task_labels = task.labels or []
-        if label_name in task_labels:
-            continue
-
-        task_labels.append(label_name)
-        data = {"labels": task_labels}
-
-        await update_task(session, api_token, task, data)
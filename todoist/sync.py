@@ -0,0 +1,41 @@
+import json
+import logging
+from http import HTTPStatus
+
+import aiohttp
+
+logger = logging.getLogger(__name__)
+
+SYNC_URL = "https://api.todoist.com/sync/v9/sync"
+# todoist accepts at most 100 commands per sync request
+SYNC_COMMAND_LIMIT = 100
+
+
+def item_update(command_uuid: str, task_id: str, labels: list[str]) -> dict:
+    return {
+        "type": "item_update",
+        "uuid": command_uuid,
+        "args": {"id": task_id, "labels": labels},
+    }
+
+
+async def sync_commands(
+    session: aiohttp.ClientSession, api_token: str, commands: list[dict]
+) -> dict[str, str | dict]:
+    # returns the status of each command by uuid, "ok" or an error object
+    headers = {"Authorization": f"Bearer {api_token}"}
+
+    async with session.post(
+        SYNC_URL, headers=headers, data={"commands": json.dumps(commands)}
+    ) as response:
+        if response.status != HTTPStatus.OK:
+            logger.error("Failed to sync commands: %s", response.status)
+            raise aiohttp.ClientResponseError(
+                request_info=response.request_info,
+                history=response.history,
+                status=response.status,
+                message=f"Failed to sync commands: {response.status}",
+            )
+
+        res: dict = await response.json()
+        return res.get("sync_status", {})
@@ -0,0 +1,209 @@
+import asyncio
+from collections.abc import Callable, Sequence
+from concurrent.futures import ThreadPoolExecutor
+from dataclasses import dataclass, field
+from datetime import datetime
+from functools import partial
+from typing import Concatenate, ParamSpec, TypeVar
+
+from sqlalchemy.orm import Session
+
+from utils import Database
+from utils.Database import (
+    DailyResult,
+    OutboxEntry,
+    PendingSignup,
+    User,
+    UserStats,
+)
+from utils.UserDirectory import CachedUser, user_directory
+
+P = ParamSpec("P")
+T = TypeVar("T")
+
+# kept within the default connection pool size so queries don't queue for a connection
+DATABASE_THREADS = 4
+
+_executor: ThreadPoolExecutor | None = None
+
+
+def get_executor() -> ThreadPoolExecutor:
+    global _executor  # noqa: PLW0603
+    if _executor is None:
+        _executor = ThreadPoolExecutor(
+            max_workers=DATABASE_THREADS, thread_name_prefix="database"
+        )
+    return _executor
+
+
+def call_with_session(
+    func: Callable[Concatenate[Session, P], T], *args: P.args, **kwargs: P.kwargs
+) -> T:
+    with Database.get_session() as session:
+        return func(session, *args, **kwargs)
+
+
+async def run_in_executor(func: Callable[P, T], *args: P.args, **kwargs: P.kwargs) -> T:
+    return await asyncio.get_running_loop().run_in_executor(
+        get_executor(), partial(func, *args, **kwargs)
+    )
+
+
+async def run_in_session(
+    func: Callable[Concatenate[Session, P], T], *args: P.args, **kwargs: P.kwargs
+) -> T:
+    # sqlite calls block, so they run on the database threads instead of the event loop
+    return await run_in_executor(call_with_session, func, *args, **kwargs)
+
+
+async def get_users() -> Sequence[User]:
+    # the directory is rebuilt on the database thread too, it's a CachedUser per
+    # row and would otherwise stall the event loop on large populations
+    def get_and_load(session: Session) -> Sequence[User]:
+        users = Database.get_users(session)
+        # a full read is a cheap chance to pick up changes made by the other process
+        user_directory.load(users)
+        return users
+
+    return await run_in_session(get_and_load)
+
+
+async def get_shameable_users(now: datetime) -> Sequence[User]:
+    def get_and_update(session: Session) -> Sequence[User]:
+        users = Database.get_shameable_users(session, now=now)
+        user_directory.update(users)
+        return users
+
+    return await run_in_session(get_and_update)
+
+
+@dataclass
+class DailyRun:
+    # everything a readout writes back, saved in one transaction
+    completed: list[User] = field(default_factory=list)
+    shamed: list[User] = field(default_factory=list)
+    revoked: list[User] = field(default_factory=list)
+    results: list[DailyResult] = field(default_factory=list)
+    outbox_entries: list[OutboxEntry] = field(default_factory=list)
+
+
+async def save_daily_run(run: DailyRun, now: datetime) -> None:
+    def save_and_commit(session: Session) -> None:
+        recorded = Database.record_daily_results(session, now.date(), run.results)
+        # a second run on the same day leaves the streaks from the first one
+        Database.update_streaks(
+            session,
+            [user for user in run.completed if user.id not in recorded],
+            [user for user in run.shamed if user.id not in recorded],
+        )
+        Database.mark_tokens_valid(session, [*run.completed, *run.shamed])
+        Database.mark_tokens_invalid(session, run.revoked, now)
+        # label writes are committed with the results, so a restart can't lose them
+        Database.enqueue_outbox(session, run.outbox_entries, now)
+        session.commit()
+
+    await run_in_session(save_and_commit)
+
+
+async def get_leaderboard(limit: int) -> Sequence[UserStats]:
+    return await run_in_session(Database.get_leaderboard, limit=limit)
+
+
+async def add_discord_to_user(email: str, discord_id: int) -> bool:
+    return await run_in_session(Database.add_discord_to_user, email, discord_id)
+
+
+async def get_user_by_id(user_id: int) -> CachedUser | None:
+    cached_user = user_directory.get_by_id(user_id)
+    if cached_user is not None:
+        return cached_user
+    user = await run_in_session(Database.get_user_by_id, user_id=user_id)
+    return user_directory.put(user) if user else None
+
+
+async def get_user_by_discord_id(discord_id: int) -> CachedUser | None:
+    cached_user = user_directory.get_by_discord_id(discord_id)
+    if cached_user is not None:
+        return cached_user
+    user = await run_in_session(Database.get_user_by_discord_id, discord_id=discord_id)
+    return user_directory.put(user) if user else None
+
+
+async def discord_id_exists(discord_id: int) -> bool:
+    return await get_user_by_discord_id(discord_id) is not None
+
+
+async def refresh_cached_user(email: str) -> CachedUser | None:
+    return await run_in_executor(Database.refresh_cached_user, email)
+
+
+async def add_user(user: User) -> None:
+    await run_in_session(Database.add_user, user=user)
+
+
+async def get_user_by_email(email: str) -> User | None:
+    return await run_in_session(Database.get_user_by_email, email=email)
+
+
+async def get_user_by_todoist_id(todoist_id: str) -> User | None:
+    return await run_in_session(Database.get_user_by_todoist_id, todoist_id=todoist_id)
+
+
+async def get_pending_signup(discord_id: int) -> PendingSignup | None:
+    return await run_in_session(Database.get_pending_signup, discord_id=discord_id)
+
+
+async def get_pending_signup_by_email(email: str) -> PendingSignup | None:
+    return await run_in_session(Database.get_pending_signup_by_email, email=email)
+
+
+async def get_pending_signups() -> Sequence[PendingSignup]:
+    return await run_in_session(Database.get_pending_signups)
+
+
+async def save_pending_signup(
+    discord_id: int, state: str, email: str | None, expires_at: datetime
+) -> None:
+    await run_in_session(
+        Database.save_pending_signup,
+        discord_id=discord_id,
+        state=state,
+        email=email,
+        expires_at=expires_at,
+    )
+
+
+async def delete_pending_signup(discord_id: int) -> None:
+    await run_in_session(Database.delete_pending_signup, discord_id=discord_id)
+
+
+async def enqueue_outbox(entries: Sequence[OutboxEntry], now: datetime) -> None:
+    def enqueue_and_commit(session: Session) -> None:
+        Database.enqueue_outbox(session, entries, now)
+        session.commit()
+
+    await run_in_session(enqueue_and_commit)
+
+
+async def get_due_outbox_user_ids(now: datetime, limit: int) -> Sequence[int]:
+    return await run_in_session(Database.get_due_outbox_user_ids, now, limit)
+
+
+async def get_due_outbox_entries(
+    user_id: int, now: datetime, limit: int
+) -> Sequence[OutboxEntry]:
+    return await run_in_session(Database.get_due_outbox_entries, user_id, now, limit)
+
+
+async def complete_outbox_entries(entry_ids: Sequence[int]) -> None:
+    await run_in_session(Database.complete_outbox_entries, entry_ids)
+
+
+async def retry_outbox_entries(
+    failures: Sequence[tuple[OutboxEntry, str]], now: datetime, max_attempts: int
+) -> None:
+    await run_in_session(Database.retry_outbox_entries, failures, now, max_attempts)
+
+
+async def count_pending_outbox() -> int:
+    return await run_in_session(Database.count_pending_outbox)
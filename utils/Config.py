@@ -1,12 +1,25 @@
 import configparser
 import logging
 import sys
-from dataclasses import dataclass
+import threading
+from collections.abc import Callable
+from dataclasses import dataclass, fields
+from datetime import datetime
+from pathlib import Path
+from typing import Any
 
 logger = logging.getLogger(__name__)
 
+CONFIG_PATH = Path("settings.cfg")
+
 config = configparser.ConfigParser()
-config.read("settings.cfg")
+
+# called with the old and new values of a section that changed on reload
+ConfigSubscriber = Callable[[Any, Any], None]
+
+
+class ConfigError(Exception):
+    pass
 
 
 @dataclass
@@ -14,6 +27,7 @@ class DiscordConfig:
     token: str
     channel_id: int
     server_id: int
+    member_cache: str
 
 
 @dataclass
@@ -28,6 +42,53 @@ class TodoistConfig:
 @dataclass
 class ShameScriptConfig:
     utc_runtime: str
+    # none, cprofile, yappi or tracemalloc, saved next to the run report in log/
+    profiler: str = "none"
+    # table or embed, see readout.py
+    readout_style: str = "table"
+
+
+@dataclass
+class DatabaseConfig:
+    synchronous: str = "NORMAL"
+    busy_timeout_ms: int = 5000
+    mmap_size: int = 256 * 1024 * 1024
+    # negative sizes are in KiB rather than pages
+    cache_size: int = -64 * 1024
+    pool_size: int = 5
+    max_overflow: int = 10
+    pool_timeout: int = 30
+
+
+@dataclass
+class SignupConfig:
+    notify_host: str = "127.0.0.1"
+    notify_port: int = 5003
+
+
+@dataclass
+class OutboxConfig:
+    # todoist writes are queued in the database and drained in the background
+    concurrency: int = 4
+    requests_per_second: float = 5.0
+    poll_interval: float = 5.0
+    max_attempts: int = 8
+    # seconds a shutdown waits for the final flush
+    shutdown_deadline: float = 10.0
+
+
+@dataclass
+class ReconcileConfig:
+    # sweep removing shame labels from tasks that are no longer overdue
+    interval_hours: float = 6.0
+    concurrency: int = 2
+    requests_per_second: float = 1.0
+
+
+@dataclass
+class LoggingConfig:
+    # console level, the file log always keeps INFO and above
+    level: int = logging.INFO
 
 
 @dataclass
@@ -35,51 +96,262 @@ class ConfigValues:
     discord: DiscordConfig
     todoist: TodoistConfig
     shame_script: ShameScriptConfig
+    database: DatabaseConfig
+    signup: SignupConfig
+    outbox: OutboxConfig
+    reconcile: ReconcileConfig
+    logging: LoggingConfig
 
 
 _config = None
+_config_stamp: tuple[int, int] | None = None
+_reload_lock = threading.Lock()
+_subscribers: dict[str, list[ConfigSubscriber]] = {}
 
 
 def load_config() -> ConfigValues:
-    global _config  # noqa: PLW0603
+    global _config, _config_stamp  # noqa: PLW0603
     if _config is not None:
         return _config
+    _config_stamp = config_stamp()
+    config.read(CONFIG_PATH)
+    try:
+        _config = parse_config(config)
+    except ConfigError:
+        logger.exception("Failed to load %s", CONFIG_PATH)
+        sys.exit()
+    return _config
+
+
+def config_stamp() -> tuple[int, int] | None:
+    try:
+        stat = CONFIG_PATH.stat()
+    except FileNotFoundError:
+        return None
+    return stat.st_mtime_ns, stat.st_size
+
+
+def subscribe(section: str, subscriber: ConfigSubscriber) -> None:
+    # section is a ConfigValues field name, e.g. "outbox"
+    _subscribers.setdefault(section, []).append(subscriber)
+
+
+def reload_config() -> list[str]:
+    # the new values replace the old ones in a single assignment, so readers see
+    # either the old or the new config and never a mix. a broken file is logged
+    # and the running config is kept
+    global config, _config, _config_stamp  # noqa: PLW0603
+    with _reload_lock:
+        old_config = load_config()
+        stamp = config_stamp()
+        parser = configparser.ConfigParser()
+        try:
+            parser.read(CONFIG_PATH)
+            new_config = parse_config(parser)
+        except (ConfigError, configparser.Error):
+            logger.exception("Config reload failed, keeping the running config")
+            _config_stamp = stamp
+            return []
+
+        changed = [
+            field.name
+            for field in fields(ConfigValues)
+            if getattr(old_config, field.name) != getattr(new_config, field.name)
+        ]
+        config, _config, _config_stamp = parser, new_config, stamp
+
+    for section in changed:
+        logger.info("Config section %s changed", section)
+        for subscriber in _subscribers.get(section, []):
+            try:
+                subscriber(getattr(old_config, section), getattr(new_config, section))
+            except Exception:
+                logger.exception("Error applying %s config change", section)
+    return changed
+
+
+def reload_if_changed() -> list[str]:
+    # a stat per call, cheap enough to run before every request
+    if _config is None or config_stamp() == _config_stamp:
+        return []
+    return reload_config()
+
+
+def parse_config(parser: configparser.ConfigParser) -> ConfigValues:
     try:
         discord_config = DiscordConfig(
-            token=config.get("DISCORD", "TOKEN"),
-            channel_id=config.getint("DISCORD", "CHANNEL_ID"),
-            server_id=config.getint("DISCORD", "SERVER_ID"),
+            token=parser.get("DISCORD", "TOKEN"),
+            channel_id=parser.getint("DISCORD", "CHANNEL_ID"),
+            server_id=parser.getint("DISCORD", "SERVER_ID"),
+            member_cache=parser.get("DISCORD", "MEMBER_CACHE", fallback="linked"),
         )
 
-    except (configparser.NoSectionError, configparser.NoOptionError):
-        logger.exception("Discord config set incorrectly")
-        sys.exit()
+    except (
+        configparser.NoSectionError,
+        configparser.NoOptionError,
+        ValueError,
+    ) as error:
+        raise ConfigError("Discord config set incorrectly") from error
 
     try:
         todoist_config = TodoistConfig(
-            client_id=config.get("TODOIST_AUTH", "CLIENT_ID"),
-            client_secret=config.get("TODOIST_AUTH", "CLIENT_SECRET"),
-            redirect_uri=config.get("TODOIST_AUTH", "REDIRECT_URI"),
-            token_url=config.get("TODOIST_AUTH", "TOKEN_URL"),
-            app_link=config.get("TODOIST_AUTH", "APP_LINK"),
+            client_id=parser.get("TODOIST_AUTH", "CLIENT_ID"),
+            client_secret=parser.get("TODOIST_AUTH", "CLIENT_SECRET"),
+            redirect_uri=parser.get("TODOIST_AUTH", "REDIRECT_URI"),
+            token_url=parser.get("TODOIST_AUTH", "TOKEN_URL"),
+            app_link=parser.get("TODOIST_AUTH", "APP_LINK"),
         )
 
-    except (configparser.NoSectionError, configparser.NoOptionError):
-        logger.exception("Todoist config set incorrectly")
-        sys.exit()
+    except (configparser.NoSectionError, configparser.NoOptionError) as error:
+        raise ConfigError("Todoist config set incorrectly") from error
 
     try:
         shame_script_config = ShameScriptConfig(
-            utc_runtime=config.get(
+            utc_runtime=parser.get(
                 section="SHAME_SCRIPT", option="UTC_RUNTIME", fallback="00:00"
             ),
+            profiler=parser.get(
+                section="SHAME_SCRIPT", option="PROFILER", fallback="none"
+            ).lower(),
+            readout_style=parser.get(
+                section="SHAME_SCRIPT", option="READOUT_STYLE", fallback="table"
+            ).lower(),
         )
+        # checked here so a bad reload is rejected rather than breaking the schedule
+        datetime.strptime(shame_script_config.utc_runtime, "%H:%M")
 
-    except (configparser.NoSectionError, configparser.NoOptionError):
-        logger.exception("Shame Script config set incorrectly")
-        sys.exit()
+    except (
+        configparser.NoSectionError,
+        configparser.NoOptionError,
+        ValueError,
+    ) as error:
+        raise ConfigError("Shame Script config set incorrectly") from error
 
-    _config = ConfigValues(
-        discord=discord_config, todoist=todoist_config, shame_script=shame_script_config
+    try:
+        defaults = DatabaseConfig()
+        database_config = DatabaseConfig(
+            synchronous=parser.get(
+                section="DATABASE", option="SYNCHRONOUS", fallback=defaults.synchronous
+            ),
+            busy_timeout_ms=parser.getint(
+                section="DATABASE",
+                option="BUSY_TIMEOUT_MS",
+                fallback=defaults.busy_timeout_ms,
+            ),
+            mmap_size=parser.getint(
+                section="DATABASE", option="MMAP_SIZE", fallback=defaults.mmap_size
+            ),
+            cache_size=parser.getint(
+                section="DATABASE", option="CACHE_SIZE", fallback=defaults.cache_size
+            ),
+            pool_size=parser.getint(
+                section="DATABASE", option="POOL_SIZE", fallback=defaults.pool_size
+            ),
+            max_overflow=parser.getint(
+                section="DATABASE",
+                option="MAX_OVERFLOW",
+                fallback=defaults.max_overflow,
+            ),
+            pool_timeout=parser.getint(
+                section="DATABASE",
+                option="POOL_TIMEOUT",
+                fallback=defaults.pool_timeout,
+            ),
+        )
+
+    except ValueError as error:
+        raise ConfigError("Database config set incorrectly") from error
+
+    try:
+        signup_defaults = SignupConfig()
+        signup_config = SignupConfig(
+            notify_host=parser.get(
+                section="SIGNUP",
+                option="NOTIFY_HOST",
+                fallback=signup_defaults.notify_host,
+            ),
+            notify_port=parser.getint(
+                section="SIGNUP",
+                option="NOTIFY_PORT",
+                fallback=signup_defaults.notify_port,
+            ),
+        )
+
+    except ValueError as error:
+        raise ConfigError("Signup config set incorrectly") from error
+
+    try:
+        outbox_defaults = OutboxConfig()
+        outbox_config = OutboxConfig(
+            concurrency=parser.getint(
+                section="OUTBOX",
+                option="CONCURRENCY",
+                fallback=outbox_defaults.concurrency,
+            ),
+            requests_per_second=parser.getfloat(
+                section="OUTBOX",
+                option="REQUESTS_PER_SECOND",
+                fallback=outbox_defaults.requests_per_second,
+            ),
+            poll_interval=parser.getfloat(
+                section="OUTBOX",
+                option="POLL_INTERVAL",
+                fallback=outbox_defaults.poll_interval,
+            ),
+            max_attempts=parser.getint(
+                section="OUTBOX",
+                option="MAX_ATTEMPTS",
+                fallback=outbox_defaults.max_attempts,
+            ),
+            shutdown_deadline=parser.getfloat(
+                section="OUTBOX",
+                option="SHUTDOWN_DEADLINE",
+                fallback=outbox_defaults.shutdown_deadline,
+            ),
+        )
+
+    except ValueError as error:
+        raise ConfigError("Outbox config set incorrectly") from error
+
+    try:
+        reconcile_defaults = ReconcileConfig()
+        reconcile_config = ReconcileConfig(
+            interval_hours=parser.getfloat(
+                section="RECONCILE",
+                option="INTERVAL_HOURS",
+                fallback=reconcile_defaults.interval_hours,
+            ),
+            concurrency=parser.getint(
+                section="RECONCILE",
+                option="CONCURRENCY",
+                fallback=reconcile_defaults.concurrency,
+            ),
+            requests_per_second=parser.getfloat(
+                section="RECONCILE",
+                option="REQUESTS_PER_SECOND",
+                fallback=reconcile_defaults.requests_per_second,
+            ),
+        )
+
+    except ValueError as error:
+        raise ConfigError("Reconcile config set incorrectly") from error
+
+    try:
+        level = parser.get(section="LOGGING", option="LEVEL", fallback="INFO")
+        logging_config = LoggingConfig(
+            level=logging.getLevelNamesMapping()[level.upper()]
+        )
+
+    except KeyError as error:
+        raise ConfigError("Logging config set incorrectly") from error
+
+    return ConfigValues(
+        discord=discord_config,
+        todoist=todoist_config,
+        shame_script=shame_script_config,
+        database=database_config,
+        signup=signup_config,
+        outbox=outbox_config,
+        reconcile=reconcile_config,
+        logging=logging_config,
     )
-    return _config
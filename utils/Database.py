@@ -1,20 +1,51 @@
 import configparser
 import logging
-from collections.abc import Sequence
+import sqlite3
+import uuid
+from collections.abc import Iterable, Iterator, Sequence
+from datetime import UTC, date, datetime, timedelta
+from enum import StrEnum
 from pathlib import Path
 
-from sqlalchemy import ForeignKey, create_engine, select
+from sqlalchemy import (
+    Engine,
+    ForeignKey,
+    UniqueConstraint,
+    create_engine,
+    delete,
+    event,
+    func,
+    insert,
+    or_,
+    select,
+    update,
+)
 from sqlalchemy.orm import (
     DeclarativeBase,
     Mapped,
     Session,
     mapped_column,
     relationship,
+    selectinload,
     sessionmaker,
 )
 
+from utils.Config import DatabaseConfig, load_config, subscribe
+from utils.UserDirectory import CachedUser, user_directory
+
 logger = logging.getLogger(__name__)
 
+DB_PATH = Path(__file__).parent.parent / "data" / "database.sqlite"
+SYNCHRONOUS_MODES = {"OFF", "NORMAL", "FULL", "EXTRA"}
+ROLLUP_DAYS = 30
+TOKEN_RECHECK_BACKOFF = timedelta(days=1)
+TOKEN_RECHECK_MAX_BACKOFF = timedelta(days=30)
+ROLLUP_MASK = (1 << ROLLUP_DAYS) - 1
+OUTBOX_RETRY_BACKOFF = timedelta(seconds=30)
+OUTBOX_MAX_RETRY_BACKOFF = timedelta(hours=1)
+# ids bound per IN list, older sqlite builds allow 999 variables a statement
+ID_CHUNK_SIZE = 500
+
 
 class EmailClaimedError(Exception):
     pass
@@ -27,10 +58,14 @@ class Base(DeclarativeBase):
 class User(Base):
     __tablename__ = "users"
     id: Mapped[int] = mapped_column(primary_key=True, autoincrement=True)
-    email: Mapped[str] = mapped_column()
-    discord_id: Mapped[int | None] = mapped_column()
-    todoist_id: Mapped[str] = mapped_column()
+    email: Mapped[str] = mapped_column(unique=True, index=True)
+    discord_id: Mapped[int | None] = mapped_column(unique=True, index=True)
+    todoist_id: Mapped[str] = mapped_column(unique=True, index=True)
     todoist_token: Mapped[str] = mapped_column()
+    # set once todoist rejects the token, cleared when the user re-authorizes
+    token_invalid_since: Mapped[datetime | None] = mapped_column()
+    token_failures: Mapped[int] = mapped_column(default=0, server_default="0")
+    token_next_check: Mapped[datetime | None] = mapped_column()
 
     score: Mapped["Score"] = relationship(back_populates="user")
 
@@ -41,7 +76,7 @@ class User(Base):
 class Score(Base):
     __tablename__ = "scores"
     id: Mapped[int] = mapped_column(primary_key=True, autoincrement=True)
-    user_id: Mapped[int] = mapped_column(ForeignKey("users.id"))
+    user_id: Mapped[int] = mapped_column(ForeignKey("users.id"), index=True)
     streak: Mapped[int] = mapped_column()
 
     user: Mapped["User"] = relationship(back_populates="score")
@@ -50,12 +85,124 @@ class Score(Base):
         return f"<Score(user_id={self.user_id}, streak={self.streak})>"
 
 
+class SignupState(StrEnum):
+    awaiting_email = "awaiting_email"
+    awaiting_authorization = "awaiting_authorization"
+
+
+class PendingSignup(Base):
+    __tablename__ = "pending_signups"
+    id: Mapped[int] = mapped_column(primary_key=True, autoincrement=True)
+    discord_id: Mapped[int] = mapped_column(unique=True, index=True)
+    state: Mapped[str] = mapped_column()
+    email: Mapped[str | None] = mapped_column()
+    expires_at: Mapped[datetime] = mapped_column()
+
+    def __repr__(self) -> str:
+        return f"<PendingSignup(discord_id={self.discord_id}, state={self.state}, email={self.email})>"
+
+
+class DailyResult(Base):
+    __tablename__ = "daily_results"
+    __table_args__ = (UniqueConstraint("user_id", "run_date"),)
+    id: Mapped[int] = mapped_column(primary_key=True, autoincrement=True)
+    user_id: Mapped[int] = mapped_column(ForeignKey("users.id"), index=True)
+    run_date: Mapped[date] = mapped_column()
+    overdue_count: Mapped[int] = mapped_column()
+    labelled_count: Mapped[int] = mapped_column()
+    streak: Mapped[int] = mapped_column()
+
+    def __repr__(self) -> str:
+        return f"<DailyResult(user_id={self.user_id}, run_date={self.run_date}, overdue_count={self.overdue_count})>"
+
+
+class UserStats(Base):
+    __tablename__ = "user_stats"
+    id: Mapped[int] = mapped_column(primary_key=True, autoincrement=True)
+    user_id: Mapped[int] = mapped_column(ForeignKey("users.id"), unique=True)
+    streak: Mapped[int] = mapped_column(index=True)
+    best_streak: Mapped[int] = mapped_column()
+    # bit n is set for the day n days before last_result_date
+    completed_days: Mapped[int] = mapped_column()
+    recorded_days: Mapped[int] = mapped_column()
+    last_result_date: Mapped[date] = mapped_column()
+    completion_rate_7: Mapped[float] = mapped_column()
+    completion_rate_30: Mapped[float] = mapped_column()
+
+    user: Mapped["User"] = relationship()
+
+    def __repr__(self) -> str:
+        return f"<UserStats(user_id={self.user_id}, streak={self.streak}, best_streak={self.best_streak})>"
+
+
+class OutboxAction(StrEnum):
+    add_label = "add_label"
+    remove_label = "remove_label"
+
+
+class OutboxEntry(Base):
+    # a todoist write that hasn't been acknowledged yet, deleted once it has
+    __tablename__ = "todoist_outbox"
+    id: Mapped[int] = mapped_column(primary_key=True, autoincrement=True)
+    # sent as the sync command uuid on every attempt, todoist applies a uuid once
+    uuid: Mapped[str] = mapped_column(unique=True, default=lambda: uuid.uuid4().hex)
+    user_id: Mapped[int] = mapped_column(ForeignKey("users.id"), index=True)
+    task_id: Mapped[str] = mapped_column()
+    action: Mapped[str] = mapped_column()
+    label: Mapped[str] = mapped_column()
+    attempts: Mapped[int] = mapped_column(default=0, server_default="0")
+    next_attempt_at: Mapped[datetime] = mapped_column(index=True)
+    last_error: Mapped[str | None] = mapped_column()
+    # set once max attempts is reached, the entry is kept for inspection
+    failed_at: Mapped[datetime | None] = mapped_column()
+
+    def __repr__(self) -> str:
+        return f"<OutboxEntry(user_id={self.user_id}, task_id={self.task_id}, action={self.action}, label={self.label})>"
+
+
 _session_maker: sessionmaker[Session] | None = None
 
 
-def load_db() -> sessionmaker[Session]:
+def utc_now() -> datetime:
+    # sqlite stores naive datetimes, every stored timestamp is utc
+    return datetime.now(UTC).replace(tzinfo=None)
+
+
+def create_db_engine(db_path: Path, database_config: DatabaseConfig) -> Engine:
+    synchronous = database_config.synchronous.upper()
+    if synchronous not in SYNCHRONOUS_MODES:
+        raise ValueError(f"Unknown sqlite synchronous mode: {synchronous}")
+
+    # the bot and the webhook server share this file, connections are handed between
+    # flask worker threads and the event loop so they can't be pinned to one thread
+    engine = create_engine(
+        f"sqlite:///{db_path}",
+        pool_size=database_config.pool_size,
+        max_overflow=database_config.max_overflow,
+        pool_timeout=database_config.pool_timeout,
+        connect_args={
+            "check_same_thread": False,
+            "timeout": database_config.busy_timeout_ms / 1000,
+        },
+    )
+
+    @event.listens_for(engine, "connect")
+    def set_sqlite_pragmas(dbapi_connection: sqlite3.Connection, _: object) -> None:
+        cursor = dbapi_connection.cursor()
+        cursor.execute("PRAGMA journal_mode=WAL")
+        cursor.execute(f"PRAGMA synchronous={synchronous}")
+        cursor.execute(f"PRAGMA busy_timeout={database_config.busy_timeout_ms:d}")
+        cursor.execute(f"PRAGMA mmap_size={database_config.mmap_size:d}")
+        cursor.execute(f"PRAGMA cache_size={database_config.cache_size:d}")
+        cursor.close()
+
+    return engine
+
+
+def load_db(
+    db_path: Path = DB_PATH, database_config: DatabaseConfig | None = None
+) -> sessionmaker[Session]:
     logger.info("Loading database")
-    db_path = Path(__file__).parent.parent / "data" / "database.sqlite"
 
     if not db_path.exists():
         logger.info("Creating database at %s", db_path)
@@ -64,21 +211,203 @@ def load_db() -> sessionmaker[Session]:
         config = configparser.ConfigParser()
         config.read(config_path)
 
-    engine = create_engine(f"sqlite:///{db_path}")
+    engine = create_db_engine(db_path, database_config or load_config().database)
     Base.metadata.create_all(engine)
     global _session_maker  # noqa: PLW0603
     _session_maker = sessionmaker(bind=engine)
 
+    with _session_maker() as session:
+        user_directory.load(session.execute(select(User)).scalars())
+
     return _session_maker
 
 
+def rebuild_engine(old: DatabaseConfig, new: DatabaseConfig) -> None:
+    # config subscriber, sessions opened after this use the new pool and pragmas
+    # while checked out connections finish on the old engine
+    global _session_maker  # noqa: PLW0603
+    if _session_maker is None or old == new:
+        return
+    old_engine: Engine = _session_maker.kw["bind"]
+    engine = create_db_engine(Path(str(old_engine.url.database)), new)
+    _session_maker = sessionmaker(bind=engine)
+    old_engine.dispose()
+    logger.info("Database engine rebuilt with the new config")
+
+
+subscribe("database", rebuild_engine)
+
+
 def get_session() -> Session:
     session_maker = _session_maker or load_db()
     return session_maker()
 
 
 def get_users(session: Session) -> Sequence[User]:
-    return session.execute(select(User)).scalars().all()
+    # scores are loaded up front so the daily loop doesn't lazy load one row per user
+    return (
+        session.execute(select(User).options(selectinload(User.score))).scalars().all()
+    )
+
+
+def get_shameable_users(session: Session, now: datetime) -> Sequence[User]:
+    # unlinked users and tokens still in their recheck backoff never reach todoist
+    return (
+        session.execute(
+            select(User)
+            .options(selectinload(User.score))
+            .where(
+                User.discord_id.is_not(None),
+                or_(User.token_next_check.is_(None), User.token_next_check <= now),
+            )
+        )
+        .scalars()
+        .all()
+    )
+
+
+def mark_tokens_invalid(session: Session, users: Sequence[User], now: datetime) -> None:
+    if not users:
+        return
+
+    session.execute(
+        update(User),
+        [
+            {
+                "id": user.id,
+                "token_invalid_since": user.token_invalid_since or now,
+                "token_failures": user.token_failures + 1,
+                "token_next_check": now
+                + min(
+                    TOKEN_RECHECK_BACKOFF * 2**user.token_failures,
+                    TOKEN_RECHECK_MAX_BACKOFF,
+                ),
+            }
+            for user in users
+        ],
+    )
+
+
+def chunked(ids: Sequence[int]) -> Iterator[Sequence[int]]:
+    # keeps IN lists under sqlite's bound variable limit for large populations
+    for start in range(0, len(ids), ID_CHUNK_SIZE):
+        yield ids[start : start + ID_CHUNK_SIZE]
+
+
+def mark_tokens_valid(session: Session, users: Sequence[User]) -> None:
+    recovered_ids = [user.id for user in users if user.token_failures]
+    for ids in chunked(recovered_ids):
+        session.execute(
+            update(User)
+            .where(User.id.in_(ids))
+            .values(token_invalid_since=None, token_failures=0, token_next_check=None)
+            .execution_options(synchronize_session=False)
+        )
+
+
+def update_streaks(
+    session: Session, completed: Sequence[User], shamed: Sequence[User]
+) -> None:
+    # expects users loaded by get_users, so missing scores are known without a query
+    for streak, users in ((Score.streak + 1, completed), (0, shamed)):
+        scored_ids = [user.id for user in users if user.score is not None]
+        for ids in chunked(scored_ids):
+            session.execute(
+                update(Score)
+                .where(Score.user_id.in_(ids))
+                .values(streak=streak)
+                .execution_options(synchronize_session=False)
+            )
+
+    new_scores = [
+        {"user_id": user.id, "streak": 1} for user in completed if user.score is None
+    ] + [{"user_id": user.id, "streak": 0} for user in shamed if user.score is None]
+
+    if new_scores:
+        session.execute(insert(Score), new_scores)
+
+
+def completion_rate(stats: UserStats, days: int) -> float:
+    window = (1 << days) - 1
+    recorded = (stats.recorded_days & window).bit_count()
+    if recorded == 0:
+        return 0.0
+    return (stats.completed_days & window).bit_count() / recorded
+
+
+def roll_up_result(stats: UserStats, result: DailyResult) -> None:
+    # slide the day bitmasks forward instead of rescanning daily_results
+    shift = min((result.run_date - stats.last_result_date).days, ROLLUP_DAYS)
+    completed = int(result.overdue_count == 0)
+
+    stats.completed_days = ((stats.completed_days << shift) | completed) & ROLLUP_MASK
+    stats.recorded_days = ((stats.recorded_days << shift) | 1) & ROLLUP_MASK
+    stats.last_result_date = result.run_date
+    stats.streak = result.streak
+    stats.best_streak = max(stats.best_streak, result.streak)
+    stats.completion_rate_7 = completion_rate(stats, 7)
+    stats.completion_rate_30 = completion_rate(stats, ROLLUP_DAYS)
+
+
+def record_daily_results(
+    session: Session, result_date: date, results: Sequence[DailyResult]
+) -> set[int]:
+    # returns the users already recorded for the day, their results are skipped
+    user_ids = [result.user_id for result in results]
+
+    # a second run on the same day must not count twice
+    already_recorded = {
+        user_id
+        for ids in chunked(user_ids)
+        for user_id in session.execute(
+            select(DailyResult.user_id).where(
+                DailyResult.run_date == result_date, DailyResult.user_id.in_(ids)
+            )
+        ).scalars()
+    }
+    new_results = [
+        result for result in results if result.user_id not in already_recorded
+    ]
+    if not new_results:
+        return already_recorded
+
+    stats_by_user = {
+        stats.user_id: stats
+        for ids in chunked(user_ids)
+        for stats in session.execute(
+            select(UserStats).where(UserStats.user_id.in_(ids))
+        ).scalars()
+    }
+
+    for result in new_results:
+        result.run_date = result_date
+        stats = stats_by_user.get(result.user_id)
+        if stats is None:
+            stats = UserStats(
+                user_id=result.user_id,
+                best_streak=0,
+                completed_days=0,
+                recorded_days=0,
+                last_result_date=result_date,
+            )
+            session.add(stats)
+        roll_up_result(stats, result)
+
+    session.add_all(new_results)
+    return already_recorded
+
+
+def get_leaderboard(session: Session, limit: int) -> Sequence[UserStats]:
+    return (
+        session.execute(
+            select(UserStats)
+            .options(selectinload(UserStats.user))
+            .order_by(UserStats.streak.desc(), UserStats.completion_rate_30.desc())
+            .limit(limit)
+        )
+        .scalars()
+        .all()
+    )
 
 
 def add_discord_to_user(session: Session, email: str, discord_id: int) -> bool:
@@ -93,10 +422,15 @@ def add_discord_to_user(session: Session, email: str, discord_id: int) -> bool:
     user.discord_id = discord_id
 
     session.commit()
+    user_directory.put(user)
 
     return True
 
 
+def get_user_by_id(session: Session, user_id: int) -> User | None:
+    return session.get(User, user_id)
+
+
 def get_user_by_discord_id(session: Session, discord_id: int) -> User | None:
     return session.execute(
         select(User).where(User.discord_id == discord_id)
@@ -113,8 +447,30 @@ def discord_id_exists(session: Session, discord_id: int) -> bool:
 
 
 def add_user(session: Session, user: User) -> None:
-    session.add(user)
+    # re-authorizing the app refreshes the token of the existing todoist account
+    existing_user = get_user_by_todoist_id(session=session, todoist_id=user.todoist_id)
+    email_user = get_user_by_email(session=session, email=user.email)
+    if (
+        email_user is not None
+        and existing_user is not None
+        and existing_user is not email_user
+    ):
+        # the email moved to another registered todoist account, merging the two
+        # would drop one user's discord link and scores
+        raise EmailClaimedError
+    # a new todoist account with a registered email takes over that user
+    existing_user = existing_user or email_user
+    if existing_user:
+        existing_user.email = user.email
+        existing_user.todoist_id = user.todoist_id
+        existing_user.todoist_token = user.todoist_token
+        existing_user.token_invalid_since = None
+        existing_user.token_failures = 0
+        existing_user.token_next_check = None
+    else:
+        session.add(user)
     session.commit()
+    user_directory.put(existing_user or user)
 
 
 def get_user_by_email(session: Session, email: str) -> User | None:
@@ -125,3 +481,154 @@ def get_user_by_todoist_id(session: Session, todoist_id: str) -> User | None:
     return session.execute(
         select(User).where(User.todoist_id == todoist_id)
     ).scalar_one_or_none()
+
+
+def get_cached_user_by_todoist_id(todoist_id: str) -> CachedUser | None:
+    cached_user = user_directory.get_by_todoist_id(todoist_id)
+    if cached_user is None:
+        with get_session() as session:
+            user = get_user_by_todoist_id(session=session, todoist_id=todoist_id)
+            cached_user = user_directory.put(user) if user else None
+    return cached_user
+
+
+def refresh_cached_user(email: str) -> CachedUser | None:
+    # picks up rows written by the other process, e.g. a refreshed todoist token
+    with get_session() as session:
+        user = get_user_by_email(session=session, email=email)
+        return user_directory.put(user) if user else None
+
+
+def get_pending_signup(session: Session, discord_id: int) -> PendingSignup | None:
+    return session.execute(
+        select(PendingSignup).where(PendingSignup.discord_id == discord_id)
+    ).scalar_one_or_none()
+
+
+def get_pending_signup_by_email(session: Session, email: str) -> PendingSignup | None:
+    # several discord users can type the same address, the earliest claim is
+    # linked and the others are told it's taken when their signup is checked
+    return (
+        session.execute(
+            select(PendingSignup)
+            .where(
+                PendingSignup.email == email,
+                PendingSignup.state == SignupState.awaiting_authorization,
+            )
+            .order_by(PendingSignup.id)
+        )
+        .scalars()
+        .first()
+    )
+
+
+def get_pending_signups(session: Session) -> Sequence[PendingSignup]:
+    return session.execute(select(PendingSignup)).scalars().all()
+
+
+def save_pending_signup(
+    session: Session,
+    discord_id: int,
+    state: str,
+    email: str | None,
+    expires_at: datetime,
+) -> None:
+    pending_signup = get_pending_signup(session=session, discord_id=discord_id)
+    if pending_signup is None:
+        pending_signup = PendingSignup(discord_id=discord_id)
+        session.add(pending_signup)
+
+    pending_signup.state = state
+    pending_signup.email = email
+    pending_signup.expires_at = expires_at
+    session.commit()
+
+
+def delete_pending_signup(session: Session, discord_id: int) -> None:
+    session.execute(delete(PendingSignup).where(PendingSignup.discord_id == discord_id))
+    session.commit()
+
+
+def enqueue_outbox(
+    session: Session, entries: Iterable[OutboxEntry], now: datetime
+) -> None:
+    for entry in entries:
+        entry.next_attempt_at = now
+        session.add(entry)
+
+
+def get_due_outbox_user_ids(
+    session: Session, now: datetime, limit: int
+) -> Sequence[int]:
+    return (
+        session.execute(
+            select(OutboxEntry.user_id)
+            .where(OutboxEntry.failed_at.is_(None), OutboxEntry.next_attempt_at <= now)
+            .group_by(OutboxEntry.user_id)
+            .order_by(func.min(OutboxEntry.id))
+            .limit(limit)
+        )
+        .scalars()
+        .all()
+    )
+
+
+def get_due_outbox_entries(
+    session: Session, user_id: int, now: datetime, limit: int
+) -> Sequence[OutboxEntry]:
+    # oldest first, so an add and a later remove on the same task apply in order
+    return (
+        session.execute(
+            select(OutboxEntry)
+            .where(
+                OutboxEntry.user_id == user_id,
+                OutboxEntry.failed_at.is_(None),
+                OutboxEntry.next_attempt_at <= now,
+            )
+            .order_by(OutboxEntry.id)
+            .limit(limit)
+        )
+        .scalars()
+        .all()
+    )
+
+
+def complete_outbox_entries(session: Session, entry_ids: Sequence[int]) -> None:
+    if entry_ids:
+        session.execute(delete(OutboxEntry).where(OutboxEntry.id.in_(entry_ids)))
+    session.commit()
+
+
+def retry_outbox_entries(
+    session: Session,
+    failures: Sequence[tuple[OutboxEntry, str]],
+    now: datetime,
+    max_attempts: int,
+) -> None:
+    if failures:
+        session.execute(
+            update(OutboxEntry),
+            [
+                {
+                    "id": entry.id,
+                    "attempts": entry.attempts + 1,
+                    "last_error": error,
+                    "next_attempt_at": now
+                    + min(
+                        OUTBOX_RETRY_BACKOFF * 2**entry.attempts,
+                        OUTBOX_MAX_RETRY_BACKOFF,
+                    ),
+                    "failed_at": now if entry.attempts + 1 >= max_attempts else None,
+                }
+                for entry, error in failures
+            ],
+        )
+    session.commit()
+
+
+def count_pending_outbox(session: Session) -> int:
+    return session.execute(
+        select(func.count())
+        .select_from(OutboxEntry)
+        .where(OutboxEntry.failed_at.is_(None))
+    ).scalar_one()
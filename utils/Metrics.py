@@ -0,0 +1,182 @@
+import math
+import threading
+from collections.abc import Sequence
+from pathlib import Path
+
+METRICS_DIRECTORY = Path(__file__).parent.parent / "data" / "metrics"
+DEFAULT_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10)
+
+LabelValues = tuple[str, ...]
+
+
+def format_value(value: float) -> str:
+    if math.isinf(value):
+        return "+Inf" if value > 0 else "-Inf"
+    return repr(float(value)) if not float(value).is_integer() else str(int(value))
+
+
+def format_labels(names: Sequence[str], values: Sequence[str]) -> str:
+    if not names:
+        return ""
+    escaped = (
+        value.replace("\\", "\\\\").replace("\n", "\\n").replace('"', '\\"')
+        for value in values
+    )
+    return (
+        "{"
+        + ",".join(
+            f'{name}="{value}"' for name, value in zip(names, escaped, strict=True)
+        )
+        + "}"
+    )
+
+
+class Metric:
+    metric_type = "untyped"
+
+    def __init__(
+        self, name: str, documentation: str, label_names: Sequence[str] = ()
+    ) -> None:
+        self.name = name
+        self.documentation = documentation
+        self.label_names = tuple(label_names)
+        self._lock = threading.Lock()
+        registry.register(self)
+
+    def label_values(self, labels: dict[str, str]) -> LabelValues:
+        return tuple(str(labels[name]) for name in self.label_names)
+
+    def samples(self) -> list[str]:
+        raise NotImplementedError
+
+    def render(self) -> str:
+        return "\n".join(
+            [
+                f"# HELP {self.name} {self.documentation}",
+                f"# TYPE {self.name} {self.metric_type}",
+                *self.samples(),
+            ]
+        )
+
+
+class Counter(Metric):
+    metric_type = "counter"
+
+    def __init__(
+        self, name: str, documentation: str, label_names: Sequence[str] = ()
+    ) -> None:
+        self._values: dict[LabelValues, float] = {}
+        super().__init__(name, documentation, label_names)
+
+    def inc(self, amount: float = 1, **labels: str) -> None:
+        key = self.label_values(labels)
+        with self._lock:
+            self._values[key] = self._values.get(key, 0) + amount
+
+    def samples(self) -> list[str]:
+        with self._lock:
+            values = list(self._values.items())
+        return [
+            f"{self.name}{format_labels(self.label_names, key)} {format_value(value)}"
+            for key, value in values
+        ]
+
+
+class Gauge(Counter):
+    metric_type = "gauge"
+
+    def set(self, value: float, **labels: str) -> None:
+        key = self.label_values(labels)
+        with self._lock:
+            self._values[key] = value
+
+    def dec(self, amount: float = 1, **labels: str) -> None:
+        self.inc(-amount, **labels)
+
+
+class Histogram(Metric):
+    metric_type = "histogram"
+
+    def __init__(
+        self,
+        name: str,
+        documentation: str,
+        label_names: Sequence[str] = (),
+        buckets: Sequence[float] = DEFAULT_BUCKETS,
+    ) -> None:
+        self.buckets = (*sorted(buckets), math.inf)
+        # per label set: bucket counts (not cumulative), sum, count
+        self._values: dict[LabelValues, tuple[list[int], list[float]]] = {}
+        super().__init__(name, documentation, label_names)
+
+    def observe(self, value: float, **labels: str) -> None:
+        key = self.label_values(labels)
+        index = next(
+            index for index, bound in enumerate(self.buckets) if value <= bound
+        )
+        with self._lock:
+            counts, totals = self._values.setdefault(
+                key, ([0] * len(self.buckets), [0.0, 0])
+            )
+            counts[index] += 1
+            totals[0] += value
+            totals[1] += 1
+
+    def samples(self) -> list[str]:
+        with self._lock:
+            values = [
+                (key, list(counts), list(totals))
+                for key, (counts, totals) in self._values.items()
+            ]
+
+        samples = []
+        bucket_label_names = (*self.label_names, "le")
+        for key, counts, (total, count) in values:
+            cumulative = 0
+            for bound, bucket_count in zip(self.buckets, counts, strict=True):
+                cumulative += bucket_count
+                labels = format_labels(bucket_label_names, (*key, format_value(bound)))
+                samples.append(f"{self.name}_bucket{labels} {cumulative}")
+            labels = format_labels(self.label_names, key)
+            samples.extend(
+                (
+                    f"{self.name}_sum{labels} {format_value(total)}",
+                    f"{self.name}_count{labels} {format_value(count)}",
+                )
+            )
+        return samples
+
+
+class Registry:
+    def __init__(self) -> None:
+        self.metrics: dict[str, Metric] = {}
+
+    def register(self, metric: Metric) -> None:
+        if metric.name in self.metrics:
+            raise ValueError(f"Metric already registered: {metric.name}")
+        self.metrics[metric.name] = metric
+
+    def render(self) -> str:
+        return "".join(f"{metric.render()}\n" for metric in self.metrics.values())
+
+
+registry = Registry()
+
+
+def write_snapshot(name: str) -> None:
+    # the bot and the webhook server are separate processes, the bot publishes its
+    # metrics as a text file that the server's /metrics endpoint includes
+    METRICS_DIRECTORY.mkdir(parents=True, exist_ok=True)
+    snapshot_path = METRICS_DIRECTORY / f"{name}.prom"
+    temporary_path = snapshot_path.with_suffix(".tmp")
+    temporary_path.write_text(registry.render(), encoding="utf-8")
+    temporary_path.replace(snapshot_path)
+
+
+def read_snapshots() -> str:
+    if not METRICS_DIRECTORY.exists():
+        return ""
+    return "".join(
+        snapshot_path.read_text(encoding="utf-8")
+        for snapshot_path in sorted(METRICS_DIRECTORY.glob("*.prom"))
+    )
@@ -0,0 +1,177 @@
+import logging
+import time
+from collections.abc import Callable, Iterator, Mapping, Sequence
+from typing import Any
+
+import sqlalchemy as sa
+from sqlalchemy.engine import Connection, Row, RowMapping
+
+# a child of the alembic logger, which alembic.ini already shows at INFO
+logger = logging.getLogger("alembic.migrations")
+
+BATCH_SIZE = 10_000
+PROGRESS_INTERVAL = 5.0
+# rowid and integer primary keys are 64 bit signed
+MIN_KEY = -(2**63)
+
+# the helpers build sql from table and column names written in the migration,
+# never from data, so the string formatting below is safe to inline
+
+
+class Progress:
+    def __init__(
+        self, label: str, total: int, interval: float = PROGRESS_INTERVAL
+    ) -> None:
+        self.label = label
+        self.total = total
+        self.interval = interval
+        self.done = 0
+        self.started = time.perf_counter()
+        self.reported = self.started
+        # longest single batch, which is how long other writers wait on the lock
+        self.longest_batch = 0.0
+
+    def advance(self, rows: int, batch_time: float) -> None:
+        self.done += rows
+        self.longest_batch = max(self.longest_batch, batch_time)
+        now = time.perf_counter()
+        if now - self.reported >= self.interval:
+            self.reported = now
+            logger.info(
+                "%s: %d/%d rows (%.0f%%), %.0f rows/s",
+                self.label,
+                self.done,
+                self.total,
+                self.done / max(self.total, 1) * 100,
+                self.done / (now - self.started),
+            )
+
+    def finish(self) -> None:
+        elapsed = time.perf_counter() - self.started
+        logger.info(
+            "%s: %d rows in %.1fs, longest batch %.3fs",
+            self.label,
+            self.done,
+            elapsed,
+            self.longest_batch,
+        )
+
+
+def count_rows(connection: Connection, table: str, where: str | None = None) -> int:
+    query = f"SELECT count(*) FROM {table}"  # noqa: S608
+    if where:
+        query += f" WHERE {where}"
+    return connection.execute(sa.text(query)).scalar_one()
+
+
+def copy_rows(  # noqa: PLR0913
+    connection: Connection,
+    source: str,
+    target: str,
+    columns: Sequence[str],
+    *,
+    select: Sequence[str] | None = None,
+    key: str = "rowid",
+    where: str | None = None,
+    batch_size: int = BATCH_SIZE,
+) -> Progress:
+    # INSERT ... SELECT in key ranges of batch_size rows, no rows pass through
+    # python. select holds sql expressions for each target column and defaults
+    # to the same column names. run it inside op.get_context().autocommit_block()
+    # so every batch is its own short transaction instead of one long one
+    select = select or columns
+    filters = f" AND ({where})" if where else ""
+    upper_bound = sa.text(
+        f"SELECT {key} FROM {source} WHERE {key} > :after{filters}"  # noqa: S608
+        f" ORDER BY {key} LIMIT 1 OFFSET :offset"
+    )
+    last_key = sa.text(f"SELECT max({key}) FROM {source} WHERE {key} > :after")  # noqa: S608
+    insert = sa.text(
+        f"INSERT INTO {target} ({', '.join(columns)})"  # noqa: S608
+        f" SELECT {', '.join(select)} FROM {source}"
+        f" WHERE {key} > :after AND {key} <= :upper{filters} ORDER BY {key}"
+    )
+
+    progress = Progress(
+        f"copy {source} -> {target}", count_rows(connection, source, where)
+    )
+    after = MIN_KEY
+    while True:
+        started = time.perf_counter()
+        upper = connection.execute(
+            upper_bound, {"after": after, "offset": batch_size - 1}
+        ).scalar()
+        if upper is None:
+            # the last batch is shorter than batch_size
+            upper = connection.execute(last_key, {"after": after}).scalar()
+            if upper is None:
+                break
+        result = connection.execute(insert, {"after": after, "upper": upper})
+        progress.advance(result.rowcount, time.perf_counter() - started)
+        after = upper
+
+    progress.finish()
+    return progress
+
+
+def stream_rows(
+    connection: Connection,
+    source: str,
+    columns: Sequence[str],
+    *,
+    key: str = "rowid",
+    batch_size: int = BATCH_SIZE,
+) -> Iterator[Sequence[Row[Any]]]:
+    # keyset pagination on an integer key, memory stays at one batch however big
+    # the table is. the key is selected first and isn't part of columns
+    query = sa.text(
+        f"SELECT {key}, {', '.join(columns)} FROM {source}"  # noqa: S608
+        f" WHERE {key} > :after ORDER BY {key} LIMIT :limit"
+    )
+    after = MIN_KEY
+    while True:
+        rows = connection.execute(query, {"after": after, "limit": batch_size}).all()
+        if not rows:
+            return
+        yield rows
+        after = rows[-1][0]
+
+
+def transform_rows(  # noqa: PLR0913
+    connection: Connection,
+    source: str,
+    target: sa.Table,
+    columns: Sequence[str],
+    transform: Callable[[RowMapping], Mapping[str, Any]],
+    *,
+    key: str = "rowid",
+    batch_size: int = BATCH_SIZE,
+) -> Progress:
+    # for changes INSERT ... SELECT can't express, rows are read and written one
+    # batch at a time through transform. like copy_rows, run it inside
+    # op.get_context().autocommit_block() so every batch commits
+    progress = Progress(
+        f"transform {source} -> {target.name}", count_rows(connection, source)
+    )
+    started = time.perf_counter()
+    for rows in stream_rows(
+        connection, source, columns, key=key, batch_size=batch_size
+    ):
+        # in autocommit mode sqlite would commit every row of the executemany on
+        # its own, a savepoint makes the batch one transaction either way
+        connection.exec_driver_sql("SAVEPOINT migration_batch")
+        try:
+            connection.execute(
+                sa.insert(target),
+                [transform(row._mapping) for row in rows],  # noqa: SLF001
+            )
+        except Exception:
+            connection.exec_driver_sql("ROLLBACK TO migration_batch")
+            connection.exec_driver_sql("RELEASE migration_batch")
+            raise
+        connection.exec_driver_sql("RELEASE migration_batch")
+        progress.advance(len(rows), time.perf_counter() - started)
+        started = time.perf_counter()
+
+    progress.finish()
+    return progress
@@ -0,0 +1,264 @@
+import contextlib
+import cProfile
+import importlib
+import json
+import logging
+import operator
+import tracemalloc
+from collections import defaultdict
+from collections.abc import Generator
+from contextlib import contextmanager
+from dataclasses import asdict, dataclass, field
+from datetime import UTC, datetime
+from pathlib import Path
+from time import perf_counter
+from typing import Any
+
+logger = logging.getLogger(__name__)
+
+RUN_REPORT_DIRECTORY = Path("log")
+RUN_REPORT_LIMIT = 30
+SLOWEST_USER_LIMIT = 10
+TOP_ALLOCATOR_LIMIT = 10
+TRACEMALLOC_FRAMES = 5
+# allocations made while taking snapshots would otherwise top every list
+trace_filters = [
+    tracemalloc.Filter(inclusive=False, filename_pattern=tracemalloc.__file__),
+    tracemalloc.Filter(
+        inclusive=False, filename_pattern="<frozen importlib._bootstrap>"
+    ),
+    tracemalloc.Filter(inclusive=False, filename_pattern="<unknown>"),
+]
+
+# highest traced heap seen before a phase reset tracemalloc's peak
+_heap_peak = 0
+
+
+@dataclass
+class MemoryAllocator:
+    location: str
+    size_bytes: int
+    count: int
+
+
+@dataclass
+class MemoryPhase:
+    name: str
+    traced: bool = False
+    # relative to the traced heap when the phase started
+    peak_bytes: int = 0
+    retained_bytes: int = 0
+    top_allocators: list[MemoryAllocator] = field(default_factory=list)
+
+
+def heap_peak() -> int:
+    # tracemalloc's own peak is reset by every phase
+    return max(_heap_peak, tracemalloc.get_traced_memory()[1])
+
+
+def exclude_from_traces(filename_pattern: str) -> None:
+    # drops allocations with any frame in the matching files from phase snapshots,
+    # the benchmarks use it for their in-process fake servers
+    trace_filters.append(
+        tracemalloc.Filter(
+            inclusive=False, filename_pattern=filename_pattern, all_frames=True
+        )
+    )
+
+
+@contextmanager
+def trace_memory(name: str) -> Generator[MemoryPhase]:
+    # a no-op unless tracemalloc is tracing. the peak is process wide, so phases
+    # running concurrently, like threaded webhooks, are counted in each other.
+    # tracing can also be stopped mid-phase by a config reload, the phase is then
+    # left untraced rather than failing the code it wraps
+    global _heap_peak  # noqa: PLW0603
+    phase = MemoryPhase(name)
+    try:
+        before = tracemalloc.take_snapshot().filter_traces(trace_filters)
+    except RuntimeError:
+        yield phase
+        return
+
+    start_size, peak = tracemalloc.get_traced_memory()
+    _heap_peak = max(_heap_peak, peak)
+    tracemalloc.reset_peak()
+    try:
+        yield phase
+    finally:
+        with contextlib.suppress(RuntimeError):
+            current, peak = tracemalloc.get_traced_memory()
+            after = tracemalloc.take_snapshot().filter_traces(trace_filters)
+            _heap_peak = max(_heap_peak, peak)
+            phase.traced = True
+            phase.peak_bytes = peak - start_size
+            phase.retained_bytes = current - start_size
+            phase.top_allocators = [
+                MemoryAllocator(
+                    str(statistic.traceback[0]),
+                    statistic.size_diff,
+                    statistic.count_diff,
+                )
+                for statistic in after.compare_to(before, "lineno")[
+                    :TOP_ALLOCATOR_LIMIT
+                ]
+            ]
+
+
+class RunReport:
+    def __init__(self, name: str) -> None:
+        self.name = name
+        self.started_at = datetime.now(UTC)
+        self._start = perf_counter()
+        self.wall_time: float | None = None
+        self.stages: defaultdict[str, float] = defaultdict(float)
+        self.users: defaultdict[str, defaultdict[str, float]] = defaultdict(
+            lambda: defaultdict(float)
+        )
+        self.memory: list[MemoryPhase] = []
+        self.heap_peak = 0
+
+    def path(self, suffix: str, directory: Path = RUN_REPORT_DIRECTORY) -> Path:
+        return directory / f"{self.name}-{self.started_at:%Y%m%dT%H%M%SZ}{suffix}"
+
+    @contextmanager
+    def span(self, stage: str, user: str | None = None) -> Generator[None]:
+        start = perf_counter()
+        try:
+            yield
+        finally:
+            elapsed = perf_counter() - start
+            self.stages[stage] += elapsed
+            if user is not None:
+                self.users[user][stage] += elapsed
+
+    @contextmanager
+    def phase(self, name: str) -> Generator[None]:
+        # memory is only recorded while tracemalloc is tracing, see profile()
+        with trace_memory(name) as memory_phase:
+            yield
+        if memory_phase.traced:
+            self.memory.append(memory_phase)
+            self.heap_peak = max(self.heap_peak, heap_peak())
+
+    def finish(self) -> None:
+        self.wall_time = perf_counter() - self._start
+
+    def to_dict(self) -> dict[str, Any]:
+        wall_time = self.wall_time or perf_counter() - self._start
+        # users are processed one after another, so every span is on the critical path
+        # and whatever the spans don't cover is reported as untracked
+        critical_path = {
+            stage: {
+                "seconds": round(seconds, 4),
+                "share": round(seconds / wall_time, 4),
+            }
+            for stage, seconds in sorted(
+                self.stages.items(), key=operator.itemgetter(1), reverse=True
+            )
+        }
+        untracked = max(wall_time - sum(self.stages.values()), 0)
+        critical_path["untracked"] = {
+            "seconds": round(untracked, 4),
+            "share": round(untracked / wall_time, 4),
+        }
+
+        slowest_users = sorted(
+            self.users.items(), key=lambda item: sum(item[1].values()), reverse=True
+        )[:SLOWEST_USER_LIMIT]
+        report: dict[str, Any] = {
+            "name": self.name,
+            "started_at": self.started_at.isoformat(),
+            "wall_time": round(wall_time, 4),
+            "user_count": len(self.users),
+            "critical_path": critical_path,
+            "slowest_users": [
+                {
+                    "user": user,
+                    "seconds": round(sum(stages.values()), 4),
+                    "stages": {
+                        stage: round(seconds, 4) for stage, seconds in stages.items()
+                    },
+                }
+                for user, stages in slowest_users
+            ],
+        }
+        if self.memory:
+            # the peak is since tracing started, so it includes what earlier phases
+            # still hold. phase numbers are each phase's own growth
+            report["memory"] = {
+                "peak_bytes": self.heap_peak,
+                "peak_bytes_per_user": round(self.heap_peak / max(len(self.users), 1)),
+                "phases": [asdict(phase) for phase in self.memory],
+            }
+        return report
+
+    def write(self, directory: Path = RUN_REPORT_DIRECTORY) -> Path:
+        directory.mkdir(parents=True, exist_ok=True)
+        report_path = self.path(".json", directory)
+        report_path.write_text(json.dumps(self.to_dict(), indent=2), encoding="utf-8")
+
+        for old_path in sorted(directory.glob(f"{self.name}-*.json"))[
+            :-RUN_REPORT_LIMIT
+        ]:
+            old_path.unlink()
+        return report_path
+
+
+@contextmanager
+def profile(profiler: str, output_path: Path) -> Generator[None]:
+    global _heap_peak  # noqa: PLW0603
+    if profiler == "tracemalloc":
+        # the heap left at the end is saved with Snapshot.dump, read it with
+        # tracemalloc.Snapshot.load. run report phases record peaks while tracing
+        output_path.parent.mkdir(parents=True, exist_ok=True)
+        started = not tracemalloc.is_tracing()
+        if started:
+            _heap_peak = 0
+            tracemalloc.start(TRACEMALLOC_FRAMES)
+        try:
+            yield
+        finally:
+            tracemalloc.take_snapshot().filter_traces(trace_filters).dump(
+                str(output_path)
+            )
+            if started:
+                tracemalloc.stop()
+            logger.info("Saved memory snapshot to %s", output_path)
+        return
+
+    # stats are saved in pstats format, read them with `python -m pstats <file>`
+    if profiler == "cprofile":
+        output_path.parent.mkdir(parents=True, exist_ok=True)
+        cprofile = cProfile.Profile()
+        cprofile.enable()
+        try:
+            yield
+        finally:
+            cprofile.disable()
+            cprofile.dump_stats(output_path)
+            logger.info("Saved profile to %s", output_path)
+        return
+
+    if profiler == "yappi":
+        try:
+            # yappi is optional, it profiles by wall time across coroutine switches
+            yappi = importlib.import_module("yappi")
+        except ImportError:
+            logger.warning("yappi is not installed, skipping profile")
+        else:
+            output_path.parent.mkdir(parents=True, exist_ok=True)
+            yappi.set_clock_type("wall")
+            yappi.clear_stats()
+            yappi.start()
+            try:
+                yield
+            finally:
+                yappi.stop()
+                yappi.get_func_stats().save(str(output_path), type="pstat")
+                logger.info("Saved profile to %s", output_path)
+            return
+    elif profiler != "none":
+        logger.warning("Unknown profiler %s, skipping profile", profiler)
+
+    yield
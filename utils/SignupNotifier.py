@@ -0,0 +1,76 @@
+import asyncio
+import logging
+import socket
+from collections.abc import Callable, Coroutine
+from typing import Any
+
+from utils.Config import load_config
+
+logger = logging.getLogger(__name__)
+
+NOTIFY_TIMEOUT = 1
+
+AuthorizationHandler = Callable[[str], Coroutine[Any, Any, None]]
+
+_handler: AuthorizationHandler | None = None
+_loop: asyncio.AbstractEventLoop | None = None
+_server: asyncio.Server | None = None
+
+
+def notify_authorized(email: str) -> None:
+    # called from the /auth handler once the todoist account has been stored
+    if _handler is not None and _loop is not None and _loop.is_running():
+        asyncio.run_coroutine_threadsafe(_handler(email), _loop)
+        return
+
+    config = load_config().signup
+    try:
+        with socket.create_connection(
+            (config.notify_host, config.notify_port), timeout=NOTIFY_TIMEOUT
+        ) as connection:
+            connection.sendall(f"{email}\n".encode())
+    except OSError:
+        # bot isn't listening, the signup expiry check still picks the user up
+        logger.warning("Could not notify bot of authorization for %s", email)
+
+
+async def handle_connection(
+    reader: asyncio.StreamReader, writer: asyncio.StreamWriter
+) -> None:
+    try:
+        line = await asyncio.wait_for(reader.readline(), NOTIFY_TIMEOUT)
+        email = line.decode().strip()
+        if email and _handler is not None:
+            await _handler(email)
+    except Exception:
+        logger.exception("Error handling authorization notification")
+    finally:
+        writer.close()
+
+
+async def start_notification_server(handler: AuthorizationHandler) -> None:
+    global _handler, _loop, _server  # noqa: PLW0603
+    _handler = handler
+    _loop = asyncio.get_running_loop()
+
+    if _server is not None:
+        return
+
+    config = load_config().signup
+    _server = await asyncio.start_server(
+        handle_connection, config.notify_host, config.notify_port
+    )
+    logger.info(
+        "Listening for authorizations on %s:%d", config.notify_host, config.notify_port
+    )
+
+
+async def restart_notification_server() -> None:
+    # picks up a changed notify host or port without restarting the bot
+    global _server  # noqa: PLW0603
+    if _server is None or _handler is None:
+        return
+    _server.close()
+    await _server.wait_closed()
+    _server = None
+    await start_notification_server(_handler)
@@ -0,0 +1,42 @@
+import logging
+import os
+import time
+from pathlib import Path
+
+logger = logging.getLogger(__name__)
+
+
+def seconds_since_process_start() -> float | None:
+    # the first stage covers interpreter start and imports, which happen before any
+    # of our code can take a timestamp, so it is measured against the process start
+    try:
+        stat = Path(f"/proc/{os.getpid()}/stat").read_text(encoding="utf-8")
+    except OSError:
+        return None
+    start_ticks = int(stat.rsplit(")", 1)[1].split()[19])
+    uptime = time.clock_gettime(time.CLOCK_BOOTTIME)
+    return uptime - start_ticks / os.sysconf("SC_CLK_TCK")
+
+
+class StartupTimer:
+    def __init__(self) -> None:
+        since_start = seconds_since_process_start()
+        self._last = time.perf_counter() - (since_start or 0)
+        self.stages: dict[str, float] = {}
+
+    def mark(self, stage: str) -> None:
+        now = time.perf_counter()
+        self.stages[stage] = now - self._last
+        self._last = now
+
+    def report(self) -> None:
+        logger.info(
+            "Startup took %.2fs (%s)",
+            sum(self.stages.values()),
+            ", ".join(
+                f"{stage}: {elapsed:.2f}s" for stage, elapsed in self.stages.items()
+            ),
+        )
+
+
+startup_timer = StartupTimer()
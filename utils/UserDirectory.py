@@ -0,0 +1,116 @@
+import logging
+import threading
+from collections.abc import Hashable, Iterable
+from dataclasses import dataclass
+from typing import TYPE_CHECKING, TypeVar
+
+if TYPE_CHECKING:
+    from utils.Database import User
+
+logger = logging.getLogger(__name__)
+
+K = TypeVar("K", bound=Hashable)
+
+
+@dataclass(frozen=True, slots=True)
+class CachedUser:
+    id: int
+    email: str
+    discord_id: int | None
+    todoist_id: str
+    todoist_token: str
+
+    @classmethod
+    def from_user(cls, user: "User") -> "CachedUser":
+        return cls(
+            id=user.id,
+            email=user.email,
+            discord_id=user.discord_id,
+            todoist_id=user.todoist_id,
+            todoist_token=user.todoist_token,
+        )
+
+
+class UserDirectory:
+    def __init__(self) -> None:
+        # writers take the lock, readers rely on single dict lookups being atomic
+        self._lock = threading.Lock()
+        self._by_id: dict[int, CachedUser] = {}
+        self._by_email: dict[str, CachedUser] = {}
+        self._by_discord_id: dict[int, CachedUser] = {}
+        self._by_todoist_id: dict[str, CachedUser] = {}
+        self.hits = 0
+        self.misses = 0
+
+    def __len__(self) -> int:
+        return len(self._by_id)
+
+    def load(self, users: Iterable["User"]) -> None:
+        cached_users = [CachedUser.from_user(user) for user in users]
+        with self._lock:
+            self._by_id = {user.id: user for user in cached_users}
+            self._by_email = {user.email: user for user in cached_users}
+            self._by_discord_id = {
+                user.discord_id: user
+                for user in cached_users
+                if user.discord_id is not None
+            }
+            self._by_todoist_id = {user.todoist_id: user for user in cached_users}
+        logger.info("Loaded %d users into directory", len(cached_users))
+
+    def linked_discord_ids(self) -> list[int]:
+        return list(self._by_discord_id)
+
+    def is_linked(self, discord_id: int) -> bool:
+        # internal bookkeeping, not counted as a directory hit or miss
+        return discord_id in self._by_discord_id
+
+    def put(self, user: "User") -> CachedUser:
+        cached_user = CachedUser.from_user(user)
+        with self._lock:
+            self._put(cached_user)
+        return cached_user
+
+    def update(self, users: Iterable["User"]) -> None:
+        # refreshes the given users without dropping anyone else
+        cached_users = [CachedUser.from_user(user) for user in users]
+        with self._lock:
+            for cached_user in cached_users:
+                self._put(cached_user)
+
+    def _put(self, cached_user: CachedUser) -> None:
+        previous = self._by_id.get(cached_user.id)
+        if previous is not None:
+            self._by_email.pop(previous.email, None)
+            self._by_todoist_id.pop(previous.todoist_id, None)
+            if previous.discord_id is not None:
+                self._by_discord_id.pop(previous.discord_id, None)
+
+        self._by_id[cached_user.id] = cached_user
+        self._by_email[cached_user.email] = cached_user
+        self._by_todoist_id[cached_user.todoist_id] = cached_user
+        if cached_user.discord_id is not None:
+            self._by_discord_id[cached_user.discord_id] = cached_user
+
+    def _get(self, index: dict[K, CachedUser], key: K) -> CachedUser | None:
+        cached_user = index.get(key)
+        if cached_user is None:
+            self.misses += 1
+        else:
+            self.hits += 1
+        return cached_user
+
+    def get_by_id(self, user_id: int) -> CachedUser | None:
+        return self._get(self._by_id, user_id)
+
+    def get_by_email(self, email: str) -> CachedUser | None:
+        return self._get(self._by_email, email)
+
+    def get_by_discord_id(self, discord_id: int) -> CachedUser | None:
+        return self._get(self._by_discord_id, discord_id)
+
+    def get_by_todoist_id(self, todoist_id: str) -> CachedUser | None:
+        return self._get(self._by_todoist_id, todoist_id)
+
+
+user_directory = UserDirectory()